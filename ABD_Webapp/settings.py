@@ -117,6 +117,8 @@ DATABASES = {
         'PASSWORD': json_config["db_pwd"],
         'HOST': json_config["db_host"],
         'PORT': json_config["db_port"],
+        # persistent connections keep the tenant of the row level security, it is only set again if it changes
+        'CONN_MAX_AGE': json_config.get('db_conn_max_age', 0),
         'TEST': {
             "TEMPLATE": "template0"
         }
@@ -131,6 +133,30 @@ DATABASES = {
     }
 }
 
+# Plots of the battery pages: compact plot data which the browser assembles to a figure, or complete plotly figures
+# rendered on the server with "plotly_figures" in config.json
+PLOTLY_FIGURES = json_config.get('plotly_figures', False)
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# The rendered figures of the battery pages are cached per process in memory (least recently used are evicted),
+# with "figure_cache_dir" in config.json they are stored in files which all processes share.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'figures': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache' if json_config.get('figure_cache_dir')
+        else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': json_config.get('figure_cache_dir', 'figures'),
+        'TIMEOUT': None,  # entries of old data versions are unreachable and evicted
+        'OPTIONS': {
+            'MAX_ENTRIES': json_config.get('figure_cache_entries', 500),
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -182,6 +208,12 @@ LOG_ROOT = (
     os.path.join(BASE_DIR, 'logs')
 )
 
+# the uploads are hashed while they are received (UploadFile.checksum)
+FILE_UPLOAD_HANDLERS = [
+    'abd_database.helpers.checksum.ChecksumMemoryFileUploadHandler',
+    'abd_database.helpers.checksum.ChecksumTemporaryFileUploadHandler',
+]
+
 if not os.path.exists(MEDIA_ROOT):
     os.makedirs(MEDIA_ROOT)
 if not os.path.exists(os.path.join(MEDIA_ROOT, 'uploadfiles')):
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ABD_Webapp.settings')
 
 application = get_wsgi_application()
+
+# extractor processes of the upload queue, only if they are not run with manage.py run_extractor_worker
+from jobqueue_manager.manager import start_queue  # noqa: E402
+start_queue()
@@ -122,4 +122,21 @@ class GraphDataSerializer(serializers.Serializer):
         pass
 
     def update(self, instance, validated_data):
-        pass
\ No newline at end of file
+        pass
+
+
+class UploadFileMetricsSerializer(serializers.ModelSerializer):
+
+    batch = serializers.IntegerField(source="batch_id", read_only=True)
+
+    class Meta:
+        model = UploadFile
+        fields = [
+            "id",
+            "batch",
+            "file_name",
+            "kb",
+            "status",
+            "time",
+            "metrics",
+        ]
@@ -6,4 +6,6 @@ urlpatterns = [
     path("type/", views.BatteryTypeAPIView.as_view(), name="battery_type"),
     # path("<str:ds>/", views.BatteryListByDatasetView.as_view(), name="battery_list_by_dataset"),
     path("battery/<str:pk>/", views.BatteryDetailAPIView.as_view(), name="battery_detail"),
+    path("upload/metrics/", views.UploadFileMetricsAPIView.as_view(), name="upload_file_metrics"),
+    path("upload/<int:pk>/metrics/", views.UploadFileMetricsDetailAPIView.as_view(), name="upload_file_metrics_detail"),
 ]
\ No newline at end of file
@@ -1,4 +1,5 @@
 from rest_framework.generics import ListAPIView
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from abd_database.models import (
@@ -180,3 +181,45 @@ class BatteryDetailAPIView(APIView):
     #     return reverse(
     #         viewname="abd_db:battery_detail", kwargs={"pk": self.kwargs["pk"]}
     #     )
+
+
+class UploadFileMetricsAPIView(ListAPIView):
+    """Metrics of the extraction stages of the last uploaded files of the user, optionally of one batch"""
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadFile.objects.filter(batch__user=self.request.user, metrics__isnull=False).order_by("-id")
+
+    def get(self, request):
+        try:
+            queryset = self.get_queryset()
+            batch = request.GET.get("batch")
+            if batch:
+                queryset = queryset.filter(batch_id=int(batch))
+            limit = int(request.GET.get("limit", 100))
+            serializer = serializers.UploadFileMetricsSerializer(queryset[:limit], many=True)
+            return Response(
+                {"data": serializer.data},
+                status=200,
+            )
+        except ValueError:
+            return Response({"error": "batch and limit have to be numbers"}, status=400)
+        except Exception as e:
+            return Response({"error": str(e)}, status=500)
+
+
+class UploadFileMetricsDetailAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        try:
+            upload_file = UploadFile.objects.get(pk=pk, batch__user=request.user)
+            serializer = serializers.UploadFileMetricsSerializer(upload_file)
+            return Response(
+                {"data": serializer.data},
+                status=200,
+            )
+        except UploadFile.DoesNotExist:
+            return Response({"error": "Upload file not found"}, status=404)
+        except Exception as e:
+            return Response({"error": str(e)}, status=500)
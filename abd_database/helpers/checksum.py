@@ -0,0 +1,55 @@
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # bytes passed to the upload handlers at once, django's default is 64 KB
+
+
+def new_checksum():
+    """BLAKE2b with a 128 bit digest, the 32 characters of UploadFile.checksum (UploadFile.ChecksumTypes.BLAKE2B)"""
+    return hashlib.blake2b(digest_size=16)
+
+
+def get_file_checksum(file):
+    """
+    Checksum of a file which was not hashed by an upload handler (e.g. a file created by a script)
+    @param file: django File
+    @return: hex digest
+    """
+    checksum = new_checksum()
+    for chunk in file.chunks(UPLOAD_CHUNK_SIZE):
+        checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class ChecksumMixin:
+    """
+    Hashes the chunks of an upload while they are received, the uploaded file gets the hex digest as attribute
+    checksum. The file does not have to be read again after the upload.
+    """
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def new_file(self, *args, **kwargs):
+        self.checksum = new_checksum()
+        # MemoryFileUploadHandler raises StopFutureHandlers if it keeps the file
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # the memory handler passes the chunks of large files on to the next handler
+        if getattr(self, 'activated', True):
+            self.checksum.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.checksum = self.checksum.hexdigest()
+        return file
+
+
+class ChecksumMemoryFileUploadHandler(ChecksumMixin, MemoryFileUploadHandler):
+    pass
+
+
+class ChecksumTemporaryFileUploadHandler(ChecksumMixin, TemporaryFileUploadHandler):
+    pass
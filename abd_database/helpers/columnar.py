@@ -0,0 +1,107 @@
+import io
+
+from django.contrib.postgres.fields import ArrayField
+from django.db import models
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only the arrow and parquet exports need it
+    pa = pq = None
+
+# format -> (content type, file extension)
+COLUMNAR_FORMATS = {
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+PARQUET_COMPRESSION = 'zstd'
+
+
+def is_available():
+    return pa is not None
+
+
+def get_arrow_type(field):
+    if isinstance(field, ArrayField):
+        return pa.list_(get_arrow_type(field.base_field))
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.FloatField):
+        return pa.float64()
+    if isinstance(field, models.ForeignKey):
+        return get_arrow_type(field.target_field)
+    if isinstance(field, (models.BigIntegerField, models.BigAutoField)):
+        return pa.int64()
+    if isinstance(field, (models.IntegerField, models.AutoField)):
+        return pa.int32()
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    return pa.string()
+
+
+def get_schema(model, field_list, units=None):
+    """
+    Typed columns for the fields of the model, the units are kept in the metadata of the columns
+    @param field_list: names of the fields in the order of the query
+    @param units: unit of every field, '' for none
+    """
+    units = units or [''] * len(field_list)
+    return pa.schema([pa.field(name, get_arrow_type(model._meta.get_field(name)),
+                               metadata={'unit': unit} if unit else None)
+                      for name, unit in zip(field_list, units)])
+
+
+def to_record_batch(rows, schema):
+    """Converts query rows (tuples in the order of the schema) to a record batch"""
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    return pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                           schema=schema)
+
+
+class StreamSink(io.RawIOBase):
+    """Write-only file which hands out the bytes written so far, but keeps the position for the parquet footer"""
+
+    def __init__(self):
+        super().__init__()
+        self.pieces = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.pieces.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def pop(self):
+        data = b''.join(self.pieces)
+        self.pieces = []
+        return data
+
+
+def stream_columnar(chunks, schema, file_format):
+    """
+    Writes chunks of rows (e.g. from iterate_query) as arrow ipc stream or parquet file, every chunk is one record
+    batch or row group, the written bytes are yielded after each chunk
+    @param file_format: key of COLUMNAR_FORMATS
+    """
+    sink = StreamSink()
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression=PARQUET_COMPRESSION)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    for rows in chunks:
+        writer.write_batch(to_record_batch(rows, schema))
+        yield sink.pop()
+    writer.close()
+    yield sink.pop()
+
+
+def render_columnar(rows, schema, file_format):
+    """@return: all rows in one piece"""
+    return b''.join(stream_columnar([rows], schema, file_format))
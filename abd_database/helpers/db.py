@@ -1,7 +1,122 @@
-from django.db import connection
+import hashlib
+import re
+from contextlib import contextmanager
 
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
 
-def set_active_tenant(active_tenant=None) -> None:
-    with connection.cursor() as cursor:
-        cursor.execute(f"SET abd.active_tenant = {active_tenant}")
-        cursor.execute(f"SET abd.change_owner_battid = {None}")
+ITERATE_CHUNK_ROWS = 10000  # rows fetched per round trip from a server-side cursor
+MAX_PREPARED_STATEMENTS = 100  # per connection, all are deallocated when exceeded
+
+
+def set_active_tenant(active_tenant=None, using=DEFAULT_DB_ALIAS) -> None:
+    """
+    Sets the tenant of the row level security policies for the session and resets the owner change. Skipped if the
+    connection already carries the tenant, e.g. a persistent connection (CONN_MAX_AGE) of the previous request of
+    the same organisation.
+    @param active_tenant: primary key of the organisation, None for anonymous users (only public data)
+    """
+    db = connections[using]
+    value = str(active_tenant)
+    db.ensure_connection()
+    if getattr(db, 'rls_session', None) == (db.connection, value):
+        return
+    with db.cursor() as cursor:
+        cursor.execute("SELECT set_config('abd.active_tenant', %s, false), "
+                       "set_config('abd.change_owner_battid', 'None', false)", [value])
+    # a setting made in a transaction is reverted by its rollback, so it is only remembered in autocommit mode
+    db.rls_session = None if db.in_atomic_block else (db.connection, value)
+
+
+@contextmanager
+def change_owner(object_id, using=DEFAULT_DB_ALIAS):
+    """
+    Lets the policies accept the owner change of the battery or dataset with this id until the block ends
+    """
+    db = connections[using]
+    with db.cursor() as cursor:
+        # the next set_active_tenant sets the session again, also if the reset below is not reached
+        db.rls_session = None
+        cursor.execute("SELECT set_config('abd.change_owner_battid', %s, false)", [str(object_id)])
+        yield
+        cursor.execute("SELECT set_config('abd.change_owner_battid', 'None', false)")
+
+
+def get_invalid_columns(model, columns):
+    """
+    @param columns: column names, e.g. of a field list of the API
+    @return: the names which are no column of the table of the model (attname, e.g. agg_data_id), in their order
+    """
+    names = {field.attname for field in model._meta.concrete_fields}
+    return [column for column in columns if column not in names]
+
+
+def quote_columns(model, columns):
+    """
+    Qualified identifiers of columns of the table of the model, to be formatted into SQL. The names are checked
+    against the columns of the model first, a field list of the API never reaches the SQL unchecked.
+    @raise ValueError: if a name is no column of the table
+    """
+    invalid = get_invalid_columns(model, columns)
+    if invalid:
+        raise ValueError(f'unknown column(s) of {model._meta.db_table}: {", ".join(invalid)}')
+    return [f'"{model._meta.db_table}"."{column}"' for column in columns]
+
+
+def iterate_query(sql, params=None, using=DEFAULT_DB_ALIAS, chunk_rows=ITERATE_CHUNK_ROWS):
+    """
+    Runs the query with a server-side (named) cursor and yields the result as lists of at most chunk_rows rows,
+    so the client never holds more than one chunk. The query is only executed when the iteration starts.
+    """
+    # in a transaction the cursor is not declared WITH HOLD, which would make the server compute the whole result
+    # before returning the first row
+    with transaction.atomic(using=using), connections[using].chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+
+
+def to_positional(sql):
+    """Converts the %s placeholders of a query to the $1, $2, ... parameters of PREPARE"""
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub(r'%[s%]', lambda match: f'${next(counter)}' if match.group() == '%s' else '%', sql)
+
+
+def prepare(cursor, sql):
+    """
+    Prepares the query once per connection. The statements are named after the query text, so queries built from
+    field lists are prepared once per field list. A new connection (e.g. after the user switch of a request) starts
+    without prepared statements.
+    @param cursor: django cursor
+    @param sql: query with %s placeholders
+    @return: name of the prepared statement
+    """
+    db = cursor.db
+    if getattr(db, 'prepared_statements', (None,))[0] is not db.connection:
+        db.prepared_statements = (db.connection, set())
+    prepared = db.prepared_statements[1]
+
+    name = 'abd_' + hashlib.sha1(sql.encode()).hexdigest()[:20]
+    if name not in prepared:
+        if len(prepared) >= MAX_PREPARED_STATEMENTS:
+            cursor.execute('DEALLOCATE ALL')
+            prepared.clear()
+        cursor.execute(f'PREPARE {name} AS {to_positional(sql)}')
+        prepared.add(name)
+    return name
+
+
+def execute_prepared(cursor, sql, params=()):
+    """
+    Runs the query as server-side prepared statement: it is parsed and planned once per connection (PostgreSQL
+    switches to a generic plan after five executions if it is not more expensive than the custom plans), later
+    calls only send EXECUTE with the parameters.
+    @param sql: query with %s placeholders, lists are passed to = ANY(%s)
+    """
+    name = prepare(cursor, sql)
+    if params:
+        cursor.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(params))})', params)
+    else:
+        cursor.execute(f'EXECUTE {name}')
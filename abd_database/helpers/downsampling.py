@@ -0,0 +1,43 @@
+import numpy as np
+
+PLOT_MAX_POINTS = 2000  # points per trace of the raw data plots
+
+
+def min_max_indices(y, max_points, groups=None):
+    """
+    Per-bucket min/max downsampling: the rows are split into max_points / 2 buckets of consecutive rows and the rows
+    with the minimal and maximal y of every bucket are kept, plus the first and last row. Unlike taking every n-th
+    row, peaks and steps of the curve are never lost.
+    @param y: values the extremes are taken of, in the order of the plot
+    @param max_points: number of points to keep, of every group if grouped
+    @param groups: group of every row (e.g. the cycle), the rows of a group must be consecutive
+    @return: sorted indices of the kept rows, all rows of groups with at most max_points rows
+    """
+    y = np.asarray(y, dtype=float)
+    nbr_of_rows = len(y)
+    if nbr_of_rows == 0:
+        return np.arange(0)
+    if groups is None:
+        starts = np.array([0])
+    else:
+        groups = np.asarray(groups)
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    sizes = np.diff(np.r_[starts, nbr_of_rows])
+    group = np.repeat(np.arange(len(starts)), sizes)
+    position = np.arange(nbr_of_rows) - starts[group]
+    size = sizes[group]
+    nbr_of_buckets = np.where(size <= max_points, size, max(max_points // 2, 1))
+    bucket = group.astype(np.int64) * max(max_points, 1) + position * nbr_of_buckets // size
+
+    order = np.lexsort((y, bucket))
+    new_bucket = np.r_[True, bucket[order][1:] != bucket[order][:-1]]
+    minima = order[new_bucket]
+    maxima = order[np.r_[new_bucket[1:], True]]
+    return np.unique(np.concatenate([minima, maxima, starts, starts + sizes - 1]))
+
+
+def downsample(df, y, max_points):
+    """@return: rows of the data frame kept by min_max_indices of column y, all rows if max_points is None"""
+    if max_points is None or len(df) <= max_points:
+        return df
+    return df.iloc[min_max_indices(df[y].to_numpy(), max_points)]
@@ -0,0 +1,43 @@
+import hashlib
+
+from django.apps import apps
+from django.core.cache import caches
+
+FIGURE_CACHE = 'figures'  # alias in settings.CACHES
+
+
+def get_data_version(battery_ids):
+    """
+    Version of the data of the batteries: the update times of their summaries, which are refreshed in the
+    transaction of every extraction (save_summaries of all extractors, HDF5 uploads included) and by the pre_delete
+    signal of the cell tests. The version is read from the
+    database, so every process (web server, extractor workers) sees the change, also with a local memory cache.
+    @return: version string, None if a battery has no summary (its figures are not cached)
+    """
+    BatterySummary = apps.get_model('abd_database', 'BatterySummary')
+    battery_ids = set(battery_ids)
+    updated = dict(BatterySummary.objects.filter(battery_id__in=battery_ids).values_list('battery_id', 'updated'))
+    if not battery_ids or updated.keys() != battery_ids:
+        return None
+    return ','.join(f'{battery_id}@{updated[battery_id].timestamp()}' for battery_id in sorted(battery_ids))
+
+
+def get_figure(name, key, version, render):
+    """
+    Figure from the cache or rendered and cached. A new data version makes the old entries unreachable, they are
+    evicted by the cache backend (LRU of the local memory cache).
+    @param name: name of the plot
+    @param key: what the figure shows, e.g. primary key of the cycling test
+    @param version: data version of get_data_version, None to skip the cache
+    @param render: function which builds the figure (json string)
+    """
+    if version is None:
+        return render()
+    cache = caches[FIGURE_CACHE]
+    cache_key = f'{name}:' + hashlib.sha1(f'{key}|{version}'.encode()).hexdigest()
+    figure = cache.get(cache_key)
+    if figure is None:
+        figure = render()
+        if figure is not None:
+            cache.set(cache_key, figure)
+    return figure
@@ -1,19 +1,22 @@
-import hashlib
 import logging
 from django.db import transaction
 from django.utils import timezone
 
+from abd_database.helpers.checksum import get_file_checksum
 from abd_database.models import UploadFile, UploadBatch
 
 logger = logging.getLogger(__name__)
 
 
 def get_checksum(file):
-    hash_md5 = hashlib.md5()
-    with open(file.file.temporary_file_path(), 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    """
+    @param file: FieldFile of the upload
+    @return: checksum computed by the upload handler while the file was received, otherwise the file is read
+    """
+    checksum = getattr(file.file, 'checksum', None)
+    if checksum is None:
+        checksum = get_file_checksum(file)
+    return checksum
 
 
 @transaction.atomic(savepoint=False)
@@ -30,8 +33,6 @@ def save_files(files, user, extractor_type, battery=None, dataset=None):
     @return duplicates_in_queue: list of filenames of duplicates found in the queue
     """
     batch = None
-    duplicates_in_db = []
-    duplicates_in_queue = []
 
     if dataset:
         batch = UploadBatch(user=user, extractor_type=extractor_type, dataset=dataset).save()
@@ -42,8 +43,7 @@ def save_files(files, user, extractor_type, battery=None, dataset=None):
         # TODO: check if reupload still works bc of not editable checksum
         UploadFile(file=file, batch=batch, kb=int(file.size / 1000), time=timezone.now(), battery=battery).save()
 
-    # TODO: optimize duplicate check per type
-    duplicates_in_db.extend(batch.check_for_duplicates())
-    duplicates_in_queue.extend(batch.check_for_duplicates_in_queue())
+    # database and queue in one query for all files
+    duplicates_in_db, duplicates_in_queue = batch.find_duplicates()
 
     return batch, (duplicates_in_db, duplicates_in_queue)
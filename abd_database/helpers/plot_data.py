@@ -0,0 +1,32 @@
+import base64
+
+import numpy as np
+
+PLOT_DATA_BINARY = True  # columns as base64 encoded float32 instead of json lists
+
+
+def encode_column(values, binary=PLOT_DATA_BINARY):
+    """
+    @param values: numbers, None or NaN for missing values
+    @return: {"dtype": "float32", "data": base64 of the little endian values} or list with None for NaN (json has no
+             NaN), decoded by decodeColumn of plotting.js
+    """
+    values = np.asarray(values, dtype=float)
+    if binary:
+        return {'dtype': 'float32', 'data': base64.b64encode(values.astype('<f4').tobytes()).decode()}
+    return [None if np.isnan(value) else value for value in values.tolist()]
+
+
+def make_trace(name, x, y, color=None, binary=PLOT_DATA_BINARY):
+    trace = {'name': name, 'x': encode_column(x, binary), 'y': encode_column(y, binary)}
+    if color is not None:
+        trace['color'] = color
+    return trace
+
+
+def make_plot_data(traces, x_title, y_title):
+    """
+    Compact plot data: the columns and names of the marker traces and the axis titles, the figure is assembled by
+    showPlot of plotting.js
+    """
+    return {'traces': traces, 'layout': {'x_title': x_title, 'y_title': y_title}}
@@ -0,0 +1,107 @@
+from django.db import connections, DatabaseError, transaction
+
+# raw data hypertables: table -> column the compressed rows are grouped by (all queries filter on it)
+RAW_DATA_TABLES = {
+    'abd_database_cyclingrawdata': 'agg_data_id',
+    'abd_database_hppcrawdata': 'agg_data_id',
+    'abd_database_eisdata': 'agg_data_id',
+}
+CHUNK_TIME_INTERVAL = '7 days'
+COMPRESS_AFTER = '30 days'
+
+# DDL and storage statistics need the table owner, which is the admin database user
+DB_ALIAS = 'admin'
+
+
+def set_chunk_time_interval(table, interval=CHUNK_TIME_INTERVAL, using=DB_ALIAS):
+    """Size of the chunks which are created from now on, existing chunks keep their size"""
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT set_chunk_time_interval(%s, %s::interval)", [table, interval])
+
+
+def enable_compression(table, segment_by, order_by='time', using=DB_ALIAS):
+    """
+    Enables native compression: the rows of a chunk are stored per segment_by value in columnar form, sorted by
+    order_by, so reading the raw data of some cycles only decompresses their segments
+    @return: None on success, otherwise the error of the database (e.g. unsupported by the TimescaleDB version)
+    """
+    try:
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {table} SET (timescaledb.compress, "
+                           f"timescaledb.compress_segmentby = %s, timescaledb.compress_orderby = %s)",
+                           [segment_by, f'{order_by} ASC'])
+    except DatabaseError as e:
+        return str(e).strip()
+    return None
+
+
+def add_compression_policy(table, compress_after=COMPRESS_AFTER, using=DB_ALIAS):
+    """Schedules the background job which compresses the chunks older than compress_after, replaces a former one"""
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT remove_compression_policy(%s, if_exists => true)", [table])
+        cursor.execute("SELECT add_compression_policy(%s, %s::interval)", [table, compress_after])
+
+
+def add_retention_policy(table, drop_after, using=DB_ALIAS):
+    """Schedules the background job which drops the chunks older than drop_after, replaces a former one"""
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT remove_retention_policy(%s, if_exists => true)", [table])
+        cursor.execute("SELECT add_retention_policy(%s, %s::interval)", [table, drop_after])
+
+
+def compress_chunks(table, older_than=COMPRESS_AFTER, using=DB_ALIAS):
+    """
+    Compresses the chunks now instead of waiting for the policy
+    @return: number of compressed chunks
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT compress_chunk(chunk, if_not_compressed => true) "
+                       "FROM show_chunks(%s, older_than => %s::interval) AS chunk", [table, older_than])
+        return len(cursor.fetchall())
+
+
+def get_hypertable_stats(table, using=DB_ALIAS):
+    """
+    @return: dict with the total size in bytes, the number of chunks and compressed chunks and the size before
+             compression of the compressed chunks
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT hypertable_size(%s)", [table])
+        total_bytes = cursor.fetchone()[0] or 0
+        cursor.execute("SELECT count(*), count(*) FILTER (WHERE is_compressed) FROM timescaledb_information.chunks "
+                       "WHERE hypertable_schema = 'public' AND hypertable_name = %s", [table])
+        nbr_of_chunks, nbr_of_compressed = cursor.fetchone()
+        cursor.execute("SELECT sum(before_compression_total_bytes), sum(after_compression_total_bytes) "
+                       "FROM chunk_compression_stats(%s)", [table])
+        before_compression, after_compression = cursor.fetchone()
+    return {'total_bytes': total_bytes,
+            'chunks': nbr_of_chunks,
+            'compressed_chunks': nbr_of_compressed,
+            'before_compression_bytes': before_compression or 0,
+            'after_compression_bytes': after_compression or 0}
+
+
+def get_battery_storage(using=DB_ALIAS):
+    """
+    Cycling raw data storage per battery, estimated with the average size of a row of the hypertable (chunks are
+    per time, not per battery)
+    @return: list of (battery name, number of rows, estimated bytes), largest first
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("""
+            SELECT battery.name, sum(rows.nbr_of_rows)
+            FROM (SELECT agg_data_id, count(*) AS nbr_of_rows FROM abd_database_cyclingrawdata
+                  GROUP BY agg_data_id) AS rows
+            INNER JOIN abd_database_aggdata AS aggdata ON aggdata.id = rows.agg_data_id
+            INNER JOIN abd_database_cyclingtest AS cyclingtest ON cyclingtest.id = aggdata.cycling_test_id
+            INNER JOIN abd_database_celltest AS celltest ON celltest.id = cyclingtest."cellTest_id"
+            INNER JOIN abd_database_battery AS battery ON battery.id = celltest.battery_id
+            GROUP BY battery.name
+            ORDER BY 2 DESC
+            """)
+        rows_per_battery = cursor.fetchall()
+        cursor.execute("SELECT hypertable_size('abd_database_cyclingrawdata')")
+        total_bytes = cursor.fetchone()[0] or 0
+    total_rows = sum(nbr_of_rows for name, nbr_of_rows in rows_per_battery)
+    bytes_per_row = total_bytes / total_rows if total_rows else 0
+    return [(name, nbr_of_rows, nbr_of_rows * bytes_per_row) for name, nbr_of_rows in rows_per_battery]
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+
+from abd_database.helpers import timescale
+
+
+def format_bytes(nbr_of_bytes):
+    return f"{nbr_of_bytes / 1e6:,.1f}MB"
+
+
+class Command(BaseCommand):
+    help = "Configures chunk size, native compression and the compression/retention policies of the raw data " \
+           "hypertables and reports their storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-interval', default=timescale.CHUNK_TIME_INTERVAL,
+                            help="time interval of new chunks")
+        parser.add_argument('--compress-after', default=timescale.COMPRESS_AFTER,
+                            help="chunks with only older measurements are compressed by a background job")
+        parser.add_argument('--compress-now', action='store_true',
+                            help="compress the old chunks now instead of waiting for the background job")
+        parser.add_argument('--drop-after', default=None,
+                            help="drop chunks with only older measurements (deletes raw data, off by default)")
+        parser.add_argument('--report', action='store_true', help="only report the storage")
+
+    def handle(self, *args, **options):
+        if not options['report']:
+            for table, segment_by in timescale.RAW_DATA_TABLES.items():
+                self.configure(table, segment_by, options)
+        self.report()
+
+    def configure(self, table, segment_by, options):
+        timescale.set_chunk_time_interval(table, options['chunk_interval'])
+        error = timescale.enable_compression(table, segment_by)
+        if error:
+            self.stderr.write(f"{table}: compression not enabled: {error}")
+        else:
+            timescale.add_compression_policy(table, options['compress_after'])
+            self.stdout.write(f"{table}: compressed by {segment_by} after {options['compress_after']}")
+            if options['compress_now']:
+                nbr_of_chunks = timescale.compress_chunks(table, options['compress_after'])
+                self.stdout.write(f"{table}: {nbr_of_chunks} chunks compressed")
+        if options['drop_after']:
+            timescale.add_retention_policy(table, options['drop_after'])
+            self.stdout.write(f"{table}: chunks are dropped after {options['drop_after']}")
+
+    def report(self):
+        for table in timescale.RAW_DATA_TABLES:
+            stats = timescale.get_hypertable_stats(table)
+            line = f"{table:<32} {format_bytes(stats['total_bytes']):>14} " \
+                   f"{stats['compressed_chunks']}/{stats['chunks']} chunks compressed"
+            if stats['after_compression_bytes']:
+                line += f", compressed chunks {format_bytes(stats['before_compression_bytes'])} -> " \
+                        f"{format_bytes(stats['after_compression_bytes'])}"
+            self.stdout.write(line)
+
+        self.stdout.write("Cycling raw data per battery (estimated):")
+        for name, nbr_of_rows, nbr_of_bytes in timescale.get_battery_storage():
+            self.stdout.write(f"{name:<40} {nbr_of_rows:>14,} rows {format_bytes(nbr_of_bytes):>14}")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from abd_database.helpers.db import set_active_tenant
+from abd_database.models import Battery, BatterySummary, CyclingTest, CyclingTestSummary
+from abd_management.models import Organisation
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the cycle summaries of all batteries, e.g. for tests extracted before the summaries existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--battery', type=int, action='append', help="only this battery (repeatable)")
+
+    def handle(self, *args, **options):
+        # the summaries are written with the row level security of the owner
+        for organisation_id in Organisation.objects.using('admin').values_list('id', flat=True):
+            set_active_tenant(organisation_id)
+            batteries = Battery.objects.filter(owner_id=organisation_id)
+            if options['battery']:
+                batteries = batteries.filter(pk__in=options['battery'])
+            for battery in batteries:
+                with transaction.atomic():
+                    for cycling_test_id in CyclingTest.objects.filter(cellTest__battery=battery) \
+                            .values_list('pk', flat=True):
+                        CyclingTestSummary.objects.refresh(cycling_test_id)
+                    summary = BatterySummary.objects.refresh(battery)
+                self.stdout.write(f"{battery}: {summary.nbr_of_tests} tests, {summary.nbr_of_cycles} cycles")
+        set_active_tenant()
@@ -1,40 +1,140 @@
-from django.contrib.postgres.aggregates import ArrayAgg
-import plotly.graph_objs as go
+import datetime
+
+import numpy as np
 import pandas as pd
 import seaborn as sns
 from django.db import models as djangoModels
-from django.db import connection
+from django.db import connection, transaction, DatabaseError, DEFAULT_DB_ALIAS
 from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
 import json
 
-from django.db.models.functions import Round, Cast
-
 from abd_database.helpers.basicHelper import round_c_rates
+from abd_database.helpers.db import execute_prepared, iterate_query, quote_columns
+from abd_database.helpers.downsampling import PLOT_MAX_POINTS, downsample, min_max_indices
+from abd_database.helpers.figure_cache import get_data_version, get_figure
+from abd_database.helpers.plot_data import make_plot_data, make_trace
+
+
+class BatteryManager(djangoModels.Manager):
+    def with_details(self):
+        """
+        Batteries with their type, chemistry, format and cell tests (with dataset) as the listings show them, loaded in
+        a constant number of queries
+        """
+        CellTest = apps.get_model('abd_database', 'CellTest')
+        return self.select_related('battery_type__supplier', 'battery_type__chemical_type_cathode',
+                                   'battery_type__cathode_proportions', 'battery_type__content_type',
+                                   'chemical_type_anode', 'anode_proportions', 'summary') \
+            .prefetch_related('battery_type__content_object',
+                              djangoModels.Prefetch('cell_test', queryset=CellTest.objects.select_related('dataset')))
+
+
+def to_aware_datetime(value):
+    """@param value: datetime (naive ones are UTC) or date (midnight UTC)"""
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time.min)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, datetime.timezone.utc)
+    return value
 
 
 class CyclingTestManager(djangoModels.Manager):
+    def get_previous_cycle_id(self, battery, date):
+        """
+        Cycle number of the last cycle of the battery which started before the date. Answered from the start times of
+        the AggData (index on cycling_test_id, start_time) instead of the raw data.
+        @param battery: Battery or its primary key
+        @return: cycle_id of the AggData (the offset of its test is not added), None if no cycle started before
+        """
+        AggData = apps.get_model('abd_database', 'AggData')
+        return AggData.objects.filter(cycling_test__cellTest__battery=battery,
+                                      start_time__lt=to_aware_datetime(date)) \
+            .order_by('-start_time', '-id').values_list('cycle_id', flat=True).first()
+
+    def shift_cycle_offsets(self, battery, nbr_of_cycles, after=None, exclude_cell_tests=()):
+        """
+        Adds nbr_of_cycles (negative to subtract) to the cycle offsets of the cycling tests of the battery in one UPDATE
+        @param after: only tests with cycles which end after this time (index on cycling_test_id, end_time of the
+                      AggData), all tests if None
+        @param exclude_cell_tests: primary keys of cell tests which are not shifted
+        @return: number of shifted tests
+        """
+        tests = self.filter(cellTest__battery=battery).exclude(cellTest__in=exclude_cell_tests)
+        if after is not None:
+            AggData = apps.get_model('abd_database', 'AggData')
+            tests = tests.filter(djangoModels.Exists(AggData.objects.filter(
+                cycling_test=djangoModels.OuterRef('pk'), end_time__gt=to_aware_datetime(after))))
+        return tests.update(cycle_offset=djangoModels.F('cycle_offset') + nbr_of_cycles)
+
     def get_cycling_tests_for_battery(self, battery):
-        q = self.filter(cellTest__battery=battery).annotate(
-            ave_temp=Round(
-                Cast(djangoModels.Avg('aggdata__ambient_temperature'), output_field=djangoModels.FloatField()), 1),
-            discharge_c_rates=ArrayAgg('aggdata__discharge_c_rate', distinct=True),
-            charge_c_rates=ArrayAgg('aggdata__charge_c_rate', distinct=True))
+        # the aggregates are read from the maintained summaries instead of joining the AggData on every request
+        q = list(self.filter(cellTest__battery=battery)
+                 .select_related('summary', 'cellTest__dataset', 'cellTest__file__batch__user')
+                 .order_by('pk'))
+        CyclingTestSummary = apps.get_model('abd_database', 'CyclingTestSummary')
         for result in q:
-            result.discharge_c_rates = sorted(round_c_rates(result.discharge_c_rates))
-            result.charge_c_rates = sorted(round_c_rates(result.charge_c_rates))
+            try:
+                summary = result.summary
+            except CyclingTestSummary.DoesNotExist:
+                # test extracted before the summaries existed
+                summary = CyclingTestSummary.objects.get_or_aggregate(result.pk)
+            result.aggdata_count = summary.nbr_of_cycles
+            result.ave_temp = summary.ave_temp
+            result.discharge_c_rates = summary.discharge_c_rates
+            result.charge_c_rates = summary.charge_c_rates
         return q
 
     def plot_cycles(self, cycles, as_dict=False):
+        """
+        Capacity per cycle from the figure cache, only rendered if the data of the battery changed.
+        Compact plot data (see make_plot_data), or the plotly figure with settings.PLOTLY_FIGURES.
+        """
+        version = get_data_version([cycles.cellTest.battery_id])
+        if settings.PLOTLY_FIGURES:
+            figure = get_figure('plot_cycles', cycles.pk, version, lambda: self.render_cycles_plot(cycles))
+            if as_dict and figure is not None:
+                return json.loads(figure)
+            return figure
+
+        plot_data = get_figure('plot_cycles_data', cycles.pk, version, lambda: self.cycles_plot_data(cycles))
+        if as_dict or plot_data is None:
+            return plot_data
+        return json.dumps(plot_data)
+
+    @staticmethod
+    def cycles_plot_data(cycles):
+        rows = list(cycles.aggdata_set.order_by('cycle_id').values_list('cycle_id', 'charge_capacity',
+                                                                        'discharge_capacity'))
+        if not rows:
+            return None
+        data = np.array(rows, dtype=float)
+        cycle_id = data[:, 0] + cycles.cycle_offset
+        capacities = data[:, 1:]
+        unit = '(Ah)'
+        maxima = np.nanmax(capacities, axis=0, initial=-np.inf)  # -inf for a column without values
+        maxima = np.abs(maxima[np.isfinite(maxima)])
+        if maxima.size and maxima.max() <= 1:
+            capacities = capacities * 1000
+            unit = '(mAh)'
+        return make_plot_data([make_trace('Charge Capacity', cycle_id, capacities[:, 0]),
+                               make_trace('Discharge Capacity', cycle_id, capacities[:, 1])],
+                              x_title='Cycle number', y_title='Capacity ' + unit)
+
+    @staticmethod
+    def render_cycles_plot(cycles):
+        import plotly.graph_objs as go  # only needed for settings.PLOTLY_FIGURES
         fig = go.Figure()
         df = pd.DataFrame(cycles.aggdata_set.all().values())
         if not df.empty:
-            df['cycle_id'] = df['cycle_id'].apply(lambda x: x + cycles.cycle_offset)
+            df['cycle_id'] = df['cycle_id'] + cycles.cycle_offset
             df = df.sort_values(by='cycle_id')
 
             max_value = max(abs(df['discharge_capacity'].max()), abs(df['charge_capacity'].max()))
             if max_value <= 1:
-                df['discharge_capacity'] = df['discharge_capacity'].apply(lambda x: x * 1000)
-                df['charge_capacity'] = df['charge_capacity'].apply(lambda x: x * 1000)
+                df['discharge_capacity'] = df['discharge_capacity'] * 1000
+                df['charge_capacity'] = df['charge_capacity'] * 1000
                 unit = '(mAh)'
             else:
                 unit = '(Ah)'
@@ -58,9 +158,6 @@ class CyclingTestManager(djangoModels.Manager):
                               yaxis_title='Capacity ' + unit,
                               height=400,
                               )
-            if as_dict:
-                return json.loads(fig.to_json())
-
             return fig.to_json()
         else:
             # TODO: errorhandling if dataframe is empty
@@ -69,7 +166,33 @@ class CyclingTestManager(djangoModels.Manager):
 
 class AggDataManager(djangoModels.Manager):
 
-    def get_agg_data_for_battery(self, battery, field_list=None, cell_tests=None):
+    def get_agg_data_for_battery(self, battery, field_list=None, cell_tests=None, min_cycle=None, max_cycle=None,
+                                 after=None, limit=None):
+        SQL, params = self.get_agg_data_for_battery_sql(battery, field_list, cell_tests, min_cycle, max_cycle, after,
+                                                        limit)
+
+        with connection.cursor() as cursor:
+            execute_prepared(cursor, SQL, params)
+            data_raw = cursor.fetchall()
+
+        return data_raw
+
+    def iterate_agg_data_for_battery(self, battery, field_list=None, cell_tests=None, min_cycle=None, max_cycle=None,
+                                     using=DEFAULT_DB_ALIAS):
+        """Same rows as get_agg_data_for_battery, yielded in chunks from a server-side cursor"""
+        SQL, params = self.get_agg_data_for_battery_sql(battery, field_list, cell_tests, min_cycle, max_cycle)
+        return iterate_query(SQL, params, using)
+
+    @staticmethod
+    def get_agg_data_for_battery_sql(battery, field_list=None, cell_tests=None, min_cycle=None, max_cycle=None,
+                                     after=None, limit=None):
+        """
+        @param min_cycle: only cycles from this cycle number (with the offset of the cycling test) on
+        @param max_cycle: only cycles up to this cycle number
+        @param after: (cycle_id, id) of the last row of the previous page, the rows are ordered by (cycle_id, id)
+        @param limit: number of rows of a page, the cycle_id and id of every row are appended as the last two columns
+                      to continue with the next page
+        """
         # q = self.filter(cycling_test__cellTest__battery=battery).order_by('cycle_id')
         # q = q.annotate(start_date=djangoModels.Min('cyclingrawdata__time'))
 
@@ -82,58 +205,207 @@ class AggDataManager(djangoModels.Manager):
             "abd_database_aggdata"."ambient_temperature", "abd_database_aggdata"."error_codes"
             """
         else:
-            fields = [f'"abd_database_aggdata"."{field}"' for field in field_list]
+            fields = quote_columns(apps.get_model('abd_database', 'AggData'), field_list)
             fields = ", ".join(fields)
-
+        if limit is not None:
+            fields += ', "abd_database_aggdata"."cycle_id", "abd_database_aggdata"."id"'
 
         # aggregationn over many entries (min(time)) very slow
-        if cell_tests is None:
-            SQL = f'SELECT {fields}' \
-                  ' FROM "abd_database_aggdata" INNER JOIN "abd_database_cyclingtest" ON ' \
-                  '("abd_database_aggdata"."cycling_test_id" = "abd_database_cyclingtest"."id") INNER JOIN ' \
-                  '"abd_database_celltest" ON ("abd_database_cyclingtest"."cellTest_id" = "abd_database_celltest"."id") ' \
-                  'WHERE "abd_database_celltest"."battery_id" = %s ORDER BY "abd_database_aggdata"."cycle_id" ASC'
-
-            params = (battery,)
-
-        else:
-            SQL = f'SELECT {fields}' \
-                  ' FROM "abd_database_aggdata" INNER JOIN "abd_database_cyclingtest" ON ' \
-                  '("abd_database_aggdata"."cycling_test_id" = "abd_database_cyclingtest"."id") INNER JOIN ' \
-                  '"abd_database_celltest" ON ("abd_database_cyclingtest"."cellTest_id" = "abd_database_celltest"."id") ' \
-                  'WHERE ("abd_database_celltest"."battery_id" = %s AND "abd_database_cyclingtest"."cellTest_id" in %s) ORDER BY "abd_database_aggdata"."cycle_id" ASC'
+        conditions = ['"abd_database_celltest"."battery_id" = %s']
+        params = [battery]
+        if cell_tests is not None:
+            conditions.append('"abd_database_cyclingtest"."cellTest_id" = ANY(%s)')
+            params.append(list(cell_tests))
+        if min_cycle is not None:
+            conditions.append('"abd_database_aggdata"."cycle_id" + "abd_database_cyclingtest"."cycle_offset" >= %s')
+            params.append(min_cycle)
+        if max_cycle is not None:
+            conditions.append('"abd_database_aggdata"."cycle_id" + "abd_database_cyclingtest"."cycle_offset" <= %s')
+            params.append(max_cycle)
+        if after is not None:
+            conditions.append('("abd_database_aggdata"."cycle_id", "abd_database_aggdata"."id") > (%s, %s)')
+            params.extend(after)
+
+        SQL = f'SELECT {fields}' \
+              ' FROM "abd_database_aggdata" INNER JOIN "abd_database_cyclingtest" ON ' \
+              '("abd_database_aggdata"."cycling_test_id" = "abd_database_cyclingtest"."id") INNER JOIN ' \
+              '"abd_database_celltest" ON ("abd_database_cyclingtest"."cellTest_id" = "abd_database_celltest"."id") ' \
+              f'WHERE {" AND ".join(conditions)} ' \
+              'ORDER BY "abd_database_aggdata"."cycle_id" ASC, "abd_database_aggdata"."id" ASC'
+        if limit is not None:
+            SQL += ' LIMIT %s'
+            params.append(limit)
+
+        return SQL, tuple(params)
+
+
+class CyclingTestSummaryManager(djangoModels.Manager):
+    def aggregate(self, cycling_test_id):
+        """
+        Aggregates the AggData of one cycling test
+        @return: dict with the field values of the CyclingTestSummary
+        """
+        sql = """
+            SELECT COUNT(*), AVG(ambient_temperature), COUNT(ambient_temperature),
+                   ARRAY_AGG(DISTINCT charge_c_rate), ARRAY_AGG(DISTINCT discharge_c_rate),
+                   MIN(start_time), MAX(end_time),
+                   ARRAY_AGG(cycle_id ORDER BY cycle_id) FILTER (WHERE discharge_capacity IS NOT NULL),
+                   ARRAY_AGG(discharge_capacity ORDER BY cycle_id) FILTER (WHERE discharge_capacity IS NOT NULL)
+            FROM abd_database_aggdata WHERE cycling_test_id = %s
+            """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [cycling_test_id])
+            (nbr_of_cycles, ave_temp, nbr_of_temperatures, charge_c_rates, discharge_c_rates, start_time, end_time,
+             fade_cycle_ids, fade_capacities) = cursor.fetchone()
+
+        return {'nbr_of_cycles': nbr_of_cycles,
+                'ave_temp': round(ave_temp, 1) if ave_temp is not None else None,
+                'nbr_of_temperatures': nbr_of_temperatures,
+                'charge_c_rates': sorted(round_c_rates(charge_c_rates or [])),
+                'discharge_c_rates': sorted(round_c_rates(discharge_c_rates or [])),
+                'start_time': start_time,
+                'end_time': end_time,
+                'fade_cycle_ids': fade_cycle_ids or [],
+                'fade_capacities': fade_capacities or []}
+
+    def refresh(self, cycling_test_id):
+        """
+        Stores the aggregates of one cycling test, called once after its extraction
+        @return: CyclingTestSummary
+        """
+        summary, created = self.update_or_create(cycling_test_id=cycling_test_id,
+                                                 defaults=self.aggregate(cycling_test_id))
+        return summary
 
-            params = (battery, tuple(cell_tests))
+    def get_or_aggregate(self, cycling_test_id):
+        """
+        Summary of a test which was extracted before the summaries existed. It is only stored if the active tenant
+        owns the test, otherwise it is aggregated for this request.
+        """
+        try:
+            with transaction.atomic():
+                return self.refresh(cycling_test_id)
+        except DatabaseError:  # row level security
+            return self.model(cycling_test_id=cycling_test_id, **self.aggregate(cycling_test_id))
 
-        with connection.cursor() as cursor:
-            cursor.execute(SQL, params)
-            data_raw = cursor.fetchall()
 
-        return data_raw
+class BatterySummaryManager(djangoModels.Manager):
+    def refresh(self, battery, exclude_cycling_tests=()):
+        """
+        Combines the summaries of the cycling tests of a battery, tests without a summary are aggregated first.
+        Only reads one row per test, called when a test is added or deleted.
+        @param battery: Battery
+        @param exclude_cycling_tests: primary keys of cycling tests which are about to be deleted
+        @return: BatterySummary
+        """
+        CyclingTest = apps.get_model('abd_database', 'CyclingTest')
+        CyclingTestSummary = apps.get_model('abd_database', 'CyclingTestSummary')
+        cycling_tests = CyclingTest.objects.filter(cellTest__battery=battery).exclude(pk__in=exclude_cycling_tests)
+        summaries = {summary.cycling_test_id: summary
+                     for summary in CyclingTestSummary.objects.filter(cycling_test__in=cycling_tests)}
+        offsets = dict(cycling_tests.values_list('pk', 'cycle_offset'))
+        for cycling_test_id in offsets.keys() - summaries.keys():
+            summaries[cycling_test_id] = CyclingTestSummary.objects.refresh(cycling_test_id)
+        summaries = list(summaries.values())
+
+        nbr_of_temperatures = sum(summary.nbr_of_temperatures for summary in summaries)
+        ave_temp = None
+        if nbr_of_temperatures:
+            ave_temp = round(sum(summary.ave_temp * summary.nbr_of_temperatures for summary in summaries
+                                 if summary.nbr_of_temperatures) / nbr_of_temperatures, 1)
+        start_times = [summary.start_time for summary in summaries if summary.start_time is not None]
+        end_times = [summary.end_time for summary in summaries if summary.end_time is not None]
+        fade = sorted((cycle_id + offsets[summary.cycling_test_id], capacity) for summary in summaries
+                      for cycle_id, capacity in zip(summary.fade_cycle_ids, summary.fade_capacities))
+
+        summary, created = self.update_or_create(battery=battery, defaults={
+            'nbr_of_tests': len(summaries),
+            'nbr_of_cycles': sum(summary.nbr_of_cycles for summary in summaries),
+            'ave_temp': ave_temp,
+            'charge_c_rates': sorted({c_rate for summary in summaries for c_rate in summary.charge_c_rates}),
+            'discharge_c_rates': sorted({c_rate for summary in summaries for c_rate in summary.discharge_c_rates}),
+            'start_time': min(start_times, default=None),
+            'end_time': max(end_times, default=None),
+            'fade_cycle_ids': [cycle_id for cycle_id, capacity in fade],
+            'fade_capacities': [capacity for cycle_id, capacity in fade]})
+        return summary
 
 
 class CyclingRawDataManager(djangoModels.Manager):
-    def capacity_vs_voltage_for_cycles(self, cycles, as_dict=False, api=False, field_list=None):
+    def capacity_vs_voltage_for_cycles(self, cycles, as_dict=False, api=False, field_list=None, max_points=None):
+        """
+        @param max_points: downsampling budget, points per trace of the plot (default PLOT_MAX_POINTS) or points per
+                           cycle of the api rows (default all rows), see min_max_indices
+        """
+        if not api:
+            return self.plot_capacity_vs_voltage(cycles, as_dict, max_points)
 
         if field_list is None:
             field_list = ["time", "voltage", "capacity", "step_flag", "agg_data_id"]
 
-        fields = [f'"abd_database_cyclingrawdata"."{field}"' for field in field_list]
-        fields = ", ".join(fields)
+        fields = ", ".join(quote_columns(self.model, field_list))
+        downsample_api = api and max_points is not None
+        if downsample_api:
+            fields += ', "abd_database_cyclingrawdata"."agg_data_id", "abd_database_cyclingrawdata"."voltage"'
 
-        if len(cycles) > 1:
-            SQL = f"SELECT {fields} FROM abd_database_cyclingrawdata" \
-                  f" WHERE agg_data_id IN {tuple(cycles)}"
-        else:
-            SQL = f"SELECT {fields} FROM abd_database_cyclingrawdata" \
-                  f" WHERE agg_data_id={cycles[0]}"
+        # one statement for any number of cycles, prepared once per connection
+        SQL = f"SELECT {fields} FROM abd_database_cyclingrawdata WHERE agg_data_id = ANY(%s)"
+        if downsample_api:
+            SQL += " ORDER BY agg_data_id, time"
 
         with connection.cursor() as cursor:
-            cursor.execute(SQL)
+            execute_prepared(cursor, SQL, [[int(cycle) for cycle in cycles]])
             data_raw = cursor.fetchall()
 
-        if api:
-            return data_raw
+        if downsample_api:
+            keys = np.array([row[-2:] for row in data_raw], dtype=float).reshape(-1, 2)
+            return [data_raw[i][:-2] for i in min_max_indices(keys[:, 1], max_points, keys[:, 0])]
+        return data_raw
+
+    def plot_capacity_vs_voltage(self, cycles, as_dict=False, max_points=None):
+        """Figure from the figure cache, only rendered if the data of the batteries changed"""
+        if max_points is None:
+            max_points = PLOT_MAX_POINTS
+        # cycle numbers and batteries of all selected cycles in one query
+        cycle_ids = {}
+        battery_ids = set()
+        for pk, cycle_id, battery_id in apps.get_model('abd_database', 'aggdata').objects.filter(pk__in=cycles) \
+                .values_list('pk', djangoModels.F('cycle_id') + djangoModels.F('cycling_test__cycle_offset'),
+                             'cycling_test__cellTest__battery_id'):
+            cycle_ids[pk] = cycle_id
+            battery_ids.add(battery_id)
+
+        version = get_data_version(battery_ids)
+        if settings.PLOTLY_FIGURES:
+            figure = get_figure('capacity_vs_voltage', (tuple(cycles), max_points), version,
+                                lambda: self.render_capacity_vs_voltage(cycles, cycle_ids, max_points))
+            if as_dict:
+                return json.loads(figure)
+            return figure
+
+        plot_data = get_figure('capacity_vs_voltage_data', (tuple(cycles), max_points), version,
+                               lambda: self.capacity_vs_voltage_plot_data(cycles, cycle_ids, max_points))
+        if as_dict:
+            return plot_data
+        return json.dumps(plot_data)
+
+    def capacity_vs_voltage_plot_data(self, cycles, cycle_ids, max_points):
+        df = pd.DataFrame(self.capacity_vs_voltage_for_cycles(cycles, api=True),
+                          columns=['time', 'voltage', 'capacity', 'step_flag', 'agg_data_id'])
+        color_list = sns.cubehelix_palette(len(cycles)).as_hex()
+        traces = []
+        for i, cycle in enumerate(cycles):
+            cycid = cycle_ids[cycle]
+            for name, flags in (('Charge', [2, 3]), ('Discharge', [4])):
+                selection = (df['agg_data_id'] == cycle) & (df['step_flag'].isin(flags))
+                df_temp = downsample(df.loc[selection, :].sort_values(by='capacity'), 'voltage', max_points)
+                traces.append(make_trace(f'{cycid}_{name}', df_temp['capacity'].abs(), df_temp['voltage'],
+                                         color=color_list[i]))
+        return make_plot_data(traces, x_title='Capacity (Ah)', y_title='Voltage (V)')
+
+    def render_capacity_vs_voltage(self, cycles, cycle_ids, max_points):
+        import plotly.graph_objs as go  # only needed for settings.PLOTLY_FIGURES
+        data_raw = self.capacity_vs_voltage_for_cycles(cycles, api=True)
 
         fig = go.Figure()
         # df = pd.DataFrame(self.filter(agg_data_id__in=cycles).values()).sort_values(by='time')
@@ -152,10 +424,9 @@ class CyclingRawDataManager(djangoModels.Manager):
         #     unit = '(Ah)'
 
         for i, cycle in enumerate(cycles):
-            aggdata = apps.get_model('abd_database', 'aggdata').objects.get(pk=cycle)
-            cycid = aggdata.cycle_id + aggdata.cycling_test.cycle_offset
+            cycid = cycle_ids[cycle]
             cycle_charge = (df['agg_data_id'] == cycle) & (df['step_flag'].isin([2, 3]))
-            df_temp = df.loc[cycle_charge, :].sort_values(by='capacity')
+            df_temp = downsample(df.loc[cycle_charge, :].sort_values(by='capacity'), 'voltage', max_points)
             fig.add_trace(go.Scatter(x=df_temp.loc[:, 'capacity'],
                                      y=df_temp.loc[:, 'voltage'],
                                      mode='markers',
@@ -165,7 +436,7 @@ class CyclingRawDataManager(djangoModels.Manager):
                           )
 
             cycle_discharge = (df['agg_data_id'] == cycle) & (df['step_flag'].isin([4]))
-            df_temp = df.loc[cycle_discharge, :].sort_values(by='capacity')
+            df_temp = downsample(df.loc[cycle_discharge, :].sort_values(by='capacity'), 'voltage', max_points)
             fig.add_trace(go.Scatter(x=df_temp.loc[:, 'capacity'].abs(),
                                      y=df_temp.loc[:, 'voltage'],
                                      mode='markers',
@@ -179,12 +450,31 @@ class CyclingRawDataManager(djangoModels.Manager):
                           yaxis_title='Voltage (V)',
                           height=400
                           )
-        if as_dict:
-            return json.loads(fig.to_json())
-
         return fig.to_json()
 
-    def get_data_for_battery(self, battery, field_list=None):
+    def get_data_for_battery(self, battery, field_list=None, start=None, end=None, after=None, limit=None):
+        SQL, params = self.get_data_for_battery_sql(battery, field_list, start, end, after, limit)
+
+        with connection.cursor() as cursor:
+            execute_prepared(cursor, SQL, params)
+            data_raw = cursor.fetchall()
+
+        return data_raw
+
+    def iterate_data_for_battery(self, battery, field_list=None, start=None, end=None, using=DEFAULT_DB_ALIAS):
+        """Same rows as get_data_for_battery, yielded in chunks from a server-side cursor"""
+        SQL, params = self.get_data_for_battery_sql(battery, field_list, start, end)
+        return iterate_query(SQL, params, using)
+
+    @staticmethod
+    def get_data_for_battery_sql(battery, field_list=None, start=None, end=None, after=None, limit=None):
+        """
+        @param start: only rows from this time on, the time range lets TimescaleDB skip the other chunks
+        @param end: only rows before this time
+        @param after: (time, id) of the last row of the previous page, the rows are ordered by (time, id)
+        @param limit: number of rows of a page, the time and id of every row are appended as the last two columns
+                      to continue with the next page
+        """
 
         # TODO check usage of ".objects.raw(SQL)"
 
@@ -192,23 +482,36 @@ class CyclingRawDataManager(djangoModels.Manager):
             field_list = ["id", "time", "voltage", "current", "capacity", "energy", "agg_data_id", "cycle_id",
                           "step_flag", "time_in_step", "cell_temperature", "ambient_temperature"]
 
-        fields = [f'"abd_database_cyclingrawdata"."{field}"' for field in field_list]
-        fields = ", ".join(fields)
+        fields = ", ".join(quote_columns(apps.get_model('abd_database', 'CyclingRawData'), field_list))
+        fields = fields.replace('"abd_database_cyclingrawdata"."cycle_id"',
+                                '"abd_database_cyclingrawdata"."cycle_id" + "abd_database_cyclingtest"."cycle_offset" as cycle_id')
+        if limit is not None:
+            fields += ', "abd_database_cyclingrawdata"."time", "abd_database_cyclingrawdata"."id"'
+
+        conditions = ['"abd_database_celltest"."battery_id" = %s']
+        params = [battery]
+        if start is not None:
+            conditions.append('"abd_database_cyclingrawdata"."time" >= %s')
+            params.append(start)
+        if end is not None:
+            conditions.append('"abd_database_cyclingrawdata"."time" < %s')
+            params.append(end)
+        if after is not None:
+            # the plain time condition is what the chunk exclusion can use, the row comparison breaks the ties
+            conditions.append('"abd_database_cyclingrawdata"."time" >= %s AND '
+                              '("abd_database_cyclingrawdata"."time", "abd_database_cyclingrawdata"."id") > (%s, %s)')
+            params.extend([after[0], after[0], after[1]])
 
         SQL = f"""
         SELECT {fields} FROM "abd_database_cyclingrawdata"
         INNER JOIN "abd_database_aggdata" ON ("abd_database_cyclingrawdata"."agg_data_id" = "abd_database_aggdata"."id")
         INNER JOIN "abd_database_cyclingtest" ON ("abd_database_aggdata"."cycling_test_id" = "abd_database_cyclingtest"."id")
         INNER JOIN "abd_database_celltest" ON ("abd_database_cyclingtest"."cellTest_id" = "abd_database_celltest"."id")
-        WHERE "abd_database_celltest"."battery_id" = %s ORDER BY "abd_database_cyclingrawdata"."time" ASC
+        WHERE {" AND ".join(conditions)}
+        ORDER BY "abd_database_cyclingrawdata"."time" ASC, "abd_database_cyclingrawdata"."id" ASC
         """
-        SQL = SQL.replace('"abd_database_cyclingrawdata"."cycle_id"',
-                          '"abd_database_cyclingrawdata"."cycle_id" + "abd_database_cyclingtest"."cycle_offset" as cycle_id')
-
-        params = (battery,)
+        if limit is not None:
+            SQL += " LIMIT %s"
+            params.append(limit)
 
-        with connection.cursor() as cursor:
-            cursor.execute(SQL, params)
-            data_raw = cursor.fetchall()
-
-        return data_raw
+        return SQL, tuple(params)
@@ -0,0 +1,85 @@
+# Generated by Django 4.0.4 on 2026-10-18 10:05
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def activate_row_level_security(table):
+    return f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY; " \
+           f"ALTER TABLE {table} FORCE ROW LEVEL SECURITY;"
+
+
+# SELECT allowed for visible tests/batteries, INSERT, UPDATE, DELETE only allowed for owned data
+sql_policy_cyclingtestsummary_select = 'CREATE POLICY owner_access_select ON abd_database_cyclingtestsummary ' \
+                                       'FOR SELECT USING ("cycling_test_id" IN (SELECT id FROM abd_database_cyclingtest));'
+
+sql_policy_cyclingtestsummary_modify = f"""
+CREATE POLICY owner_access_modify ON abd_database_cyclingtestsummary
+FOR ALL USING
+("cycling_test_id" IN (SELECT id FROM abd_database_cyclingtest
+WHERE "cellTest_id" IN (SELECT id FROM abd_database_celltest
+WHERE dataset_id IN (SELECT id FROM abd_database_dataset
+WHERE (owner_id::TEXT = current_setting('abd.active_tenant'))))));
+"""
+
+sql_policy_batterysummary_select = 'CREATE POLICY owner_access_select ON abd_database_batterysummary ' \
+                                   'FOR SELECT USING ("battery_id" IN (SELECT id FROM abd_database_battery));'
+
+sql_policy_batterysummary_modify = "CREATE POLICY owner_access_modify ON abd_database_batterysummary " \
+                                   "FOR ALL USING (battery_id IN (SELECT id FROM abd_database_battery " \
+                                   "WHERE owner_id::TEXT = current_setting('abd.active_tenant')::TEXT));"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abd_database', '0015_auto_20231211_1230'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatterySummary',
+            fields=[
+                ('nbr_of_cycles', models.PositiveIntegerField(default=0)),
+                ('ave_temp', models.FloatField(blank=True, null=True)),
+                ('charge_c_rates', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, default=list, size=None)),
+                ('discharge_c_rates', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, default=list, size=None)),
+                ('start_time', models.DateTimeField(blank=True, null=True)),
+                ('end_time', models.DateTimeField(blank=True, null=True)),
+                ('fade_cycle_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None)),
+                ('fade_capacities', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, default=list, size=None)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('battery', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='abd_database.battery')),
+                ('nbr_of_tests', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='CyclingTestSummary',
+            fields=[
+                ('nbr_of_cycles', models.PositiveIntegerField(default=0)),
+                ('ave_temp', models.FloatField(blank=True, null=True)),
+                ('charge_c_rates', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, default=list, size=None)),
+                ('discharge_c_rates', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, default=list, size=None)),
+                ('start_time', models.DateTimeField(blank=True, null=True)),
+                ('end_time', models.DateTimeField(blank=True, null=True)),
+                ('fade_cycle_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None)),
+                ('fade_capacities', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, default=list, size=None)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('cycling_test', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='abd_database.cyclingtest')),
+                ('nbr_of_temperatures', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunSQL(sql=activate_row_level_security("abd_database_cyclingtestsummary")),
+        migrations.RunSQL(sql=sql_policy_cyclingtestsummary_select),
+        migrations.RunSQL(sql=sql_policy_cyclingtestsummary_modify),
+        migrations.RunSQL(sql=activate_row_level_security("abd_database_batterysummary")),
+        migrations.RunSQL(sql=sql_policy_batterysummary_select),
+        migrations.RunSQL(sql=sql_policy_batterysummary_modify),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:20
+
+from django.db import migrations
+
+# raw data of a test spans weeks to months, one day chunks of historic uploads give thousands of tiny chunks
+RAW_DATA_TABLES = ['abd_database_cyclingrawdata', 'abd_database_hppcrawdata', 'abd_database_eisdata']
+
+
+def set_chunk_time_interval(interval):
+    return " ".join(f"SELECT set_chunk_time_interval('{table}', INTERVAL '{interval}');" for table in RAW_DATA_TABLES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abd_database', '0016_cyclingtestsummary_batterysummary'),
+    ]
+
+    # compression and its policies depend on the TimescaleDB version and are set with manage.py configure_hypertables
+    operations = [
+        migrations.RunSQL(sql=set_chunk_time_interval('7 days'), reverse_sql=set_chunk_time_interval('1 day')),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abd_database', '0017_raw_data_chunk_interval'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='aggdata',
+            index=models.Index(fields=['cycling_test', 'start_time'], name='aggdata_test_start_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggdata',
+            index=models.Index(fields=['cycling_test', 'end_time'], name='aggdata_test_end_time_idx'),
+        ),
+    ]
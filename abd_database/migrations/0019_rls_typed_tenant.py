@@ -0,0 +1,126 @@
+# Generated by Django 4.0.4 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+# The policies compared owner_id::TEXT = current_setting('abd.active_tenant'), the cast of the column prevents every
+# index on it. The settings are read as bigint by stable functions instead ('None' or a missing setting is NULL, which
+# matches no row), the comparisons are index conditions.
+sql_tenant_functions = """
+CREATE OR REPLACE FUNCTION abd_active_tenant() RETURNS bigint LANGUAGE sql STABLE PARALLEL SAFE AS $$
+SELECT CASE WHEN current_setting('abd.active_tenant', true) ~ '^[0-9]+$'
+            THEN current_setting('abd.active_tenant', true)::bigint END
+$$;
+CREATE OR REPLACE FUNCTION abd_change_owner_id() RETURNS bigint LANGUAGE sql STABLE PARALLEL SAFE AS $$
+SELECT CASE WHEN current_setting('abd.change_owner_battid', true) ~ '^[0-9]+$'
+            THEN current_setting('abd.change_owner_battid', true)::bigint END
+$$;
+"""
+
+sql_drop_tenant_functions = "DROP FUNCTION abd_active_tenant(); DROP FUNCTION abd_change_owner_id();"
+
+
+def is_owner(typed):
+    if typed:
+        return "owner_id = abd_active_tenant()"
+    return "owner_id::TEXT = current_setting('abd.active_tenant')"
+
+
+def is_owner_change(typed):
+    if typed:
+        return "id = abd_change_owner_id()"
+    return "id::TEXT = current_setting('abd.change_owner_battid')"
+
+
+def owned_datasets(typed):
+    return f"dataset_id IN (SELECT id FROM abd_database_dataset WHERE {is_owner(typed)})"
+
+
+def owned_celltests(typed):
+    return f'"cellTest_id" IN (SELECT id FROM abd_database_celltest WHERE {owned_datasets(typed)})'
+
+
+def owned_cyclingtests(typed):
+    return f'"cycling_test_id" IN (SELECT id FROM abd_database_cyclingtest WHERE {owned_celltests(typed)})'
+
+
+def owned_aggdata(typed):
+    return f'"agg_data_id" IN (SELECT id FROM abd_database_aggdata WHERE {owned_cyclingtests(typed)})'
+
+
+def owned_batteries(typed):
+    return f"battery_id IN (SELECT id FROM abd_database_battery WHERE {is_owner(typed)})"
+
+
+def visible(typed):
+    return f"({is_owner(typed)}) OR (private = False) OR ({is_owner_change(typed)})"
+
+
+def owner_or_change(typed):
+    return f"({is_owner(typed)}) OR ({is_owner_change(typed)})"
+
+
+# (table, policy, USING, WITH CHECK) of the policies of 0013, 0014 and 0016 which compare the tenant
+POLICIES = [
+    ('abd_database_dataset', 'owner_access', visible, None),
+    ('abd_database_dataset', 'owner_insert', None, is_owner),
+    ('abd_database_dataset', 'owner_update', is_owner, owner_or_change),
+    ('abd_database_dataset', 'owner_delete', is_owner, None),
+    ('abd_database_celltest', 'owner_access_update', owned_datasets, None),
+    ('abd_database_celltest', 'owner_access_insert', None, owned_datasets),
+    ('abd_database_celltest', 'owner_access_del', owned_datasets, None),
+    ('abd_database_cyclingtest', 'owner_access_update', owned_celltests, None),
+    ('abd_database_cyclingtest', 'owner_access_insert', None, owned_celltests),
+    ('abd_database_cyclingtest', 'owner_delete', owned_celltests, None),
+    ('abd_database_aggdata', 'owner_access_update', owned_cyclingtests, None),
+    ('abd_database_aggdata', 'owner_access_insert', None, owned_cyclingtests),
+    ('abd_database_aggdata', 'owner_delete', owned_cyclingtests, None),
+    ('abd_database_cyclingrawdata', 'owner_update', None, owned_aggdata),
+    ('abd_database_cyclingrawdata', 'owner_insert', None, owned_aggdata),
+    ('abd_database_cyclingrawdata', 'owner_delete', owned_aggdata, None),
+    ('abd_database_battery', 'owner_access', visible, None),
+    ('abd_database_battery', 'insert_policy', None, is_owner),
+    ('abd_database_battery', 'update_policy', is_owner, owner_or_change),
+    ('abd_database_battery', 'delete_owner_access', is_owner, None),
+    ('abd_database_cyclingtestsummary', 'owner_access_modify', owned_cyclingtests, None),
+    ('abd_database_batterysummary', 'owner_access_modify', owned_batteries, None),
+]
+
+
+def alter_policies(typed):
+    sql = []
+    for table, policy, using, check in POLICIES:
+        statement = f"ALTER POLICY {policy} ON {table}"
+        if using is not None:
+            statement += f" USING ({using(typed)})"
+        if check is not None:
+            statement += f" WITH CHECK ({check(typed)})"
+        sql.append(statement + ";")
+    return " ".join(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abd_database', '0018_aggdata_cycle_time_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=sql_tenant_functions, reverse_sql=sql_drop_tenant_functions),
+        migrations.RunSQL(sql=alter_policies(typed=True), reverse_sql=alter_policies(typed=False)),
+        migrations.AddIndex(
+            model_name='battery',
+            index=models.Index(fields=['owner', 'private'], name='battery_owner_private_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='battery',
+            index=models.Index(condition=models.Q(('private', False)), fields=['id'], name='battery_public_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['owner', 'private'], name='dataset_owner_private_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(condition=models.Q(('private', False)), fields=['id'], name='dataset_public_idx'),
+        ),
+    ]
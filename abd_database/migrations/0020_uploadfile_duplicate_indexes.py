@@ -0,0 +1,21 @@
+# Generated by Django 4.0.4 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abd_database', '0019_rls_typed_tenant'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='uploadfile',
+            index=models.Index(fields=['checksum', 'status'], name='uploadfile_checksum_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadfile',
+            index=models.Index(fields=['file_name', 'kb'], name='uploadfile_name_kb_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.0.4 on 2026-10-18 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abd_database', '0020_uploadfile_duplicate_indexes'),
+    ]
+
+    # the checksums of the existing uploads are MD5, their files are deleted after the extraction and can not be
+    # hashed again
+    operations = [
+        migrations.AddField(
+            model_name='uploadfile',
+            name='checksum_type',
+            field=models.CharField(choices=[('md5', 'MD5'), ('blake2b', 'BLAKE2b')], default='md5', editable=False,
+                                   max_length=8),
+        ),
+        migrations.AlterField(
+            model_name='uploadfile',
+            name='checksum_type',
+            field=models.CharField(choices=[('md5', 'MD5'), ('blake2b', 'BLAKE2b')], default='blake2b', editable=False,
+                                   max_length=8),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abd_database', '0021_uploadfile_checksum_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadfile',
+            name='metrics',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import os
 import re
+from collections import defaultdict
 from datetime import datetime
 
 from django.core.exceptions import ValidationError
@@ -7,20 +8,21 @@ from django.core.validators import MinLengthValidator
 from timescale.fields import TimescaleDateTimeField
 from django.utils.translation import gettext_lazy as _
 from abd_database.helpers.basicHelper import validate_proportions
+from abd_database.helpers.db import change_owner
 
-from abd_database.managers import CyclingTestManager, AggDataManager, CyclingRawDataManager
+from abd_database.managers import BatteryManager, CyclingTestManager, AggDataManager, CyclingRawDataManager, \
+    CyclingTestSummaryManager, BatterySummaryManager
 from abd_database.templatetags.queue_tags import is_in_queue
 from abd_management.models import Organisation, User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.fields import ArrayField
-from django.db import models, connections, connection
-from django.db.models import Q
+from django.db import models, connections
+from django.db.models import Exists, OuterRef, Q
 from django.contrib.auth.models import Group, Permission
 
 from timescale.db.models.models import TimescaleModel
 
-from jobqueue_manager import manager
 from jobqueue_manager.manager import get_queue_status
 
 
@@ -198,6 +200,15 @@ class Battery(models.Model):
     owner = models.ForeignKey(Organisation, on_delete=models.RESTRICT)
     private = models.BooleanField(default=True)
 
+    objects = BatteryManager()
+
+    class Meta:
+        # the clauses of the row level security policies (owner, public)
+        indexes = [
+            models.Index(fields=['owner', 'private'], name='battery_owner_private_idx'),
+            models.Index(fields=['id'], condition=Q(private=False), name='battery_public_idx'),
+        ]
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
         self.set_name()
@@ -236,10 +247,8 @@ class Battery(models.Model):
             new_owner: Instance of new owner
         """
         self.owner = new_owner
-        with connection.cursor() as cursor:
-            cursor.execute(f"SET abd.change_owner_battid = {self.id}")
+        with change_owner(self.id):
             self.save(update_fields=["owner"])
-            cursor.execute(f"SET abd.change_owner_battid = {None}")
 
     def __str__(self):
         return self.name
@@ -258,6 +267,11 @@ class Dataset(models.Model):
 
     class Meta:
         unique_together = [['name', 'url', 'doi', 'license', 'authors', 'organisation']]
+        # the clauses of the row level security policies (owner, public)
+        indexes = [
+            models.Index(fields=['owner', 'private'], name='dataset_owner_private_idx'),
+            models.Index(fields=['id'], condition=Q(private=False), name='dataset_public_idx'),
+        ]
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         super().save(force_insert, force_update, using, update_fields)
@@ -271,10 +285,8 @@ class Dataset(models.Model):
         """
         self.owner = new_owner
         batts = Battery.objects.filter(cell_test__in=CellTest.objects.filter(dataset=self))
-        with connection.cursor() as cursor:
-            cursor.execute(f"SET abd.change_owner_battid = {self.id}")
+        with change_owner(self.id):
             self.save(update_fields=["owner"])
-            cursor.execute(f"SET abd.change_owner_battid = {None}")
 
         for battery in batts:
             battery.update_owner(new_owner)
@@ -386,12 +398,51 @@ class AggData(BaseAggData):
                           discharge_capacity__isnull=False) & Q(discharge_c_rate__isnull=False))
             )
         ]
+        indexes = [
+            # cycle offsets from the cycle times instead of the raw data (CyclingTestManager.get_previous_cycle_id and
+            # shift_cycle_offsets)
+            models.Index(fields=['cycling_test', 'start_time'], name='aggdata_test_start_time_idx'),
+            models.Index(fields=['cycling_test', 'end_time'], name='aggdata_test_end_time_idx'),
+        ]
 
 
 class HPPCAggData(BaseAggData):
     hppc_test = models.ForeignKey(HPPCTest, on_delete=models.CASCADE)
 
 
+class BaseSummary(models.Model):
+    """Aggregates of the AggData which are maintained after an upload or a deletion instead of queried per request"""
+    nbr_of_cycles = models.PositiveIntegerField(default=0)
+    ave_temp = models.FloatField(null=True, blank=True)
+    charge_c_rates = ArrayField(models.FloatField(), default=list, blank=True)  # distinct, rounded with round_c_rates
+    discharge_c_rates = ArrayField(models.FloatField(), default=list, blank=True)
+    start_time = models.DateTimeField(null=True, blank=True)
+    end_time = models.DateTimeField(null=True, blank=True)
+    # capacity fade: discharge capacity per cycle
+    fade_cycle_ids = ArrayField(models.IntegerField(), default=list, blank=True)
+    fade_capacities = ArrayField(models.FloatField(), default=list, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+
+class CyclingTestSummary(BaseSummary):
+    cycling_test = models.OneToOneField(CyclingTest, on_delete=models.CASCADE, primary_key=True,
+                                        related_name='summary')
+    nbr_of_temperatures = models.PositiveIntegerField(default=0)  # weight of ave_temp in the battery summary
+
+    objects = CyclingTestSummaryManager()
+
+
+class BatterySummary(BaseSummary):
+    """Summary of all cycling tests of a battery, the fade_cycle_ids include the cycle offsets of the tests"""
+    battery = models.OneToOneField(Battery, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    nbr_of_tests = models.PositiveIntegerField(default=0)
+
+    objects = BatterySummaryManager()
+
+
 class TestData(TimescaleModel):
     voltage = models.FloatField()
     cell_temperature = models.FloatField(blank=True, null=True)
@@ -482,46 +533,58 @@ class UploadBatch(models.Model):
         super().save(force_insert, force_update, using, update_fields)
         return self
 
+    def find_duplicates(self):
+        """
+        Duplicates of all files of the batch in one query (index on checksum, status): successfully uploaded files and
+        files of queued or running jobs with the same checksum
+        @return: tuple (duplicates in the database, duplicates in the queue) as check_for_duplicates and
+                 check_for_duplicates_in_queue return them
+        """
+        queued = UploadFile.queued_jobs()
+        rows = UploadFile.objects.filter(
+            Q(batch=self) | Q(checksum__in=UploadFile.objects.filter(batch=self).values('checksum')) & (
+                    Q(status=UploadFile.StatusCodes.SUCCESSFUL) | Q(Exists(queued), forget=False))) \
+            .annotate(queued=Exists(queued)).order_by('pk') \
+            .values_list('pk', 'batch_id', 'checksum', 'file_name', 'status', 'forget', 'queued')
+
+        successful = defaultdict(list)
+        in_queue = defaultdict(list)
+        files = []
+        for pk, batch_id, checksum, file_name, status, forget, is_queued in rows:
+            if batch_id == self.pk:
+                files.append((pk, checksum))
+            if status == UploadFile.StatusCodes.SUCCESSFUL:
+                successful[checksum].append(pk)
+            elif is_queued and not forget:
+                in_queue[checksum].append(file_name)
+
+        return ([(pk, successful[checksum]) for pk, checksum in files if successful[checksum]],
+                [(pk, in_queue[checksum]) for pk, checksum in files if in_queue[checksum]])
+
     def check_for_duplicates(self):
         """
         Checks if there are any successfully uploaded files in the database with the same checksum
         @return: returns list of tuples with the primary key of the uploaded file and a list of the primary keys of the related duplicated files
         [(uploaded_file.pk, [duplicate0.pk, duplicate1.pk, duplicate2.pk, ...]), (...), ...]
         """
-        files = self.uploadfile_set.all()
-        duplicates_tuples_list = []
-        for uploaded_file in files:
-            duplicates = uploaded_file.get_duplicates()
-            if duplicates:
-                duplicates_tuples_list.append((uploaded_file.pk, duplicates))
-
-        return duplicates_tuples_list
+        return self.find_duplicates()[0]
 
     def check_for_duplicates_in_queue(self):
         """
         Checks if there are uploaded files with the same checksum in the queue and returns a list of filenames
         @return: returns list of tuples with the primary key of the uploaded file and list with filenames of duplicates found in the queue
         """
-        files = self.uploadfile_set.all()
-        duplicates_tuples_list = []
-        for uploaded_file in files:
-            duplicates = uploaded_file.get_duplicates_in_queue()
-            if duplicates:
-                duplicates_tuples_list.append((uploaded_file.pk, duplicates))
-
-        return duplicates_tuples_list
+        return self.find_duplicates()[1]
 
     def get_duplicate_batteries_from_database(self):
         duplicat_batteries = []
-        files = self.uploadfile_set.all()
+        files = set(self.uploadfile_set.values_list('file_name', 'kb'))
         if files:
-            queries = [Q(file_name=file.file_name) & Q(kb=file.kb) for file in files]
-            query = queries.pop()
-            for item in queries:
-                query |= item
-            uploadfiles = UploadFile.objects.filter(query)
+            # one query on the index (file_name, kb), the pairs are matched afterwards
+            uploadfiles = UploadFile.objects.filter(file_name__in={file_name for file_name, kb in files},
+                                                    kb__in={kb for file_name, kb in files}).select_related('battery')
             for file in uploadfiles:
-                if hasattr(file, 'battery'):
+                if (file.file_name, file.kb) in files and hasattr(file, 'battery'):
                     duplicat_batteries.append(file.battery)
         return duplicat_batteries
 
@@ -549,6 +612,10 @@ class UploadFile(models.Model):
         ERROR = 'ERROR', _('Error')
         UNHANDLED = 'UNHANDLED', _('Unhandled')
 
+    class ChecksumTypes(models.TextChoices):
+        MD5 = 'md5', _('MD5')  # uploads before the checksum was computed by the upload handlers
+        BLAKE2B = 'blake2b', _('BLAKE2b')  # 128 bit digest, see helpers.checksum
+
     batch = models.ForeignKey(UploadBatch, on_delete=models.RESTRICT)
     battery = models.ForeignKey(Battery, on_delete=models.CASCADE, null=True, blank=True)
     file = models.FileField(upload_to='uploadfiles')
@@ -562,6 +629,10 @@ class UploadFile(models.Model):
     forget = models.BooleanField(default=False)
     checksum = models.CharField(max_length=32, validators=[MinLengthValidator(32, 'Checksum has to be exact 32 long')],
                                 editable=False)
+    checksum_type = models.CharField(max_length=8, choices=ChecksumTypes.choices, default=ChecksumTypes.BLAKE2B,
+                                     editable=False)
+    # stages of the extraction {stage: {calls, wall, cpu, rows, rss, queries}}, see StageMetrics (metrics_helper)
+    metrics = models.JSONField(blank=True, null=True, editable=False)
 
     class Meta:
         constraints = [
@@ -575,6 +646,11 @@ class UploadFile(models.Model):
                 check=(Q(forget=False) | (Q(forget=True) & ~Q(status__exact='SUCCESS')))
             )
         ]
+        indexes = [
+            # duplicate detection of the uploads (UploadBatch.find_duplicates, get_duplicate_batteries_from_database)
+            models.Index(fields=['checksum', 'status'], name='uploadfile_checksum_idx'),
+            models.Index(fields=['file_name', 'kb'], name='uploadfile_name_kb_idx'),
+        ]
 
     def get_path(self):
         return self.file.path
@@ -597,14 +673,24 @@ class UploadFile(models.Model):
         list_result = [entry['pk'] for entry in result]
         return list_result
 
+    @staticmethod
+    def queued_jobs():
+        """
+        @return: queued or running jobs which extract the file (OuterRef), the files of QueueJob.get_files: a file
+                 which has a CellTest already is skipped by the jobs of its batch
+        """
+        from jobqueue_manager.models import QueueJob
+        return QueueJob.objects.filter(status__in=[QueueJob.StatusCodes.QUEUED, QueueJob.StatusCodes.RUNNING],
+                                       batch=OuterRef('batch')) \
+            .filter(Q(target_file__isnull=True) | Q(target_file=OuterRef('pk'))) \
+            .exclude(Exists(CellTest.objects.filter(file=OuterRef(OuterRef('pk')))))
+
     def get_duplicates_in_queue(self):
         """
         @return: returns a list of filenames of duplicate files found in the queue
         """
-        files_in_queue = []
-        [files_in_queue.extend(batch.files) for batch in manager.public_queue.batches]
-        names_and_checksums_in_queue = [(file.file_name, file.file_checksum) for file in files_in_queue]
-        return [item[0] for item in names_and_checksums_in_queue if item[1] == self.checksum]
+        return list(UploadFile.objects.filter(Exists(UploadFile.queued_jobs()), checksum=self.checksum, forget=False)
+                    .exclude(status=self.StatusCodes.SUCCESSFUL).order_by('pk').values_list('file_name', flat=True))
 
     def delete_file(self):
         """
@@ -650,6 +736,14 @@ class UploadFile(models.Model):
 
         self.save(update_fields=['status', 'error_details', 'is_deleted'])
 
+    def set_metrics(self, metrics):
+        """
+        Stores the metrics of the extraction of the file
+        @param metrics: StageMetrics.to_json()
+        """
+        self.metrics = metrics
+        self.save(update_fields=['metrics'])
+
     def set_forget(self):
         """
         Sets the forget-flag on the file to ignore this file.
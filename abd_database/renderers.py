@@ -0,0 +1,32 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .helpers import columnar
+
+
+class ColumnarRenderer(BaseRenderer):
+    """
+    Renders the {"fields": [...], "data": [[...]]} lists of the data endpoints with typed columns.
+    Selected with ?format=arrow / ?format=parquet or the Accept header. Large results are streamed by the views
+    instead, errors and other responses are rendered as json.
+    """
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        view = renderer_context.get('view')
+        if not isinstance(data, dict) or 'fields' not in data or not columnar.is_available():
+            renderer_context['response']['Content-Type'] = JSONRenderer.media_type
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+        schema = columnar.get_schema(view.model, data['fields'])
+        return columnar.render_columnar(data['data'], schema, self.format)
+
+
+class ArrowRenderer(ColumnarRenderer):
+    media_type = columnar.COLUMNAR_FORMATS['arrow'][0]
+    format = 'arrow'
+
+
+class ParquetRenderer(ColumnarRenderer):
+    media_type = columnar.COLUMNAR_FORMATS['parquet'][0]
+    format = 'parquet'
@@ -74,7 +74,6 @@ class BatteryTypeSerializer(serializers.ModelSerializer):
 
     def get_battery_format(self, obj):
         content_type = obj.content_type
-        object_id = obj.object_id
 
         if content_type.model == 'prismaformat':
             serializer = PrismaFormatSerializer
@@ -83,10 +82,10 @@ class BatteryTypeSerializer(serializers.ModelSerializer):
         else:
             return None
 
-        try:
-            instance = content_type.get_object_for_this_type(id=object_id)
-        except content_type.model_class().DoesNotExist:
-            return None  # Handle if object does not exist
+        # prefetched by the views, None if the object does not exist
+        instance = obj.content_object
+        if instance is None:
+            return None
 
         return serializer(instance, context=self.context).data
 
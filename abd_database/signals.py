@@ -1,10 +1,10 @@
-from django.db import connection, transaction
+from django.db import transaction
 
-from django.db.models import Max
+from django.db.models import Count, Max
 from django.db.models.signals import pre_delete, post_save
 from django.dispatch import receiver
 
-from abd_database.models import CellTest, CyclingTest, Dataset, Battery
+from abd_database.models import CellTest, CyclingTest, Dataset, Battery, BatterySummary
 
 
 @receiver(pre_delete, sender=CellTest)
@@ -23,39 +23,29 @@ def pre_cleanup_cycle_offset(sender, **kwargs):
 
     if sender == CellTest:
 
-        t = kwargs['instance'].cyclingtest_test_type.aggdata_set.filter(
-            cycling_test=kwargs['instance'].cyclingtest_test_type).aggregate(Max('end_time'))['end_time__max']
-
-        if t is not None:
-            # gets all cycle_id's from battery where time is later than last timestamp in deleting celltest
-            sql = f'''SELECT DISTINCT(cyclingtest.id)
-                FROM public.abd_database_battery as battery
-                INNER JOIN public.abd_database_celltest as celltest on battery.id=celltest.battery_id
-                INNER JOIN public.abd_database_cyclingtest as cyclingtest on celltest.id=cyclingtest."cellTest_id"
-                INNER JOIN public.abd_database_aggdata as aggdata on cyclingtest.id=aggdata."cycling_test_id"
-                INNER JOIN public.abd_database_cyclingrawdata as rawdata on aggdata.id=rawdata.agg_data_id
-                WHERE battery.id={kwargs['instance'].cyclingtest_test_type.cellTest.battery.id} AND time>'{t}'
-                ORDER BY cyclingtest.id ASC'''
-
-            cycletest_ids = None
-            with connection.cursor() as cursor:
-                cursor.execute(sql)
-                result = cursor.fetchall()
-                if result:
-                    cycletest_ids = [x[0] for x in result]
-
-        else:
-            # if time query returns none no relevant tests can be selected
-            cycletest_ids = []
-
-        cycle_offset = kwargs['instance'].cyclingtest_test_type.aggdata_set.count()
-
-        # subtracts the length of the deleting test from the offset from all tests after the deleting one.
-        if cycletest_ids:
-            for id in cycletest_ids:
-                cycletest = CyclingTest.objects.get(pk=id)
-                cycletest.cycle_offset = cycletest.cycle_offset - cycle_offset
-                cycletest.save(update_fields=['cycle_offset'])
+        cycles = kwargs['instance'].cyclingtest_test_type.aggdata_set.aggregate(end_time=Max('end_time'),
+                                                                                 count=Count('pk'))
+
+        if cycles['end_time'] is not None:
+            # subtracts the length of the deleting test from the offset of all tests with cycles after the deleting one
+            CyclingTest.objects.shift_cycle_offsets(kwargs['instance'].battery_id, -cycles['count'],
+                                                    after=cycles['end_time'])
+
+
+@receiver(pre_delete, sender=CellTest)
+def refresh_battery_summary(sender, instance, **kwargs):
+    """Removes a deleted test from the summary of its battery
+
+        Runs after pre_cleanup_cycle_offset, so the capacity fade uses the adjusted cycle offsets.
+        Only an existing summary is updated, when the battery itself is deleted it is removed with the battery.
+
+    Args:
+        sender: CellTest model class
+        instance: Instance of the CellTest that is deleted
+    """
+    if BatterySummary.objects.filter(battery_id=instance.battery_id).exists():
+        deleted_tests = list(CyclingTest.objects.filter(cellTest=instance).values_list('pk', flat=True))
+        BatterySummary.objects.refresh(instance.battery, exclude_cycling_tests=deleted_tests)
 
 
 @receiver(post_save, sender=Dataset)
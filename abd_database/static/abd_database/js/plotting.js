@@ -83,4 +83,53 @@ function residualPlot(graph, x, residuals, baseline, xlabel) {
     }
 
     Plotly.newPlot(graph, data, layout);
-}
\ No newline at end of file
+}
+
+
+// column of the plot data of the server: base64 encoded little endian float32 or plain array
+function decodeColumn(column) {
+    if (Array.isArray(column)) {
+        return column;
+    }
+    var binary = atob(column.data);
+    var bytes = new Uint8Array(binary.length);
+    for (var i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return new Float32Array(bytes.buffer);
+}
+
+// plots the compact plot data of the server (marker traces and axis titles) or a complete plotly figure
+function showPlot(graph, plot) {
+    if (!plot.traces) {
+        Plotly.newPlot(graph, plot);
+        return;
+    }
+    var data = plot.traces.map(function (trace) {
+        var marker = {size: 12};
+        if (trace.color) {
+            marker.color = trace.color;
+        }
+        return {
+            x: decodeColumn(trace.x),
+            y: decodeColumn(trace.y),
+            type: 'scatter',
+            mode: 'markers',
+            name: trace.name,
+            showlegend: true,
+            marker: marker
+        };
+    });
+
+    var layout = {
+        xaxis: {
+            title: plot.layout.x_title
+        },
+        yaxis: {
+            title: plot.layout.y_title
+        },
+        height: 400
+    }
+
+    Plotly.newPlot(graph, data, layout);
+}
@@ -1,6 +1,6 @@
 from django import template
 import queue_settings
-from jobqueue_manager import manager
+from jobqueue_manager.models import QueueJob
 
 register = template.Library()
 
@@ -17,9 +17,7 @@ def get_max_batch_size():
 
 @register.simple_tag(name="get_current_queue_size")
 def get_current_queue_size():
-    if manager.public_queue:
-        return int(manager.public_queue.get_total_size()/1000)
-    return 0
+    return int(QueueJob.objects.get_total_size()/1000)
 
 
 @register.simple_tag(name="is_in_queue")
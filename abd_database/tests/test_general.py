@@ -1,6 +1,15 @@
+import gzip
+import io
+import unittest
+
+import numpy as np
+
 from django.test import TestCase
 
+from abd_database.helpers import columnar
+
 from abd_database.models import *
+from datetime import datetime, timezone
 from django.contrib.contenttypes.models import ContentType
 
 class TypeLimitTests(TestCase):
@@ -17,3 +26,117 @@ class TypeLimitTests(TestCase):
         #                           Q(app_label='abd_database', model='cylinderisonorm')]
         #                          )
         self.assertEqual(2, len(ContentType.objects.filter(get_type_limit(('prismaisonorm', 'cylinderisonorm')))))
+
+
+class ExportTests(TestCase):
+
+    def test_stream_csv_in_chunks(self):
+        """
+        the streamed csv pieces together are the complete csv file, the gzip stream decompresses to the same
+        """
+        from abd_database.views_export import stream_csv, stream_gzip
+        header_rows = [['cycle_id', 'voltage'], ['', 'V']]
+        chunks = [[(1, 3.7), (1, 3.8)], [(2, None)]]
+        expected = "cycle_id,voltage\r\n,V\r\n1,3.7\r\n1,3.8\r\n2,\r\n"
+        self.assertEqual("".join(stream_csv(chunks, header_rows)), expected)
+        compressed = b"".join(stream_gzip(stream_csv(chunks, header_rows)))
+        self.assertEqual(gzip.decompress(compressed).decode(), expected)
+
+    @unittest.skipUnless(columnar.is_available(), 'pyarrow is not installed')
+    def test_stream_columnar_row_groups(self):
+        """
+        every chunk is one row group of the parquet file, the arrow stream holds the same typed columns
+        """
+        import pyarrow.ipc
+        import pyarrow.parquet
+        fields = ['time', 'voltage', 'cycle_id']
+        schema = columnar.get_schema(CyclingRawData, fields, ['', 'V', ''])
+        time = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        chunks = [[(time, 3.7, 1), (time, 3.8, 1)], [(time, None, 2)]]
+
+        parquet = pyarrow.parquet.ParquetFile(io.BytesIO(b"".join(columnar.stream_columnar(chunks, schema,
+                                                                                            'parquet'))))
+        self.assertEqual(parquet.num_row_groups, 2)
+        table = parquet.read()
+        self.assertEqual(table.column_names, fields)
+        self.assertEqual(table.column('voltage').to_pylist(), [3.7, 3.8, None])
+        self.assertEqual(table.schema.field('voltage').metadata, {b'unit': b'V'})
+
+        stream = pyarrow.ipc.open_stream(b"".join(columnar.stream_columnar(chunks, schema, 'arrow')))
+        self.assertTrue(stream.read_all().equals(table))
+
+
+class DownsamplingTests(TestCase):
+
+    def test_min_max_keeps_extremes(self):
+        """
+        every group keeps about max_points rows including its extremes, first and last row, small groups keep all rows
+        """
+        from abd_database.helpers.downsampling import min_max_indices
+        y = np.sin(np.linspace(0, 10, 10000))
+        y[1234] = 5
+        groups = np.repeat([1, 2], [10000, 10])
+        indices = min_max_indices(np.r_[y, np.arange(10)], 100, groups)
+        self.assertLessEqual(len(indices), 100 + 2 + 10)
+        self.assertIn(1234, indices)
+        self.assertIn(0, indices)
+        self.assertIn(9999, indices)
+        self.assertEqual(indices[-10:].tolist(), list(range(10000, 10010)))
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
+
+class PlotDataTests(TestCase):
+
+    def test_encode_column(self):
+        """binary columns are little endian float32 (decodeColumn of plotting.js), lists have None instead of NaN"""
+        import base64
+        from abd_database.helpers.plot_data import encode_column
+        values = [1.5, np.nan, -2.25]
+        column = encode_column(values)
+        decoded = np.frombuffer(base64.b64decode(column['data']), dtype='<f4')
+        self.assertEqual(column['dtype'], 'float32')
+        np.testing.assert_array_equal(decoded, np.array(values, dtype='<f4'))
+        self.assertEqual(encode_column(values, binary=False), [1.5, None, -2.25])
+
+
+class PreparedStatementTests(TestCase):
+
+    def test_execute_prepared(self):
+        """the query is prepared once per connection, later calls only execute it"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from abd_database.helpers.db import execute_prepared, to_positional
+        self.assertEqual(to_positional("a = %s AND b LIKE 'x%%' AND c = ANY(%s)"),
+                         "a = $1 AND b LIKE 'x%' AND c = ANY($2)")
+        sql = "SELECT x FROM unnest(%s::int[]) AS x WHERE x > %s ORDER BY x"
+        with connection.cursor() as cursor, CaptureQueriesContext(connection) as queries:
+            execute_prepared(cursor, sql, [[1, 2, 3], 1])
+            self.assertEqual(cursor.fetchall(), [(2,), (3,)])
+            execute_prepared(cursor, sql, [[4, 5], 4])
+            self.assertEqual(cursor.fetchall(), [(5,)])
+        self.assertEqual([query['sql'].split()[0] for query in queries.captured_queries],
+                         ['PREPARE', 'EXECUTE', 'EXECUTE'])
+
+    def test_field_list_is_checked(self):
+        """field names which are no column of the table never reach the SQL"""
+        sql, params = CyclingRawData.objects.get_data_for_battery_sql(1, ['time', 'voltage'])
+        self.assertIn('"abd_database_cyclingrawdata"."voltage"', sql)
+        self.assertEqual(params, (1,))
+        with self.assertRaises(ValueError):
+            CyclingRawData.objects.get_data_for_battery_sql(1, ['time', 'voltage" FROM pg_user --'])
+
+
+class ChecksumTests(TestCase):
+
+    def test_upload_handler_checksum(self):
+        """uploads are hashed while they are received, in memory (small files) and in temporary files"""
+        import hashlib
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import RequestFactory
+        from abd_database.helpers.checksum import get_file_checksum
+        for size in (1000, 5 * 1024 * 1024):
+            data = bytes(range(256)) * (size // 256)
+            request = RequestFactory().post('/', {'file_field': SimpleUploadedFile('test.csv', data)})
+            uploaded = request.FILES['file_field']
+            self.assertEqual(uploaded.checksum, hashlib.blake2b(data, digest_size=16).hexdigest())
+            self.assertEqual(get_file_checksum(uploaded), uploaded.checksum)
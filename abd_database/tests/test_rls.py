@@ -2,15 +2,16 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.management import call_command
 from django.db import connection
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.db.utils import ProgrammingError, DatabaseError
 from django.db.models import ObjectDoesNotExist
 from django.core.exceptions import ValidationError
 
 from abd_database.models import Battery, BatteryType, Supplier, ChemicalType, Dataset, CellTest, UploadFile, \
-    CyclingTest, AggData, CyclingRawData
+    CyclingTest, AggData, CyclingRawData, BatterySummary, CyclingTestSummary
 from abd_management.models import Organisation, User
-from abd_database.helpers.db import set_active_tenant
+from abd_database.helpers.db import change_owner, set_active_tenant
 
 from django.conf import settings
 
@@ -1813,3 +1814,183 @@ class RLSTestCase(TransactionTestCase):
         self.assertEqual(nbr_cyclingtests_before - 1, nbr_cyclingtests_after)
         # Check if cyclingtest still exists
         self.assertFalse(CyclingTest.objects.filter(id=cyclingtest_id).exists())
+
+    ##################################################### SUMMARY #####################################################
+    def test_battery_summary_refresh_and_delete(self):
+        print("test_battery_summary_refresh_and_delete\n")
+        set_active_tenant(self.owner_user.company_id)
+        CyclingTestSummary.objects.refresh(self.owned_cyclingtest.id)
+        summary = BatterySummary.objects.refresh(self.owned_battery)
+        self.assertEqual(summary.nbr_of_tests, 1)
+        self.assertEqual(summary.nbr_of_cycles, 1)
+        self.assertEqual(summary.charge_c_rates, [1.0])
+        self.assertEqual(summary.discharge_c_rates, [])
+        # the deleted test is removed from the summary by the pre_delete signal
+        self.owned_celltest.delete()
+        summary = BatterySummary.objects.get(battery=self.owned_battery)
+        self.assertEqual(summary.nbr_of_tests, 0)
+        self.assertEqual(summary.nbr_of_cycles, 0)
+
+    def test_battery_summary_other_tenant(self):
+        print("test_battery_summary_other_tenant\n")
+        set_active_tenant(self.owner_user.company_id)
+        BatterySummary.objects.refresh(self.owned_battery)
+        # summaries of private batteries are not visible for other tenants and can not be written by them
+        set_active_tenant(self.other_user.company_id)
+        self.assertFalse(BatterySummary.objects.filter(battery_id=self.owned_battery.id).exists())
+        with self.assertRaises(DatabaseError):
+            CyclingTestSummary.objects.create(cycling_test_id=self.public_cyclingtest.id)
+
+    ################################################## QUERY COUNTS ###################################################
+    def assertConstantQueries(self, request, add_rows):
+        """
+        The request issues the same number of queries after add_rows added more rows to the pages (no query per row)
+        """
+        request()  # warms up caches like the content types
+        with CaptureQueriesContext(connection) as before:
+            request()
+        add_rows()
+        with CaptureQueriesContext(connection) as after:
+            request()
+        self.assertEqual(len(before), len(after), "\n".join(query['sql'] for query in after.captured_queries))
+
+    def add_owned_battery_with_cycles(self):
+        set_active_tenant(self.owner_user.company_id)
+        battery_type = BatteryType.objects.create(supplier=Supplier.objects.all().first(), specific_type='OTHER',
+                                                  theoretical_capacity=50,
+                                                  chemical_type_cathode=ChemicalType.objects.all().first(),
+                                                  content_type=ContentType.objects.get(model='prismaformat'),
+                                                  object_id=1)
+        battery = Battery.objects.create(owner=self.owner_org, battery_type=battery_type, weight=100, vmax=4.2,
+                                         vnom=3.7, vmin=3.0, prod_year=2016, private=True)
+        for dataset in (self.private_dataset_owner, self.public_dataset):
+            CellTest.objects.create(battery=battery, file=UploadFile.objects.all().first(), date=timezone.now(),
+                                    dataset=dataset)
+        celltest = CellTest.objects.create(battery=self.owned_battery, file=UploadFile.objects.all().first(),
+                                           date=timezone.now(), dataset=self.private_dataset_owner)
+        cyclingtest = CyclingTest.objects.create(cellTest=celltest, cycle_offset=1)
+        for cycle_id in (1, 2):
+            AggData.objects.create(cycling_test=cyclingtest, cycle_id=cycle_id, start_time=timezone.now(),
+                                   end_time=timezone.now(), min_voltage=3, max_voltage=4, charge_capacity=10,
+                                   charge_c_rate=1)
+
+    def test_query_count_battery_pages(self):
+        print("test_query_count_battery_pages\n")
+        self.client.force_login(self.owner_user)
+
+        def get_pages():
+            for url in ("/database/0/", "/database/type/", f"/database/batt_{self.owned_battery.id}/"):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.assertConstantQueries(get_pages, self.add_owned_battery_with_cycles)
+
+    def test_query_count_capacity_tab(self):
+        print("test_query_count_capacity_tab\n")
+        self.client.force_login(self.owner_user)
+
+        def get_capacity_tab():
+            set_active_tenant(self.owner_user.company_id)
+            cycles = list(AggData.objects.filter(cycling_test__cellTest__battery=self.owned_battery)
+                          .values_list('pk', flat=True))
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(f"/database/batt_{self.owned_battery.id}/",
+                                            {'tab': 'capacity-tab', 'battery_pk': self.owned_battery.id,
+                                             'selected_cycles[]': cycles},
+                                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        queries_before = get_capacity_tab()
+        self.add_owned_battery_with_cycles()
+        # two more selected cycles
+        self.assertEqual(get_capacity_tab(), queries_before)
+
+    def test_query_count_api_lists(self):
+        print("test_query_count_api_lists\n")
+        self.client.force_login(self.owner_user)
+
+        def get_lists():
+            for url in ("/database/api/batteries/", "/database/api/battery_types/",
+                        f"/database/api/cycles/?battery={self.owned_battery.id}"):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.assertConstantQueries(get_lists, self.add_owned_battery_with_cycles)
+
+    ################################################## FIGURE CACHE ###################################################
+    def test_figure_cache_data_version(self):
+        print("test_figure_cache_data_version\n")
+        set_active_tenant(self.owner_user.company_id)
+        BatterySummary.objects.refresh(self.owned_battery)
+        cyclingtest = CyclingTest.objects.select_related('cellTest').get(pk=self.owned_cyclingtest.id)
+        figure = CyclingTest.objects.plot_cycles(cyclingtest)
+        # a cached figure only reads the data version
+        with self.assertNumQueries(1):
+            self.assertEqual(CyclingTest.objects.plot_cycles(cyclingtest), figure)
+        # the summary refresh of an extraction is a new data version
+        AggData.objects.create(cycling_test=self.owned_cyclingtest, cycle_id=2, start_time=timezone.now(),
+                               end_time=timezone.now(), min_voltage=3, max_voltage=4, charge_capacity=9,
+                               charge_c_rate=1)
+        BatterySummary.objects.refresh(self.owned_battery)
+        self.assertNotEqual(CyclingTest.objects.plot_cycles(cyclingtest), figure)
+
+    ################################################## CYCLE OFFSETS ##################################################
+    def test_cycle_offsets(self):
+        print("test_cycle_offsets\n")
+        set_active_tenant(self.owner_user.company_id)
+        start_time = self.owned_aggdata.start_time
+        end_time = self.owned_aggdata.end_time
+        celltest = CellTest.objects.create(battery=self.owned_battery, file=UploadFile.objects.all().first(),
+                                           date=timezone.now(), dataset=self.private_dataset_owner)
+        later_cyclingtest = CyclingTest.objects.create(cellTest=celltest)
+        AggData.objects.create(cycling_test=later_cyclingtest, cycle_id=7,
+                               start_time=end_time + timezone.timedelta(days=1),
+                               end_time=end_time + timezone.timedelta(days=2), min_voltage=3, max_voltage=4,
+                               charge_capacity=10, charge_c_rate=1)
+
+        # the last cycle which started before the date
+        self.assertIsNone(CyclingTest.objects.get_previous_cycle_id(self.owned_battery, start_time))
+        self.assertEqual(CyclingTest.objects.get_previous_cycle_id(self.owned_battery, end_time), 1)
+        self.assertEqual(CyclingTest.objects.get_previous_cycle_id(self.owned_battery.id,
+                                                                   end_time + timezone.timedelta(days=3)), 7)
+        # only the tests with cycles after the time are shifted, in one query
+        with self.assertNumQueries(1):
+            self.assertEqual(CyclingTest.objects.shift_cycle_offsets(self.owned_battery, 3, after=end_time), 1)
+        self.assertEqual(CyclingTest.objects.get(pk=later_cyclingtest.pk).cycle_offset, 3)
+        self.assertEqual(CyclingTest.objects.get(pk=self.owned_cyclingtest.pk).cycle_offset, 0)
+        # deleting a test subtracts its cycles from the later tests
+        CellTest.objects.get(pk=self.owned_celltest.pk).delete()
+        self.assertEqual(CyclingTest.objects.get(pk=later_cyclingtest.pk).cycle_offset, 2)
+
+    ############################################### POLICY PERFORMANCE ###############################################
+    def test_policies_use_indexes(self):
+        print("test_policies_use_indexes\n")
+        set_active_tenant(self.owner_user.company_id)
+        with connection.cursor() as cursor:
+            # the tables of the test are tiny, without sequential scans the plans show whether the policy clauses are
+            # index conditions (a comparison of a cast column is only possible with a sequential scan)
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                for table in ("abd_database_battery", "abd_database_dataset"):
+                    for sql in (f"SELECT id FROM {table}", f"UPDATE {table} SET private = private",
+                                f"DELETE FROM {table}"):
+                        cursor.execute(f"EXPLAIN {sql}")
+                        plan = "\n".join(row[0] for row in cursor.fetchall())
+                        self.assertNotIn("Seq Scan", plan, plan)
+                        self.assertIn("Index", plan, plan)
+            finally:
+                cursor.execute("RESET enable_seqscan")
+
+    def test_tenant_set_once(self):
+        print("test_tenant_set_once\n")
+        set_active_tenant(self.owner_user.company_id)
+        # the connection already carries the tenant
+        with self.assertNumQueries(0):
+            set_active_tenant(self.owner_user.company_id)
+        with self.assertNumQueries(1):
+            set_active_tenant(self.other_user.company_id)
+        # an owner change resets the session with the next request
+        with change_owner(self.owned_battery.id):
+            pass
+        with self.assertNumQueries(1):
+            set_active_tenant(self.other_user.company_id)
+        self.assertEqual(list(Battery.objects.filter(pk=self.owned_battery.pk)), [])
@@ -1,5 +1,9 @@
+from datetime import datetime, timedelta, timezone
+
 from django.contrib.auth.hashers import make_password
-from rest_framework.test import APITransactionTestCase
+from django.test import SimpleTestCase
+from rest_framework.request import Request
+from rest_framework.test import APITransactionTestCase, APIRequestFactory
 from abd_database import models
 from abd_database import serializers
 from abd_management.models import Organisation, User
@@ -7,6 +11,7 @@ from django.contrib.contenttypes.models import ContentType
 from rest_framework import status
 from django.conf import settings
 from abd_database.helpers.db import set_active_tenant
+from abd_database.views_api import decode_cursor, get_max_rows, paginate
 
 
 class BatteryTestCase(APITransactionTestCase):
@@ -119,3 +124,33 @@ class BatteryTestCase(APITransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         self.assertEqual(len(response.data), 1)
+
+    def test_get_raw_data_unknown_fields(self):
+        self.client.login(username="admin", password="admin")
+
+        response = self.client.get(f"/database/api/cycling_rawdata/?battery={self.battery.pk}"
+                                   f"&fields=time,voltage,volts,agg_data")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'fields': ['unknown field(s): volts, agg_data']})
+
+
+class PaginationTestCase(SimpleTestCase):
+
+    def test_keyset_pagination(self):
+        """
+        a page holds max_rows rows without the sort key, the next link continues after the sort key of the last row
+        """
+        time = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        rows = [(3.7, time, 1), (3.8, time, 2), (3.9, time + timedelta(seconds=1), 3)]
+        request = Request(APIRequestFactory().get('/database/api/cycling_rawdata/?battery=1&max_rows=2'))
+
+        self.assertEqual(get_max_rows(request), 2)
+        page, next_url = paginate(request, rows, 2)
+        self.assertEqual(page, [(3.7,), (3.8,)])
+        next_request = Request(APIRequestFactory().get(next_url))
+        self.assertEqual(decode_cursor(next_request), [time.isoformat(), 2])
+        self.assertEqual(next_request.query_params['max_rows'], '2')
+
+        self.assertEqual(paginate(request, rows, 3), ([(3.7,), (3.8,), (3.9,)], None))
+        self.assertIsNone(decode_cursor(request))
@@ -33,7 +33,7 @@ class BatteryTypeView(generic.ListView):
 
     def get_queryset(self):
 
-        battery_list = Battery.objects.all() # filtering solved by RLS
+        battery_list = Battery.objects.with_details()  # filtering solved by RLS
 
         temp_id = None
         battery_type_dict = []
@@ -89,7 +89,7 @@ class BatteryView(generic.ListView):
 
     def get_queryset(self, **kwargs):
         dataset_pk = self.kwargs['ds']
-        return Battery.objects.all()
+        return Battery.objects.with_details()
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(object_list=object_list, **kwargs)
@@ -111,7 +111,7 @@ class BatteryDetail(FormView):
 
     def get(self, request, pk):
         context = {}
-        battery = self.model.objects.get(pk=pk)
+        battery = self.model.objects.with_details().get(pk=pk)
         context['battery'] = battery
         context['has_tests'] = battery.cell_test.exists()
         context['cycling_tests'] = CyclingTest.objects.get_cycling_tests_for_battery(battery)
@@ -130,7 +130,8 @@ class BatteryDetail(FormView):
                 tab = self.request.POST['tab']
                 if tab == "cycles-tab":
                     test_pk = int(self.request.POST['selection'])
-                    graph = CyclingTest.objects.plot_cycles(CyclingTest.objects.get(pk=test_pk), as_dict=True)
+                    graph = CyclingTest.objects.plot_cycles(CyclingTest.objects.select_related('cellTest').get(pk=test_pk),
+                                                           as_dict=True)
                     return JsonResponse({'graph': graph}, status=200)
                 elif tab == "capacity-tab":
                     data = {}
@@ -1,26 +1,110 @@
+import base64
+import json
+from datetime import datetime
+
+from django.utils.dateparse import parse_datetime
 from rest_framework import generics
-from rest_framework import viewsets, response
+from rest_framework import viewsets, response, exceptions
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 from .models import Battery, BatteryType, AggData, CyclingRawData, CellTest, Dataset, CyclingTest
+from .helpers import columnar
+from .helpers.db import get_invalid_columns
 from .permissions import ReadOnly
+from .renderers import ArrowRenderer, ColumnarRenderer, ParquetRenderer
 from .serializers import BatterySerializer, BatteryTypeSerializer, AggDataSerializer, CyclingRawDataSerializer, \
     CellTestSerializer, DatasetSerializer, CyclingTestSerializer
 
 from .helpers.modelHelper import save_files
 from .helpers.upload import add_duplicates_to_queue
+from .views_export import columnar_response, get_database
+
+MAX_ROWS = 100000  # rows of one page of the data lists, larger results are continued with the next link
+
 
 def string_to_list(string_list):
     return [int(c) for c in string_list.split(',')]
 
 
+def get_int_param(request, name):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise exceptions.ValidationError({name: 'integer expected'})
+
+
+def get_time_param(request, name):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        time = parse_datetime(value)
+    except ValueError:
+        time = None
+    if time is None:
+        raise exceptions.ValidationError({name: 'ISO 8601 date and time expected'})
+    return time
+
+
+def get_max_rows(request):
+    max_rows = get_int_param(request, 'max_rows')
+    return MAX_ROWS if max_rows is None else max(1, min(max_rows, MAX_ROWS))
+
+
+def encode_cursor(key):
+    key = [value.isoformat() if isinstance(value, datetime) else value for value in key]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(request):
+    """@return: sort key of the last row of the previous page, None for the first page"""
+    cursor = request.query_params.get('cursor')
+    if cursor is None:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        key = None
+    if not isinstance(key, list) or len(key) != 2:
+        raise exceptions.ValidationError({'cursor': 'invalid cursor'})
+    return key
+
+
+def paginate(request, rows, max_rows):
+    """
+    Keyset pagination: the page is queried with max_rows + 1 rows and the sort key of every row appended as the last
+    two columns. The next page continues after the sort key of the last row, so deep pages are as fast as the first.
+    @return: rows of the page without the sort key, url of the next page or None for the last page
+    """
+    next_url = None
+    if len(rows) > max_rows:
+        rows = rows[:max_rows]
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', encode_cursor(rows[-1][-2:]))
+    return [row[:-2] for row in rows], next_url
+
+
+def is_columnar(request):
+    """True if arrow or parquet is requested, which needs pyarrow on the server"""
+    if not isinstance(request.accepted_renderer, ColumnarRenderer):
+        return False
+    if not columnar.is_available():
+        raise exceptions.NotAcceptable('pyarrow is not installed on the server')
+    return True
+
+
 class BatteryDetail(generics.RetrieveAPIView):
-    queryset = Battery.objects.all()
+    queryset = Battery.objects.with_details()
     serializer_class = BatterySerializer
     permission_classes = [ReadOnly]
 
 
 class BatteryTypeDetail(generics.RetrieveAPIView):
-    queryset = BatteryType.objects.all()
+    queryset = BatteryType.objects.select_related('chemical_type_cathode', 'content_type') \
+        .prefetch_related('content_object')
     serializer_class = BatteryTypeSerializer
     permission_classes = [ReadOnly]
 
@@ -37,7 +121,8 @@ class BatteryTypeViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint to view and edit Battery types
     """
-    queryset = BatteryType.objects.all()
+    queryset = BatteryType.objects.select_related('chemical_type_cathode', 'content_type') \
+        .prefetch_related('content_object')
     serializer_class = BatteryTypeSerializer
 
 
@@ -45,7 +130,7 @@ class BatteryViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows Batteries to be viewed and edited
     """
-    queryset = Battery.objects.all()
+    queryset = Battery.objects.with_details()
     serializer_class = BatterySerializer
     # filter_backends = [HasPermissionFilterBackend]
 
@@ -60,10 +145,10 @@ class BatteryViewSet(viewsets.ReadOnlyModelViewSet):
 
         dataset_pk = self.request.query_params.get('dataset')
         if dataset_pk is not None:
-            queryset = Battery.objects.filter(
+            queryset = Battery.objects.with_details().filter(
                 cell_test__dataset=dataset_pk).distinct()
         else:
-            queryset = Battery.objects.all()
+            queryset = Battery.objects.with_details()
 
         return queryset
 
@@ -87,6 +172,20 @@ class AggDataViewSet(viewsets.ReadOnlyModelViewSet):
     """
     serializer_class = AggDataSerializer
     queryset = AggData.objects.all()
+    model = AggData
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ArrowRenderer, ParquetRenderer]
+
+    def get_filter(self):
+        battery = self.request.query_params.get('battery')
+        celltest = self.request.query_params.get('cell_tests')
+
+        if battery is None:
+            raise Exception('GET without battery filter not allowed')
+        if celltest is not None:
+            celltest = string_to_list(celltest)
+        return {'battery': battery, 'cell_tests': celltest,
+                'min_cycle': get_int_param(self.request, 'min_cycle'),
+                'max_cycle': get_int_param(self.request, 'max_cycle')}
 
     def get_queryset(self):
         """
@@ -100,34 +199,30 @@ class AggDataViewSet(viewsets.ReadOnlyModelViewSet):
         if 'pk' in self.kwargs:
             return super().get_queryset()
 
-        queryset = None
-
-        battery = self.request.query_params.get('battery')
-        celltest = self.request.query_params.get('cell_tests')
-
-        if battery is not None:
-            if celltest is not None:
-                celltest = string_to_list(celltest)
-            queryset = AggData.objects.get_agg_data_for_battery(battery=battery, cell_tests=celltest)
-
-        else:
-            raise Exception('GET without battery filter not allowed')
-
-        return queryset
+        return AggData.objects.get_agg_data_for_battery(**self.get_filter(), after=decode_cursor(self.request),
+                                                        limit=get_max_rows(self.request) + 1)
 
     def list(self, request, *args, **kwargs):
         """
         Custom implementation of list view:
         Returns a list of fields and nested list with the data, instead of default behaviour (field-value pairs for each
         query item)
+        The list is paginated by max_rows, "next" is the url of the next page.
         """
 
         fields = ["id", "cycling_test_id", "cycle_id", "charge_capacity", "discharge_capacity", "efficiency",
                   "charge_c_rate", "discharge_c_rate", "ambient_temperature", "error_codes"]
 
-        queryset = self.get_queryset()
+        if is_columnar(request):
+            filters = self.get_filter()
+            return columnar_response(
+                lambda using: AggData.objects.iterate_agg_data_for_battery(**filters, using=using),
+                columnar.get_schema(self.model, fields), request.accepted_renderer.format,
+                f'battery_{filters["battery"]}-cycles', *get_database(request.user))
+
+        queryset, next_url = paginate(request, self.get_queryset(), get_max_rows(request))
 
-        return response.Response({"fields": fields, "data": queryset})
+        return response.Response({"fields": fields, "data": queryset, "next": next_url})
 
 
 class CyclingRawDataViewSet(viewsets.ReadOnlyModelViewSet):
@@ -135,29 +230,38 @@ class CyclingRawDataViewSet(viewsets.ReadOnlyModelViewSet):
     API endpoint to retrieve and edit cycling raw data
     """
     serializer_class = CyclingRawDataSerializer
+    model = CyclingRawData
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ArrowRenderer, ParquetRenderer]
+
+    def get_fields(self):
+        fields = self.request.query_params.get('fields')
+        if fields is None:
+            return ["id", "time", "voltage", "current", "capacity", "energy", "agg_data_id", "cycle_id",
+                    "step_flag", "time_in_step", "cell_temperature", "ambient_temperature"]
+        fields = fields.split(',')
+        invalid = get_invalid_columns(CyclingRawData, fields)
+        if invalid:
+            raise exceptions.ValidationError({'fields': f'unknown field(s): {", ".join(invalid)}'})
+        return fields
 
     def get_queryset(self):
         cycles = self.request.query_params.get('cycles')
         battery = self.request.query_params.get('battery')
-        fields = self.request.query_params.get('fields')
+        fields = self.get_fields()
 
         assert (battery is None) or (cycles is None), 'filtering cycles and battery is not allowed'
 
-        if fields is None:
-            fields = ["id", "time", "voltage", "current", "capacity", "energy", "agg_data_id", "cycle_id",
-                      "step_flag", "time_in_step", "cell_temperature", "ambient_temperature"]
-        else:
-            fields = [field for field in fields.split(',')]
-
         queryset = None
 
         if cycles is not None:
             cycles = string_to_list(cycles)
-            queryset = CyclingRawData.objects.capacity_vs_voltage_for_cycles(cycles=cycles, api=True,
-                                                                             field_list=fields)
+            queryset = CyclingRawData.objects.capacity_vs_voltage_for_cycles(
+                cycles=cycles, api=True, field_list=fields, max_points=get_int_param(self.request, 'resolution'))
 
         if battery is not None:
-            queryset = CyclingRawData.objects.get_data_for_battery(battery, fields)
+            queryset = CyclingRawData.objects.get_data_for_battery(
+                battery, fields, start=get_time_param(self.request, 'start'), end=get_time_param(self.request, 'end'),
+                after=decode_cursor(self.request), limit=get_max_rows(self.request) + 1)
 
         if queryset is None:
             raise Exception('Not supported request string')
@@ -169,11 +273,26 @@ class CyclingRawDataViewSet(viewsets.ReadOnlyModelViewSet):
         Custom implementation of list view:
         Returns a list of fields and nested list with the data, instead of default behaviour (field-value pairs for each
         query item)
+        The raw data of a battery is paginated by max_rows, "next" is the url of the next page.
+        With ?format=arrow or ?format=parquet the raw data of a battery is streamed in typed columns.
         """
 
+        battery = request.query_params.get('battery')
+        if battery is not None and request.query_params.get('cycles') is None and is_columnar(request):
+            fields = self.get_fields()
+            start, end = get_time_param(request, 'start'), get_time_param(request, 'end')
+            return columnar_response(
+                lambda using: CyclingRawData.objects.iterate_data_for_battery(battery, fields, start, end,
+                                                                              using=using),
+                columnar.get_schema(self.model, fields), request.accepted_renderer.format,
+                f'battery_{battery}-raw_data', *get_database(request.user))
+
         queryset, fields = self.get_queryset()
+        if battery is None:
+            return response.Response({"fields": fields, "data": queryset})
 
-        return response.Response({"fields": fields, "data": queryset})
+        queryset, next_url = paginate(request, queryset, get_max_rows(request))
+        return response.Response({"fields": fields, "data": queryset, "next": next_url})
 
 # not rdy for release
 # class H5Upload(viewsets.ViewSet):
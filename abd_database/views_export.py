@@ -1,9 +1,68 @@
 from abc import ABC, abstractmethod
 from django.views import View
+from .helpers import columnar
+from .helpers.db import set_active_tenant
 from .models import AggData, Battery, CyclingRawData
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.contrib import messages
 import csv
+import io
+import zlib
+
+
+def stream_csv(chunks, header_rows=()):
+    """
+    Renders chunks of rows (e.g. from iterate_query) as csv text, one piece per chunk
+    @param chunks: iterable of lists of rows
+    @param header_rows: rows written before the data (field names, units)
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(header_rows)
+    yield buffer.getvalue()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def stream_gzip(pieces):
+    """Compresses a stream of text pieces to a gzip stream"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)  # gzip header and trailer
+    for piece in pieces:
+        data = compressor.compress(piece.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def get_database(user):
+    """@return: tenant id and database alias for the queries of a streamed response"""
+    tenant_id = None if user.is_anonymous else user.company_id
+    using = 'admin' if user.is_superuser else 'default'
+    return tenant_id, using
+
+
+def stream_query(get_data, render, tenant_id, using):
+    """
+    Runs the query when the response is streamed. This is after the middlewares are done and they may have replaced
+    the database connection, so the tenant of the request is set again for the query (skipped if it is unchanged).
+    @param get_data: function of the database alias, returns the chunks of rows
+    @param render: function of the chunks, returns the pieces of the response
+    """
+    set_active_tenant(tenant_id, using=using)
+    yield from render(get_data(using))
+
+
+def columnar_response(get_data, schema, file_format, filename, tenant_id, using):
+    """Streams the rows as arrow ipc stream or parquet file, one record batch or row group per chunk"""
+    content_type, extension = columnar.COLUMNAR_FORMATS[file_format]
+    content = stream_query(get_data, lambda chunks: columnar.stream_columnar(chunks, schema, file_format),
+                           tenant_id, using)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename={filename}.{extension}'
+    return response
 
 
 class ExportCSV(View, ABC):
@@ -11,30 +70,38 @@ class ExportCSV(View, ABC):
     units = None
 
     @abstractmethod
-    def get_data(self):
+    def get_data(self, using):
+        """@return: chunks of rows, the query runs when the response is streamed"""
         pass
 
     @abstractmethod
     def set_filename(self):
         pass
 
-    def get(self, request, *args, **kwargs):
-        response = HttpResponse(content_type='text/csv', headers={'filename': self.set_filename()})
-        response['Content-Disposition'] = f'attachment; filename={self.set_filename()}'
-
-        data = self.get_data()
-
-        writer = csv.writer(response)
-
-        if self.fields is not None:
-            writer.writerow(self.fields)
-
-        if self.units is not None:
-            writer.writerow(self.units)
-
-        for r in data:
-            writer.writerow(r)
+    def stream_data(self, tenant_id, using):
+        header_rows = [row for row in (self.fields, self.units) if row is not None]
+        return stream_query(self.get_data, lambda chunks: stream_csv(chunks, header_rows), tenant_id, using)
 
+    def get(self, request, *args, **kwargs):
+        filename = self.set_filename()
+        tenant_id, using = get_database(request.user)
+        file_format = request.GET.get('format', 'csv')
+        if file_format in columnar.COLUMNAR_FORMATS:
+            if not columnar.is_available():
+                return HttpResponse('pyarrow is not installed on the server', status=406)
+            schema = columnar.get_schema(self.model, self.fields, self.units)
+            return columnar_response(self.get_data, schema, file_format, filename.removesuffix('.csv'),
+                                     tenant_id, using)
+
+        content = self.stream_data(tenant_id, using)
+        content_type = 'text/csv'
+        if request.GET.get('compress') == 'gzip':
+            content = stream_gzip(content)
+            content_type = 'application/gzip'
+            filename = f'{filename}.gz'
+
+        response = StreamingHttpResponse(content, content_type=content_type, headers={'filename': filename})
+        response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
 
@@ -44,8 +111,9 @@ class ExportAggData(ExportCSV):
               'charge_c_rate', 'discharge_c_rate', 'ambient_temperature']
     units = ["", "Ah", "Ah", "%", "", "", "degreeC"]
 
-    def get_data(self):
-        return self.model.objects.get_agg_data_for_battery(self.kwargs['battery_id'], field_list=self.fields)
+    def get_data(self, using):
+        return self.model.objects.iterate_agg_data_for_battery(self.kwargs['battery_id'], field_list=self.fields,
+                                                               using=using)
 
     def set_filename(self):
         name = Battery.objects.get(pk=self.kwargs["battery_id"]).__str__()
@@ -58,8 +126,9 @@ class ExportRawData(ExportCSV):
               "time_in_step", "cell_temperature", "ambient_temperature"]
     units = ["", "V", "A", "Ah", "Wh", "", "", "s", "degreeC", "degreeC"]
 
-    def get_data(self):
-        return self.model.objects.get_data_for_battery(self.kwargs["battery_id"], field_list=self.fields)
+    def get_data(self, using):
+        return self.model.objects.iterate_data_for_battery(self.kwargs["battery_id"], field_list=self.fields,
+                                                           using=using)
 
     def set_filename(self):
         name = Battery.objects.get(pk=self.kwargs["battery_id"]).__str__()
@@ -1,6 +1,7 @@
 from django.db import connection
 
 from ABD_Webapp.settings import json_config
+from abd_database.helpers.db import set_active_tenant
 
 
 class RlsMiddleware(object):
@@ -14,9 +15,8 @@ class RlsMiddleware(object):
         else:
             tenant_id = request.user.company_id
 
-        with connection.cursor() as cursor:
-            cursor.execute(f'SET abd.active_tenant = "{tenant_id}" ')
-            cursor.execute(f'SET abd.change_owner_battid = "{None}" ')
+        # skipped if the (persistent) connection already carries the tenant
+        set_active_tenant(tenant_id)
 
         response = self.get_response(request)
 
@@ -28,7 +28,8 @@ class DatabaseUserSwitchMiddleware:
         self.get_response = get_response
 
     def __call__(self, request):
-        if request.user.is_superuser:
+        switched = request.user.is_superuser
+        if switched:
             connection.close()
             connection.settings_dict["USER"] = json_config["db_admin_user"]
             connection.settings_dict["PASSWORD"] = json_config["db_admin_pwd"]
@@ -36,9 +37,11 @@ class DatabaseUserSwitchMiddleware:
 
         response = self.get_response(request)
 
-        connection.close()
-        connection.settings_dict["USER"] = json_config["db_user"]
-        connection.settings_dict["PASSWORD"] = json_config["db_pwd"]
-        connection.connect()
+        # only a switched connection is replaced, others are kept for the next request (CONN_MAX_AGE)
+        if switched:
+            connection.close()
+            connection.settings_dict["USER"] = json_config["db_user"]
+            connection.settings_dict["PASSWORD"] = json_config["db_pwd"]
+            connection.connect()
 
         return response
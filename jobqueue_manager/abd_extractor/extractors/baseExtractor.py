@@ -1,12 +1,16 @@
-import numpy as np
 import pandas as pd
-from django.db import connection, transaction
+from django.db import transaction
 from abc import ABC
 import jobqueue_manager.abd_extractor.models as extractorModels
 from abd_database.models import CellTest, TestType, CyclingTest, BaseAggData, AggData, UploadFile, CyclingRawData,\
-    HPPCTest, HPPCAggData, ResistanceData
+    HPPCTest, HPPCAggData, HPPCRawData, ResistanceData, CyclingTestSummary, BatterySummary
 import jobqueue_manager.abd_extractor.helpers.extractor_helper as helper
-from jobqueue_manager.abd_extractor.helpers.to_csv_helper import get_cyclingRawData_csv
+import jobqueue_manager.abd_extractor.helpers.aggregation_helper as aggregation
+from jobqueue_manager.abd_extractor.helpers.copy_helper import copy_rawdata
+from jobqueue_manager.abd_extractor.helpers.parallel_helper import ordered_map
+from jobqueue_manager.abd_extractor.helpers.stream_helper import CycleBuffer, prefetch, STREAMING_MIN_KB, \
+    STREAM_CHUNK_ROWS
+from jobqueue_manager.abd_extractor.readers.base_reader import StreamingReader
 from customexceptions import VersionError
 import logging
 
@@ -15,26 +19,90 @@ logger = logging.getLogger(__name__)
 warnings = []
 
 
+def parse_file(reader_class, file, required_fields, additional_fields):
+    """
+    Reads the file and cleans its data as far as it does not depend on the database (clean_data without the cycle
+    offset), runs in the parse processes of the batch
+    @param reader_class: reader of the extractor
+    @param file: UploadFile
+    @return: attributes of the reader with the parsed data, without the parser of the device library
+    @raise Exception: error of the file, with the metrics of the stages until the error as its metrics attribute
+    """
+    reader = reader_class(file)
+    try:
+        with reader.metrics.measure('get_data') as measurement:
+            reader.get_data()
+            measurement['rows'] = len(reader.data)
+        reader.check_headers(set(required_fields), set(additional_fields))
+        reader.remove_nan()
+        reader.get_date()
+        with reader.metrics.measure('close_cycle_gaps', rows=len(reader.data)):
+            reader.data = helper.close_cycle_gaps(reader.data, pd.DataFrame())
+    except Exception as e:
+        # the attributes of an exception are pickled with it, the metrics reach the worker also from a process
+        e.metrics = reader.metrics
+        raise
+    return {key: value for key, value in vars(reader).items() if key != 'parser'}
+
+
 class BaseExtractor(ABC):
+    # Pipelined extraction: the readers are created again from their UploadFile in the parse processes (parse_file),
+    # which also clean the data, and every file is saved while the next ones are parsed. Extractors without it read
+    # and clean all files in the worker (clean_data) before save_data.
+    pipelined = True
+
     def __init__(self, files):
         logger.info("Initializing BaseExtractor")
         self.files: list = files
         self.data_hppc: pd.DataFrame = pd.DataFrame()
 
-        self.cellTests: [CellTest] = []
-        self.tests: [TestType] = []
-        self.agg_datas: list[list[BaseAggData]] = []
+        # saved objects per file
+        self.cellTests: [CellTest] = [[] for file in files]
+        self.tests: [TestType] = [[] for file in files]
+        self.agg_datas: list[list[BaseAggData]] = [[] for file in files]
         self.warnings: list = []
 
         self.extract_data()
 
+    def is_streamed(self, index):
+        """Big files are read, cleaned and saved chunk by chunk if the reader supports it"""
+        return isinstance(self.readers[index], StreamingReader) and self.files[index].kb >= STREAMING_MIN_KB
+
     def extract_data(self):
         logger.info("Start extracting data")
-        for index, reader in enumerate(self.readers):
+        indices = []
+        for index in range(len(self.readers)):
+            self.files[index].set_status(UploadFile.StatusCodes.EXTRACTING)
+            if self.is_streamed(index):
+                logger.info(f"File {index}/{len(self.readers)} is extracted in streaming mode while saving")
+                continue
+            indices.append(index)
+        prepared = self.prepare_files(indices)
+
+        if not self.pipelined:
+            for index, success in prepared:
+                pass
+            self.save_data()
+            return
+
+        # file N is saved while the next files are parsed, the cycle offsets are added and saved in the order of the
+        # files. At most parse_ahead + 1 parsed files are held in memory.
+        for index in range(len(self.readers)):
+            if not self.is_streamed(index) and not next(prepared)[1]:
+                self.save_metrics(index)
+                continue
+            self.save_file(index)
+
+    def prepare_files(self, indices):
+        """
+        Parses and cleans the files
+        @param indices: indices of the readers, the streamed files are prepared while they are saved
+        @return: generator of tuples (index, False if the file has an error), in the order of the indices
+        """
+        for index, error in self.parse_files(indices):
             try:
-                logger.info(f"Getting data and cleaning it for file {index}/{len(self.readers)}")
-                self.files[index].set_status(UploadFile.StatusCodes.EXTRACTING)
-                reader.get_data()
+                if error is not None:
+                    raise error
                 self.files[index].set_status(UploadFile.StatusCodes.CLEANING)
                 self.clean_data(index)
                 self.files[index].set_status(UploadFile.StatusCodes.PREPARED)
@@ -42,70 +110,145 @@ class BaseExtractor(ABC):
                 logger.error(f"{e} by file {index}/{len(self.readers)}")
                 transaction.on_commit(lambda: self.files[index].set_status(UploadFile.StatusCodes.ERROR, e))
                 # TODO: logg, message to errorcodes/warnings, return  raise version error for upper func?
+                yield index, False
             except Exception as e:
                 logger.error(f"Error in file nr {index}/{len(self.readers)}: \n{e}")
                 transaction.on_commit(lambda: self.files[index].set_status(UploadFile.StatusCodes.ERROR, e))
-
-        self.save_data()
+                yield index, False
+            else:
+                yield index, True
+
+    def parse_files(self, indices):
+        """
+        Reads the files, in parallel processes with parse_file if the extraction is pipelined. The results are handed
+        out in the order of the files, the cycle offsets of clean_data depend on it.
+        @param indices: indices of the readers
+        @return: generator of tuples (index, exception of the file or None)
+        """
+        if not self.pipelined:
+            for index in indices:
+                try:
+                    self.readers[index].get_data()
+                    yield index, None
+                except Exception as e:
+                    yield index, e
+            return
+
+        logger.info(f"Getting data and cleaning it for {len(indices)} files")
+        required_fields = CyclingRawData.get_required_fields(self)
+        additional_fields = CyclingRawData.get_additional_fields(self)
+        tasks = [(type(self.readers[index]), self.files[index], required_fields, additional_fields)
+                 for index in indices]
+        results = ordered_map(parse_file, tasks)
+        for index in indices:
+            parsed, error = next(results)
+            if error is None:
+                vars(self.readers[index]).update(parsed)
+            elif hasattr(error, 'metrics'):
+                # stored by save_metrics with the error of the file
+                self.readers[index].metrics = error.metrics
+            # no reference to the data is kept here, the reader releases it after saving
+            del parsed
+            yield index, error
 
     def clean_data(self, index):
+        """Adds the cycle offset to the data of a file parsed by parse_file"""
         logger.info(f"Cleaning data for file nr. {index}")
-        self.readers[index].check_headers(set(CyclingRawData.get_required_fields(self)), set(CyclingRawData.get_additional_fields(self)))
-        self.readers[index].remove_nan()
-        self.readers[index].get_date()
         if not self.readers[index].date:
             self.readers[index].date = self.date
-        self.readers[index].data = helper.close_cycle_gaps(self.readers[index].data, pd.DataFrame())
-        self.add_cycle_id_offset(self.readers[index].data, self.readers[index].date)
+        with self.readers[index].metrics.measure('add_cycle_id_offset', rows=len(self.readers[index].data)):
+            self.add_cycle_id_offset(self.readers[index].data, self.readers[index].date)
         logger.info(f"Successfully cleaned data")
         # error-correction
 
     def save_data(self):
         logger.info(f"Start saving data to database")
-
-        for file_index, reader in enumerate(self.readers):
-            # TODO: HPPCTest was saved even though CyclingTest failed --> should not happen due to atomic()?
-            with transaction.atomic():
-                try:
-                    logger.info(f"Saving data for file {file_index}/{len(self.readers)}")
-                    self.cellTests.append([])
-                    self.tests.append([])
-                    self.agg_datas.append([])
-                    self.files[file_index].set_status(UploadFile.StatusCodes.SAVING)
-                    samples_hppc = self.readers[file_index].data[
-                        self.readers[file_index].data['step_flag'].isin([5, 6])]
-                    test_index = 0
-                    if not samples_hppc.empty:
-                        cycle_ids = samples_hppc['cycle_id'].unique()
-                        self.data_hppc = self.readers[file_index].data[
-                            self.readers[file_index].data['cycle_id'].isin(cycle_ids)]
-                        self.readers[file_index].data = self.readers[file_index].data[
-                            ~self.readers[file_index].data['cycle_id'].isin(cycle_ids)]
-                        # TODO: At the moment exact same CellTest as for the CyclingData.
-                        self.cellTests[file_index].append(
-                            CellTest(battery=self.battery, dataset=self.dataset, date=self.readers[file_index].date,
-                                     equipment=self.equipment, file=self.files[file_index]).save())
-                        self.tests[file_index].append(self.save_HPPCTest(file_index, test_index))  # Needs test_index to get the correct CellTest
+        for file_index in range(len(self.readers)):
+            self.save_file(file_index)
+
+    def save_file(self, file_index):
+        """Saves the file in its transaction, releases its data afterwards and stores the metrics of its extraction"""
+        with self.readers[file_index].metrics.measure('save'):
+            self.save_file_data(file_index)
+
+        # the data is not needed after the commit, so it is released before the next file is saved
+        self.readers[file_index].data = pd.DataFrame()
+        self.data_hppc = pd.DataFrame()
+        self.save_metrics(file_index)
+
+    def save_metrics(self, file_index):
+        try:
+            self.files[file_index].set_metrics(self.readers[file_index].metrics.to_json())
+        except Exception as e:
+            logger.error(f"Could not save the metrics of file nr {file_index}/{len(self.readers)}: \n{e}")
+
+    def save_file_data(self, file_index):
+        metrics = self.readers[file_index].metrics
+        # the changes of the transaction are only seen by the queue page after its commit, so the status is set before
+        # (a streamed file is also read and cleaned in the transaction)
+        self.files[file_index].set_status(UploadFile.StatusCodes.SAVING)
+        # TODO: HPPCTest was saved even though CyclingTest failed --> should not happen due to atomic()?
+        with transaction.atomic():
+            try:
+                logger.info(f"Saving data for file {file_index}/{len(self.readers)}")
+                if self.is_streamed(file_index):
+                    self.save_stream(file_index)
+                    with metrics.measure('save_summaries'):
+                        self.save_summaries(file_index)
+                    logger.info(f"Successfully saved all data for")
+                    self.files[file_index].set_status()
+                    return
+                samples_hppc = self.readers[file_index].data[
+                    self.readers[file_index].data['step_flag'].isin([5, 6])]
+                test_index = 0
+                if not samples_hppc.empty:
+                    cycle_ids = samples_hppc['cycle_id'].unique()
+                    self.data_hppc = self.readers[file_index].data[
+                        self.readers[file_index].data['cycle_id'].isin(cycle_ids)]
+                    self.readers[file_index].data = self.readers[file_index].data[
+                        ~self.readers[file_index].data['cycle_id'].isin(cycle_ids)]
+                    # TODO: At the moment exact same CellTest as for the CyclingData.
+                    self.cellTests[file_index].append(
+                        CellTest(battery=self.battery, dataset=self.dataset, date=self.readers[file_index].date,
+                                 equipment=self.equipment, file=self.files[file_index]).save())
+                    self.tests[file_index].append(self.save_HPPCTest(file_index, test_index))  # Needs test_index to get the correct CellTest
+                    with metrics.measure('save_HPPCaggData') as measurement:
                         self.agg_datas[file_index].append(self.save_HPPCaggData(file_index, test_index))  # Needs test_index to get the correct TestType
-                        self.data_hppc = self.post_clean_HPPCRawData(self.data_hppc, file_index, test_index)
+                        measurement['rows'] = len(self.agg_datas[file_index][-1])
+                    self.data_hppc = self.post_clean_HPPCRawData(self.data_hppc, file_index, test_index)
+                    with metrics.measure('save_HPPCRawData', rows=len(self.data_hppc)):
                         self.save_HPPCRawData(self.data_hppc)
-                        test_index += 1
-
-                    if not self.readers[file_index].data.empty:
-                        self.cellTests[file_index].append(CellTest(battery=self.battery,
-                                                                   dataset=self.dataset,
-                                                                   date=self.readers[file_index].date,
-                                                                   equipment=self.equipment,
-                                                                   file=self.files[file_index]).save())
-                        self.tests[file_index].append(self.save_cyclingTest(file_index, test_index))    # Needs test_index to get the correct CellTest
+                    test_index += 1
+
+                if not self.readers[file_index].data.empty:
+                    self.cellTests[file_index].append(CellTest(battery=self.battery,
+                                                               dataset=self.dataset,
+                                                               date=self.readers[file_index].date,
+                                                               equipment=self.equipment,
+                                                               file=self.files[file_index]).save())
+                    self.tests[file_index].append(self.save_cyclingTest(file_index, test_index))    # Needs test_index to get the correct CellTest
+                    with metrics.measure('save_aggData') as measurement:
                         self.agg_datas[file_index].append(self.save_aggData(file_index, test_index))    # Needs test_index to get the correct TestType
-                        self.readers[file_index].data = self.post_clean_cyclingRawData(file_index, test_index)
+                        measurement['rows'] = len(self.agg_datas[file_index][-1])
+                    self.readers[file_index].data = self.post_clean_cyclingRawData(file_index, test_index)
+                    with metrics.measure('save_cyclingRawData', rows=len(self.readers[file_index].data)):
                         self.save_cyclingRawData(file_index)
-                    logger.info(f"Successfully saved all data for")
-                    self.files[file_index].set_status()
-                except Exception as e:
-                    logger.error(f"Error in file nr {file_index}/{len(self.readers)}: \n{e}")
-                    transaction.on_commit(lambda: self.files[file_index].set_status(UploadFile.StatusCodes.ERROR, e))
+                with metrics.measure('save_summaries'):
+                    self.save_summaries(file_index)
+                logger.info(f"Successfully saved all data for")
+                self.files[file_index].set_status()
+            except Exception as e:
+                logger.error(f"Error in file nr {file_index}/{len(self.readers)}: \n{e}")
+                transaction.on_commit(lambda: self.files[file_index].set_status(UploadFile.StatusCodes.ERROR, e))
+
+    def save_summaries(self, file_index):
+        """
+        Summarizes the new cycling tests of a file and updates the summary of the battery, in the same transaction
+        """
+        for test in self.tests[file_index]:
+            if isinstance(test, CyclingTest):
+                CyclingTestSummary.objects.refresh(test.pk)
+        BatterySummary.objects.refresh(self.get_battery(file_index))
 
     def save_cyclingTest(self, file_index, test_index=0):
         return CyclingTest(cellTest=self.cellTests[file_index][test_index]).save()
@@ -113,204 +256,115 @@ class BaseExtractor(ABC):
     def save_HPPCTest(self, file_index, test_index=0):
         return HPPCTest(cellTest=self.cellTests[file_index][test_index]).save()
 
+    def get_battery(self, file_index):
+        """@return: battery of the file, the HDF5 files bring their own battery"""
+        if hasattr(self, 'battery'):
+            return self.battery
+        return self.batteries[file_index]
+
+    def get_battery_type(self, reader_index):
+        if hasattr(self, 'battery'):
+            return self.battery.battery_type
+        return self.battery_types[reader_index]
+
+    @staticmethod
+    def get_error_codes(df_error_codes, cycle_index):
+        error_codes = None
+        if not df_error_codes.empty:
+            if cycle_index in df_error_codes['cycle_id']:
+                error_codes = df_error_codes["error"].loc[cycle_index]
+                if type(error_codes) is not list:
+                    error_codes = [int(error_codes)]
+        if error_codes is None:
+            error_codes = []
+        return error_codes
+
     def save_aggData(self, reader_index, test_index=0, df_error_codes=pd.DataFrame(), additive=None):
         if not additive:
             df_cyclingRawData = self.readers[reader_index].data
         else:
             df_cyclingRawData = self.readers[reader_index].data[additive]['CyclingRawData']['data']
-        groups = df_cyclingRawData.groupby('cycle_id')
+        battery_type = self.get_battery_type(reader_index)
+        cycling_test = self.tests[reader_index][test_index]
+        return self.create_aggData(df_cyclingRawData, cycling_test, battery_type.theoretical_capacity, df_error_codes)
+
+    def create_aggData(self, df_cyclingRawData, cycling_test, theoretical_capacity, df_error_codes=pd.DataFrame()):
+        values = aggregation.aggregate_cycles(df_cyclingRawData, theoretical_capacity)
+        fields = list(values.keys())
         entries = []
-        for cycle_index, group in groups:
-            cycle_id = cycle_index
-            cc_charge_avg = None
-            cc_discharge_avg = None
-            charge_c_rate = None
-            discharge_c_rate = None
-            charge_capacity = None
-            discharge_capacity = None
-            efficiency = None
-            ambient_temperature = None
-            start_time = None
-            end_time = None
-            min_voltage = None
-            max_voltage = None
-
-            error_codes = None
-
-            battery_type = None
-            if hasattr(self, 'battery'):
-                battery_type = self.battery.battery_type
-            else:
-                battery_type = self.battery_types[reader_index]
-
-            if len(group[group['step_flag'].isin([2, 3])]['current']) > 0:
-                cc_charge_avg = group[group['step_flag'].isin([2, 3])]['current'].mean()
-                charge_c_rate = np.round(cc_charge_avg / battery_type.theoretical_capacity, 2)
-            if len(group[group['step_flag'] == 4]['current']) > 0:
-                cc_discharge_avg = abs(group[group['step_flag'] == 4]['current'].mean())
-                discharge_c_rate = np.round(cc_discharge_avg / battery_type.theoretical_capacity, 2)
-            if len(group[group['step_flag'].isin([2, 3])]) > 0:
-                charge_capacity = group[group['step_flag'].isin([2, 3])]['capacity'].abs().max()
-            if len(group[group['step_flag'] == 4]['capacity']) > 0:
-                discharge_capacity = group[group['step_flag'] == 4]['capacity'].abs().max()
-            if discharge_capacity is not None and charge_capacity is not None and charge_capacity != 0:
-                efficiency = discharge_capacity / charge_capacity * 100
-            if 'ambient_temperature' in group:
-                if group['ambient_temperature'].notnull().values.all():
-                    ambient_temperature = group['ambient_temperature'].mean()
-            start_time = group['time'].min()
-            end_time = group['time'].max()
-            min_voltage = group['voltage'].min()
-            max_voltage = group['voltage'].max()
-            # null check
-            if not df_error_codes.empty:
-                if cycle_index in df_error_codes['cycle_id']:
-                    error_codes = df_error_codes["error"].loc[cycle_index]
-                    if type(error_codes) is not list:
-                        error_codes = [int(error_codes)]
-            if error_codes is None:
-                error_codes = []
-            entries.append(AggData(cycle_id=cycle_id,
-                                   charge_capacity=charge_capacity,
-                                   discharge_capacity=discharge_capacity,
-                                   efficiency=efficiency,
-                                   charge_c_rate=charge_c_rate,
-                                   discharge_c_rate=discharge_c_rate,
-                                   cycling_test=self.tests[reader_index][test_index],
-                                   ambient_temperature=ambient_temperature,
-                                   start_time=start_time,
-                                   end_time=end_time,
-                                   min_voltage=min_voltage,
-                                   max_voltage=max_voltage,
-                                   error_codes=error_codes).save())
+        for row in zip(*values.values()):
+            entry = dict(zip(fields, row))
+            entries.append(AggData(cycling_test=cycling_test,
+                                   error_codes=self.get_error_codes(df_error_codes, entry['cycle_id']),
+                                   **entry))
 
-        return entries
+        # bulk_create sets the primary keys on PostgreSQL
+        return AggData.objects.bulk_create(entries)
 
     def save_HPPCaggData(self, reader_index, test_index=0, df_error_codes=pd.DataFrame()):
-        df_HPPCRawData = self.data_hppc
-        groups = df_HPPCRawData.groupby('cycle_id')
+        return self.create_HPPCaggData(self.data_hppc, self.tests[reader_index][test_index], df_error_codes)
+
+    def create_HPPCaggData(self, df_HPPCRawData, hppc_test, df_error_codes=pd.DataFrame()):
+        values = aggregation.aggregate_hppc_cycles(df_HPPCRawData)
+        fields = list(values.keys())
         entries = []
-        for cycle_index, group in groups:
-            cycle_id = cycle_index
-            ambient_temperature = None
-            start_time = None
-            end_time = None
-            error_codes = None
-
-            battery_type = None
-            if hasattr(self, 'battery'):
-                battery_type = self.battery.battery_type
-            else:
-                battery_type = self.battery_types[reader_index]
-
-            if 'ambient_temperature' in group:
-                if group['ambient_temperature'].notnull().values.all():
-                    ambient_temperature = group['ambient_temperature'].mean()
-            start_time = group['time'].min()
-            end_time = group['time'].max()
-            # null check
-            if not df_error_codes.empty:
-                if cycle_index in df_error_codes['cycle_id']:
-                    error_codes = df_error_codes["error"].loc[cycle_index]
-                    if type(error_codes) is not list:
-                        error_codes = [int(error_codes)]
-            if error_codes is None:
-                error_codes = []
-            aggdata = HPPCAggData(cycle_id=cycle_id,
-                                  hppc_test=self.tests[reader_index][test_index],
-                                  ambient_temperature=ambient_temperature,
-                                  start_time=start_time,
-                                  end_time=end_time,
-                                  error_codes=error_codes).save()
-            entries.append(aggdata)
-
-            pulses = group.loc[group['step_flag'].isin([5, 6])]
-            grouped_pulses = pulses.groupby((pulses.index.to_series().diff() > 1).cumsum())
-            for pulse_id, pulse in grouped_pulses:
-                self.save_ResistanceData(pulse, group, aggdata, cycle_index, ambient_temperature)
+        for row in zip(*values.values()):
+            entry = dict(zip(fields, row))
+            entries.append(HPPCAggData(hppc_test=hppc_test,
+                                       error_codes=self.get_error_codes(df_error_codes, entry['cycle_id']),
+                                       **entry))
+        entries = HPPCAggData.objects.bulk_create(entries)
+
+        self.save_ResistanceData(df_HPPCRawData, {aggdata.cycle_id: aggdata for aggdata in entries})
 
         return entries
 
     @staticmethod
-    def calc_resistance(pulse, group):
-        idx_last_pulse = pulse.index[-1]
-        idx_last_before_pulse = pulse.index[0] - 1
-
-        voltage_pulse = group.loc[idx_last_pulse, 'voltage']
-        voltage_before_pulse = group.loc[idx_last_before_pulse, 'voltage']
-        diff_voltage = voltage_pulse - voltage_before_pulse
-
-        current_pulse = group.loc[idx_last_pulse, 'current']
-        mean_current_pulse = pulse['current'].mean()
-        current_before_pulse = group.loc[idx_last_before_pulse, 'current']
-        diff_current = current_pulse - current_before_pulse
-
-        resistance = diff_voltage / diff_current
+    def save_ResistanceData(df_HPPCRawData, aggdata_by_cycle):
+        pulses = aggregation.calc_pulse_resistances(df_HPPCRawData)
+        resistances = []
+        # TODO: Calculation for cell_temperature and soc
+        for cycle_index, resistance, test_current in zip(pulses['cycle_id'].tolist(), pulses['resistance'].tolist(),
+                                                         pulses['test_current'].tolist()):
+            aggdata = aggdata_by_cycle[cycle_index]
+            resistances.append(ResistanceData(hppc_agg_data=aggdata,
+                                              cycle_id=cycle_index,
+                                              cell_temperature=None,
+                                              ambient_temperature=aggdata.ambient_temperature,
+                                              soc=None,
+                                              resistance=resistance,
+                                              test_current=test_current))
+
+        return ResistanceData.objects.bulk_create(resistances)
 
-        return resistance, mean_current_pulse
-
-    def save_ResistanceData(self, pulse, group, aggdata, cycle_index, ambient_temperature):
-
-        resistance = None
-        test_current = None
-        cell_temperature = None
-        # ambient_temperature = None
-        soc = None
-
-        # TODO: Probably better to only check this once and not here and in save_aggdata
-        if 5 in pulse.loc[:, 'step_flag'].unique():
-            resistance, test_current = self.calc_resistance(pulse, group)
-
-        if 6 in pulse.loc[:, 'step_flag'].unique():
-            resistance, test_current = self.calc_resistance(pulse, group)
-
-        return ResistanceData(hppc_agg_data=aggdata,
-                              cycle_id=cycle_index,
-                              cell_temperature=cell_temperature,
-                              ambient_temperature=ambient_temperature,
-                              soc=soc,
-                              resistance=resistance,
-                              test_current=test_current).save()
+    @staticmethod
+    def assign_agg_data(df_rawData, agg_datas, required_fields):
+        """
+        Sets the agg_data_id column of the raw data by mapping the cycle_id of every row to the primary key of the
+        AggData/HPPCAggData entry with the same cycle_id.
+        @param df_rawData: cycling or HPPC raw data
+        @param agg_datas: saved aggregated data of the test
+        @param required_fields: required fields of the raw data model to check for
+        @return: raw data with the agg_data_id column as integer array
+        """
+        df_rawData['agg_data_id'] = aggregation.map_agg_data_ids(df_rawData['cycle_id'].to_numpy(), agg_datas)
+        if not set(required_fields).issubset(df_rawData.columns):
+            missing_attributes = set(required_fields) - set(df_rawData.columns)
+            warnings.append(f'Missing required attribute(s): {missing_attributes} in cyclingrawdata-dataset')
+            raise AttributeError(f'Missing required attribute(s): {missing_attributes} in cyclingrawdata-dataset')
+        return df_rawData
 
-    #TODO: Fix cycle offset calculation
     def post_clean_cyclingRawData(self, file_index, test_index=0, cellTest_name=None):
         if cellTest_name:
             df_cyclingRawData = self.readers[file_index].data[cellTest_name]['CyclingRawData']['data']
         else:
             df_cyclingRawData = self.readers[file_index].data
-        entry_cycle_id = df_cyclingRawData.iloc[0]['cycle_id']
-        last_cycle_id = entry_cycle_id
-        nbr_of_jumps = 0
-        offset_cycle_id = entry_cycle_id - 1 if entry_cycle_id != 0 else 0
-        df_cyclingRawData['agg_data'] = ''
-        for index, group in df_cyclingRawData.groupby('cycle_id'):
-            if index - last_cycle_id >= 1:
-                nbr_of_jumps += index - last_cycle_id - 1
-            df_cyclingRawData.loc[df_cyclingRawData["cycle_id"] == index, 'agg_data'] = self.agg_datas[file_index][test_index][index - nbr_of_jumps - offset_cycle_id - 1]
-            last_cycle_id = index
-        if not set(extractorModels.CyclingRawData.required_fields).issubset(df_cyclingRawData.columns):
-            missing_attributes = set(extractorModels.CyclingRawData.required_fields) - set(df_cyclingRawData.columns)
-            warnings.append(f'Missing required attribute(s): {missing_attributes} in cyclingrawdata-dataset')
-            raise AttributeError(f'Missing required attribute(s): {missing_attributes} in cyclingrawdata-dataset')
-        return df_cyclingRawData
+        return self.assign_agg_data(df_cyclingRawData, self.agg_datas[file_index][test_index],
+                                    extractorModels.CyclingRawData.required_fields)
 
-    # TODO: Similar to post_clean_cyclingRawData. Cycle offset calculation will be reworked, thus wait till then for changes
     def post_clean_HPPCRawData(self, df_HPPCRawData, file_index, test_index=0):
-        entry_cycle_id = df_HPPCRawData.iloc[0]['cycle_id']
-        last_cycle_id = entry_cycle_id
-        nbr_of_jumps = 0
-        offset_cycle_id = entry_cycle_id - 1 if entry_cycle_id != 0 else 0
-        df_HPPCRawData['agg_data'] = ''
-        for index, group in df_HPPCRawData.groupby('cycle_id'):
-            if index - last_cycle_id >= 1:
-                nbr_of_jumps += index - last_cycle_id - 1
-            df_HPPCRawData.loc[df_HPPCRawData["cycle_id"] == index, 'agg_data'] = self.agg_datas[file_index][test_index][index - nbr_of_jumps - offset_cycle_id - 1]
-            last_cycle_id = index
-        if not set(extractorModels.HPPCRawData.required_fields).issubset(df_HPPCRawData.columns):
-            missing_attributes = set(extractorModels.HPPCRawData.required_fields) - set(df_HPPCRawData.columns)
-            warnings.append(f'Missing required attribute(s): {missing_attributes} in cyclingrawdata-dataset')
-            raise AttributeError(f'Missing required attribute(s): {missing_attributes} in cyclingrawdata-dataset')
-        return df_HPPCRawData
+        return self.assign_agg_data(df_HPPCRawData, self.agg_datas[file_index][test_index],
+                                    extractorModels.HPPCRawData.required_fields)
 
     def save_cyclingRawData(self, index, cellTest_name=None):
         if cellTest_name:
@@ -319,71 +373,135 @@ class BaseExtractor(ABC):
             df_cyclingRawData = self.readers[index].data
         if 'step_id' in df_cyclingRawData.columns:
             df_cyclingRawData.drop(columns=['step_id'], inplace=True)
-        cyclingRawData_csv, columns = get_cyclingRawData_csv(df_cyclingRawData)
-
-        with connection.cursor() as cursor:
-            cursor.copy_from(cyclingRawData_csv, 'abd_database_cyclingrawdata', sep=',', columns=columns, null='None')
+        copy_rawdata(df_cyclingRawData, CyclingRawData)
 
     @staticmethod
     def save_HPPCRawData(data):
         if 'step_id' in data.columns:
             data.drop(columns=['step_id'], inplace=True)
-        HPPCRawData_csv, columns = get_cyclingRawData_csv(data)
-
-        with connection.cursor() as cursor:
-            cursor.copy_from(HPPCRawData_csv, 'abd_database_hppcrawdata', sep=',', columns=columns, null='None')
+        copy_rawdata(data, HPPCRawData)
+
+    def clean_chunks(self, index):
+        """
+        Reads the file of the reader chunk by chunk and cleans every chunk like clean_data, without the cycle
+        numbering and offset which need the state of the whole file (see save_stream)
+        """
+        reader = self.readers[index]
+        first_chunk = True
+        chunks = reader.get_chunks(STREAM_CHUNK_ROWS)
+        while True:
+            with reader.metrics.measure('get_data') as measurement:
+                chunk = next(chunks, None)
+                measurement['rows'] = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                return
+            reader.data = chunk
+            reader.check_headers(set(CyclingRawData.get_required_fields(self)), set(CyclingRawData.get_additional_fields(self)))
+            reader.remove_nan()
+            if first_chunk:
+                reader.get_date()
+                first_chunk = False
+            yield reader.data
+
+    def save_stream(self, file_index):
+        """
+        Streaming mode: reads, cleans and saves the file in chunks. A cycle is saved (aggregated data and raw data)
+        as soon as it is complete, so only the current chunks and the unfinished cycle are held in memory.
+        The next chunk is parsed while the current one is loaded into the database.
+        """
+        reader = self.readers[file_index]
+        cycles = CycleBuffer()
+        previous_cycle_id = None
+        first_chunk = True
+        for chunk in prefetch(self.clean_chunks(file_index)):
+            if first_chunk:
+                if not reader.date:
+                    reader.date = self.date
+                previous_cycle_id = self.get_previous_cycle_id(reader.date)
+                first_chunk = False
+            self.save_cycles(file_index, cycles.push(chunk), previous_cycle_id)
+        self.save_cycles(file_index, cycles.flush(), previous_cycle_id)
+        reader.data = pd.DataFrame()
+
+        if cycles.get_nbr_of_cycles() > 0:
+            new_tests = [cell_test.pk for cell_test in self.cellTests[file_index]]
+            with reader.metrics.measure('add_cycle_id_offset', rows=cycles.nbr_of_rows):
+                self.update_cycle_offsets(previous_cycle_id, cycles.get_nbr_of_cycles(), cycles.end_time, new_tests)
+
+    def get_stream_test(self, file_index, test_class):
+        """
+        Test of the given type (HPPCTest or CyclingTest) of a streamed file, created with its first cycle
+        @return: index of the test in self.tests
+        """
+        for test_index, test in enumerate(self.tests[file_index]):
+            if isinstance(test, test_class):
+                return test_index
+        self.cellTests[file_index].append(CellTest(battery=self.battery, dataset=self.dataset,
+                                                   date=self.readers[file_index].date, equipment=self.equipment,
+                                                   file=self.files[file_index]).save())
+        self.tests[file_index].append(test_class(cellTest=self.cellTests[file_index][-1]).save())
+        self.agg_datas[file_index].append([])
+        return len(self.tests[file_index]) - 1
+
+    def save_cycles(self, file_index, df, previous_cycle_id=None):
+        """
+        Saves complete cycles of a streamed file, cycles with HPPC pulses to the HPPC test like in save_data
+        """
+        if df.empty:
+            return
+        metrics = self.readers[file_index].metrics
+        if previous_cycle_id:
+            df = df.assign(cycle_id=df['cycle_id'] + previous_cycle_id)
+        hppc_cycles = df.loc[df['step_flag'].isin([5, 6]), 'cycle_id'].unique()
+        is_hppc = df['cycle_id'].isin(hppc_cycles)
+
+        if is_hppc.any():
+            df_hppc = df[is_hppc].copy()
+            test_index = self.get_stream_test(file_index, HPPCTest)
+            with metrics.measure('save_HPPCaggData') as measurement:
+                agg_datas = self.create_HPPCaggData(df_hppc, self.tests[file_index][test_index])
+                measurement['rows'] = len(agg_datas)
+            self.agg_datas[file_index][test_index].extend(agg_datas)
+            with metrics.measure('save_HPPCRawData', rows=len(df_hppc)):
+                self.save_HPPCRawData(self.assign_agg_data(df_hppc, agg_datas,
+                                                           extractorModels.HPPCRawData.required_fields))
+
+        if not is_hppc.all():
+            df_cycling = df[~is_hppc].copy()
+            test_index = self.get_stream_test(file_index, CyclingTest)
+            with metrics.measure('save_aggData') as measurement:
+                agg_datas = self.create_aggData(df_cycling, self.tests[file_index][test_index],
+                                                self.get_battery_type(file_index).theoretical_capacity)
+                measurement['rows'] = len(agg_datas)
+            self.agg_datas[file_index][test_index].extend(agg_datas)
+            df_cycling = self.assign_agg_data(df_cycling, agg_datas, extractorModels.CyclingRawData.required_fields)
+            if 'step_id' in df_cycling.columns:
+                df_cycling = df_cycling.drop(columns=['step_id'])
+            with metrics.measure('save_cyclingRawData', rows=len(df_cycling)):
+                copy_rawdata(df_cycling, CyclingRawData)
 
     def add_cycle_id_offset(self, data, date):
-        # get the first cycle before the first test-date from the adding test
-        sql = f'''
-            SELECT rawdata.cycle_id
-            FROM public.abd_database_battery as battery
-            INNER JOIN public.abd_database_celltest as celltest on battery.id=celltest.battery_id
-            INNER JOIN public.abd_database_cyclingtest as cyclingtest on celltest.id=cyclingtest."cellTest_id"
-            INNER JOIN public.abd_database_aggdata as aggdata on cyclingtest.id=aggdata."cycling_test_id"
-            INNER JOIN public.abd_database_cyclingrawdata as rawdata on aggdata.id=rawdata.agg_data_id
-            WHERE battery.id={self.battery.id} AND time<'{date}'
-            ORDER BY rawdata.id DESC
-            LIMIT 1
-            '''
-        cycle_id = None
-        with connection.cursor() as cursor:
-            cursor.execute(sql)
-            result = cursor.fetchone()
-            if result:
-                cycle_id = result[0]
-
+        cycle_id = self.get_previous_cycle_id(date)
+        if cycle_id:
+            data['cycle_id'] = data['cycle_id'].apply(lambda x: x + cycle_id)
+        self.update_cycle_offsets(cycle_id, data['cycle_id'].unique().size, data['time'].max())
+
+    def get_previous_cycle_id(self, date):
+        # get the last cycle before the first test-date from the adding test
+        return CyclingTest.objects.get_previous_cycle_id(self.battery, date)
+
+    def update_cycle_offsets(self, cycle_id, nbr_of_cycles, end_time, exclude_cell_tests=()):
+        """
+        Shifts the cycle offsets of the other tests of the battery by the cycles of the added test
+        @param cycle_id: last cycle before the added test (get_previous_cycle_id)
+        @param nbr_of_cycles: number of cycles of the added test
+        @param end_time: time of the last row of the added test
+        @param exclude_cell_tests: primary keys of cell tests which are part of the upload
+        """
         if not cycle_id:
             # no cycles before date found
             # all other cycles need to be increased by max(cycle_id)
-            cycle_id_offset = data['cycle_id'].max()
-            for cell_test in self.battery.cell_test.all():
-                if hasattr(cell_test, 'cyclingtest_test_type'):
-                    cell_test.cyclingtest_test_type.cycle_offset = cell_test.cyclingtest_test_type.cycle_offset + cycle_id_offset
-                    cell_test.cyclingtest_test_type.save(update_fields=['cycle_offset'])
+            CyclingTest.objects.shift_cycle_offsets(self.battery, nbr_of_cycles, exclude_cell_tests=exclude_cell_tests)
         else:
-            data['cycle_id'] = data['cycle_id'].apply(lambda x: x + cycle_id)
-            # get all tests after the last test-date from the uploading test
-            sql = f'''
-            SELECT DISTINCT(cyclingtest.id)
-            FROM public.abd_database_battery as battery
-            INNER JOIN public.abd_database_celltest as celltest on battery.id=celltest.battery_id
-            INNER JOIN public.abd_database_cyclingtest as cyclingtest on celltest.id=cyclingtest."cellTest_id"
-            INNER JOIN public.abd_database_aggdata as aggdata on cyclingtest.id=aggdata."cycling_test_id"
-            INNER JOIN public.abd_database_cyclingrawdata as rawdata on aggdata.id=rawdata.agg_data_id
-            WHERE battery.id={self.battery.id} AND time>'{data['time'].max()}'
-            ORDER BY cyclingtest.id ASC
-            '''
-            cycletest_ids = None
-            with connection.cursor() as cursor:
-                cursor.execute(sql)
-                result = cursor.fetchall()
-                if result:
-                    cycletest_ids = [x[0] for x in result]
-
-            if cycletest_ids:
-                # add the length of the uploading test to the offset for all tests after the uploading one.
-                for cycletest_id in cycletest_ids:
-                    cycletest = CyclingTest.objects.get(pk=cycletest_id)
-                    cycletest.cycle_offset = cycletest.cycle_offset + data['cycle_id'].unique().size
-                    cycletest.save(update_fields=['cycle_offset'])
+            # add the length of the uploading test to the offset for all tests after the uploading one.
+            CyclingTest.objects.shift_cycle_offsets(self.battery, nbr_of_cycles, after=end_time)
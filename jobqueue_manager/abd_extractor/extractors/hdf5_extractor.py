@@ -17,7 +17,8 @@ logger = logging.getLogger(__name__)
 
 
 class Hdf5Extractor(BaseExtractor):
-    
+    pipelined = False  # the readers keep their HDFStore open
+
     def __init__(self, files, owner):
         # TODO: make battery_type and battery to list for uploading multiple files at once
         self.owner = owner
@@ -27,24 +28,6 @@ class Hdf5Extractor(BaseExtractor):
         self.readers = [Hdf5Reader(file.file.path) for file in files]
         super(Hdf5Extractor, self).__init__(files)
 
-    def extract_data(self):
-        super(Hdf5Extractor, self).extract_data()
-        for reader_index, reader in enumerate(self.readers):
-            try:
-                for test_index, cellTest_name in enumerate(reader.data):
-                    if 'CyclingRawData' in reader.data[cellTest_name]:
-                        reader.data[cellTest_name]['CyclingRawData']['data'] = self.post_clean_cyclingRawData(reader_index, test_index, cellTest_name)
-                        self.save_cyclingRawData(reader_index, cellTest_name)
-                        logger.info("Saved cycling raw data")
-                    elif 'EISRawData' in reader.data[cellTest_name]:
-                        # Prepared for EIS data
-                        pass
-                return list(set(self.warnings))
-            except Exception as e:
-                # TODO: check if necessary for other extractors AND if handling can be more specifig than general Exception
-                logger.error(f"Error in file nr {reader_index}/{len(self.readers)}: \n{e}")
-                transaction.on_commit(lambda: self.files[reader_index].set_status(UploadFile.StatusCodes.ERROR, e))
-
     def clean_data(self, index):
         self.readers[index].battery = self.clean_battery(index)
         self.readers[index].dataset = self.clean_dataset(self.readers[index].dataset)
@@ -68,9 +51,6 @@ class Hdf5Extractor(BaseExtractor):
                     self.datasets.append(self.save_dataset(reader.dataset, self.owner))
                     logger.info(f"Saved dataset with id: {self.datasets[file_index].pk}")
 
-                    self.cellTests.append([])
-                    self.cycling_tests.append([])
-                    self.agg_datas.append([])
                     for test_index, cellTest_name in enumerate(reader.data):
                         reader.data[cellTest_name]['data'] = self.clean_cellTest(reader.data[cellTest_name]['data'], self.batteries[file_index], self.datasets[file_index], self.files[file_index])
                         self.cellTests[file_index].append(self.save_cellTest(reader.data[cellTest_name]['data']))
@@ -78,8 +58,8 @@ class Hdf5Extractor(BaseExtractor):
 
                         if 'CyclingRawData' in reader.data[cellTest_name]:
                             # index instead of testindex
-                            self.cycling_tests[file_index].append(self.save_cyclingTest(file_index, test_index))
-                            logger.info(f"Saved cycling-test with id: {self.cycling_tests[file_index][test_index].pk}")
+                            self.tests[file_index].append(self.save_cyclingTest(file_index, test_index))
+                            logger.info(f"Saved cycling-test with id: {self.tests[file_index][test_index].pk}")
 
                             self.agg_datas[file_index].append(self.save_aggData(file_index, test_index, reader.data[cellTest_name]['ErrorCodes']['data'], cellTest_name))
                             logger.info(f"Saved agg-data with id(s): {min(agg_data.pk for agg_data in self.agg_datas[file_index][test_index])}-{max(agg_data.pk for agg_data in self.agg_datas[file_index][test_index])}")
@@ -88,6 +68,7 @@ class Hdf5Extractor(BaseExtractor):
 
                             self.save_cyclingRawData(file_index, cellTest_name)
                             logger.info("Saved cycling raw data")
+                    self.save_summaries(file_index)
                     self.files[file_index].set_status()
                 except Exception as e:
                     logger.error(f"Error in file nr {file_index}/{len(self.readers)}: \n{e}")
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+CHARGE_FLAGS = [2, 3]  # cc_charge, cv_charge
+DISCHARGE_FLAGS = [4]  # cc_discharge
+HPPC_FLAGS = [5, 6]  # hppc_test, hppc_discharge
+
+
+def _float_column(df, column):
+    # raw data can hold None after remove_nan (object dtype), cast it back to a float array
+    return df[column].to_numpy(dtype='float64', na_value=np.nan)
+
+
+def _none_where(values, mask):
+    """Returns a list where every entry with mask == True is replaced by None"""
+    result = values.astype(object)
+    result[mask] = None
+    return result.tolist()
+
+
+def get_ambient_temperature(df, groups):
+    """
+    Mean ambient temperature per cycle. A cycle only gets a temperature if it has no missing value (same as the
+    former per-cycle check with notnull().all()).
+    @param df: raw data of the cycles
+    @param groups: grouping key (cycle_id per row)
+    @return: list with the mean temperature or None per cycle
+    """
+    if 'ambient_temperature' not in df:
+        return None
+    temperature = pd.Series(_float_column(df, 'ambient_temperature'), index=df.index)
+    grouped = temperature.groupby(groups, sort=True)
+    complete = (grouped.count() == grouped.size()).to_numpy()
+    return _none_where(grouped.mean().to_numpy(), ~complete)
+
+
+def aggregate_cycles(df, theoretical_capacity):
+    """
+    Computes all aggregated values per cycle of a cycling test in one grouped pass.
+    @param df: cleaned cycling raw data (needs cycle_id, step_flag, current, capacity, voltage and time)
+    @param theoretical_capacity: capacity of the battery type to calculate the c-rates
+    @return: dict with one list per AggData field, ordered by cycle_id
+    """
+    flags = df['step_flag'].to_numpy()
+    charge = np.isin(flags, CHARGE_FLAGS)
+    discharge = np.isin(flags, DISCHARGE_FLAGS)
+    current = _float_column(df, 'current')
+    capacity = np.abs(_float_column(df, 'capacity'))
+
+    frame = pd.DataFrame({'charge_rows': charge,
+                          'discharge_rows': discharge,
+                          'charge_current': np.where(charge, current, np.nan),
+                          'discharge_current': np.where(discharge, current, np.nan),
+                          'charge_capacity': np.where(charge, capacity, np.nan),
+                          'discharge_capacity': np.where(discharge, capacity, np.nan),
+                          'voltage': _float_column(df, 'voltage'),
+                          'time': df['time']}, index=df.index)
+
+    groups = df['cycle_id'].to_numpy()
+    agg = frame.groupby(groups, sort=True).agg(charge_rows=('charge_rows', 'sum'),
+                                               discharge_rows=('discharge_rows', 'sum'),
+                                               cc_charge_avg=('charge_current', 'mean'),
+                                               cc_discharge_avg=('discharge_current', 'mean'),
+                                               charge_capacity=('charge_capacity', 'max'),
+                                               discharge_capacity=('discharge_capacity', 'max'),
+                                               min_voltage=('voltage', 'min'),
+                                               max_voltage=('voltage', 'max'),
+                                               start_time=('time', 'min'),
+                                               end_time=('time', 'max'))
+
+    no_charge = (agg['charge_rows'] == 0).to_numpy()
+    no_discharge = (agg['discharge_rows'] == 0).to_numpy()
+    charge_capacity = agg['charge_capacity'].to_numpy()
+    discharge_capacity = agg['discharge_capacity'].to_numpy()
+    charge_c_rate = np.round(agg['cc_charge_avg'].to_numpy() / theoretical_capacity, 2)
+    discharge_c_rate = np.round(np.abs(agg['cc_discharge_avg'].to_numpy()) / theoretical_capacity, 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        efficiency = discharge_capacity / charge_capacity * 100
+
+    return {'cycle_id': agg.index.tolist(),
+            'charge_capacity': _none_where(charge_capacity, no_charge),
+            'discharge_capacity': _none_where(discharge_capacity, no_discharge),
+            'efficiency': _none_where(efficiency, no_charge | no_discharge | (charge_capacity == 0)),
+            'charge_c_rate': _none_where(charge_c_rate, no_charge),
+            'discharge_c_rate': _none_where(discharge_c_rate, no_discharge),
+            'ambient_temperature': get_ambient_temperature(df, groups) or [None] * len(agg),
+            'start_time': agg['start_time'].tolist(),
+            'end_time': agg['end_time'].tolist(),
+            'min_voltage': agg['min_voltage'].tolist(),
+            'max_voltage': agg['max_voltage'].tolist()}
+
+
+def aggregate_hppc_cycles(df):
+    """
+    Computes the aggregated values per cycle of a HPPC test in one grouped pass.
+    @param df: cleaned HPPC raw data (needs cycle_id and time)
+    @return: dict with one list per HPPCAggData field, ordered by cycle_id
+    """
+    groups = df['cycle_id'].to_numpy()
+    times = df['time'].groupby(groups, sort=True)
+    start_time = times.min()
+    return {'cycle_id': start_time.index.tolist(),
+            'ambient_temperature': get_ambient_temperature(df, groups) or [None] * len(start_time),
+            'start_time': start_time.tolist(),
+            'end_time': times.max().tolist()}
+
+
+def calc_pulse_resistances(df):
+    """
+    Finds all HPPC pulses (consecutive rows with step_flag 5 or 6 inside a cycle) and calculates their resistance
+    against the last row before the pulse.
+    @param df: HPPC raw data with the original row index
+    @return: DataFrame with cycle_id, resistance and test_current per pulse
+    """
+    is_pulse = np.isin(df['step_flag'].to_numpy(), HPPC_FLAGS)
+    pulses = pd.DataFrame({'cycle_id': df['cycle_id'].to_numpy()[is_pulse],
+                           'current': _float_column(df, 'current')[is_pulse]}, index=df.index[is_pulse])
+    if pulses.empty:
+        return pd.DataFrame(columns=['cycle_id', 'resistance', 'test_current'])
+
+    index = pulses.index.to_series()
+    cycle_ids = pulses['cycle_id']
+    # a new pulse starts with a gap in the index or with a new cycle
+    pulse_ids = ((index.diff() > 1) | (cycle_ids != cycle_ids.shift())).cumsum()
+    grouped = pulses.groupby(pulse_ids.to_numpy(), sort=False)
+    result = grouped.agg(cycle_id=('cycle_id', 'first'), test_current=('current', 'mean'))
+    last_idx = index.groupby(pulse_ids.to_numpy(), sort=False).last().to_numpy()
+    before_idx = index.groupby(pulse_ids.to_numpy(), sort=False).first().to_numpy() - 1
+
+    voltage = pd.Series(_float_column(df, 'voltage'), index=df.index)
+    current = pd.Series(_float_column(df, 'current'), index=df.index)
+    diff_voltage = voltage.reindex(last_idx).to_numpy() - voltage.reindex(before_idx).to_numpy()
+    diff_current = current.reindex(last_idx).to_numpy() - current.reindex(before_idx).to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['resistance'] = diff_voltage / diff_current
+
+    return result.reset_index(drop=True)
+
+
+def map_agg_data_ids(cycle_ids, agg_datas):
+    """
+    Maps the cycle_id of every raw data row to the primary key of the aggregated data with the same cycle_id.
+    @param cycle_ids: cycle_id per raw data row
+    @param agg_datas: saved AggData/HPPCAggData entries of the test
+    @return: int64 array with the agg_data primary key per row
+    """
+    agg_cycle_ids = np.fromiter((agg_data.cycle_id for agg_data in agg_datas), dtype='int64', count=len(agg_datas))
+    agg_ids = np.fromiter((agg_data.pk for agg_data in agg_datas), dtype='int64', count=len(agg_datas))
+    positions = pd.Index(agg_cycle_ids).get_indexer(cycle_ids)
+    if (positions < 0).any():
+        missing = np.unique(np.asarray(cycle_ids)[positions < 0])
+        raise ValueError(f'No aggregated data found for cycle(s) {missing.tolist()}')
+    return agg_ids[positions]
@@ -0,0 +1,139 @@
+import io
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+
+CHUNK_ROWS = 100000  # rows encoded per chunk, bounds the memory of the COPY buffer
+
+PG_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + np.array([0, 0], dtype='>i4').tobytes()
+PG_COPY_TRAILER = np.array([-1], dtype='>i2').tobytes()
+PG_EPOCH_US = 946684800000000  # 2000-01-01 in microseconds since unix epoch
+
+# postgres column type -> numpy type of the binary representation
+PG_BINARY_TYPES = {
+    'double precision': '>f8',
+    'integer': '>i4',
+    'bigint': '>i8',
+    'smallint': '>i2',
+    'timestamp with time zone': '>i8',
+}
+
+
+def get_copy_columns(df, model):
+    """
+    Returns the columns of the model which are present in the DataFrame together with their binary type
+    @param df: data to load
+    @param model: Django model of the target table (CyclingRawData, HPPCRawData)
+    @return: list of tuples (column name, postgres type)
+    """
+    columns = []
+    for field in model._meta.concrete_fields:
+        column = field.get_attname_column()[1]
+        if column == 'id' or column not in df.columns:
+            continue
+        db_type = field.db_type(connection)
+        if db_type not in PG_BINARY_TYPES:
+            raise TypeError(f'Column {column} with type {db_type} can not be loaded with binary COPY')
+        columns.append((column, db_type))
+    return columns
+
+
+def _put(buffer, positions, values):
+    """Writes the bytes of every value at its start position in the buffer"""
+    width = values.dtype.itemsize
+    buffer[positions[:, None] + np.arange(width)] = values.view(np.uint8).reshape(-1, width)
+
+
+def _column_values(series, db_type):
+    if db_type == 'timestamp with time zone':
+        if isinstance(series.dtype, pd.DatetimeTZDtype):
+            series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+        times = pd.to_datetime(series).to_numpy().astype('datetime64[us]')
+        nulls = np.isnat(times)
+        values = times.astype('int64') - PG_EPOCH_US
+    else:
+        values = series.to_numpy(dtype='float64', na_value=np.nan)
+        nulls = np.isnan(values)
+        if db_type != 'double precision':
+            values = np.where(nulls, 0, values)
+    return values.astype(PG_BINARY_TYPES[db_type]), nulls
+
+
+def encode_binary_chunk(df, columns):
+    """
+    Encodes the rows of the DataFrame as tuples of the PostgreSQL binary COPY format
+    @param df: chunk of the data to load
+    @param columns: list of tuples (column name, postgres type), see get_copy_columns
+    @return: bytes with one binary tuple per row
+    """
+    nbr_of_rows = len(df)
+    encoded = [_column_values(df[column], db_type) for column, db_type in columns]
+    row_sizes = np.full(nbr_of_rows, 2, dtype='int64')
+    for values, nulls in encoded:
+        row_sizes += 4 + np.where(nulls, 0, values.dtype.itemsize)
+    positions = np.zeros(nbr_of_rows, dtype='int64')
+    positions[1:] = np.cumsum(row_sizes)[:-1]
+
+    buffer = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+    _put(buffer, positions, np.full(nbr_of_rows, len(columns), dtype='>i2'))
+    positions = positions + 2
+    for values, nulls in encoded:
+        _put(buffer, positions, np.where(nulls, -1, values.dtype.itemsize).astype('>i4'))
+        positions = positions + 4
+        _put(buffer, positions[~nulls], values[~nulls])
+        positions = positions + np.where(nulls, 0, values.dtype.itemsize)
+    return buffer.tobytes()
+
+
+class BinaryCopyStream(io.RawIOBase):
+    """
+    File-like object for cursor.copy_expert, which encodes the DataFrame chunk by chunk while it is read.
+    Only one encoded chunk is held in memory at any time.
+    """
+
+    def __init__(self, df, columns, chunk_rows=CHUNK_ROWS):
+        super().__init__()
+        self.chunks = self._generate(df, columns, chunk_rows)
+        self.chunk = b''
+        self.offset = 0
+
+    @staticmethod
+    def _generate(df, columns, chunk_rows):
+        yield PG_COPY_HEADER
+        for start in range(0, len(df), chunk_rows):
+            yield encode_binary_chunk(df.iloc[start:start + chunk_rows], columns)
+        yield PG_COPY_TRAILER
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        while size < 0 or size > 0:
+            if self.offset >= len(self.chunk):
+                self.chunk = next(self.chunks, None)
+                self.offset = 0
+                if self.chunk is None:
+                    self.chunk = b''
+                    break
+            end = len(self.chunk) if size < 0 else min(len(self.chunk), self.offset + size)
+            parts.append(self.chunk[self.offset:end])
+            if size > 0:
+                size -= end - self.offset
+            self.offset = end
+        return b''.join(parts)
+
+
+def copy_rawdata(df, model, chunk_rows=CHUNK_ROWS):
+    """
+    Loads the DataFrame into the table of the model with a binary COPY, works for cycling and HPPC raw data
+    @param df: raw data with columns named like the table columns (agg_data_id instead of agg_data)
+    @param model: CyclingRawData or HPPCRawData
+    @param chunk_rows: number of rows encoded at once
+    """
+    columns = get_copy_columns(df, model)
+    column_names = ", ".join(f'"{column}"' for column, db_type in columns)
+    sql = f'COPY {model._meta.db_table} ({column_names}) FROM STDIN WITH (FORMAT binary)'
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, BinaryCopyStream(df, columns, chunk_rows), size=1 << 20)
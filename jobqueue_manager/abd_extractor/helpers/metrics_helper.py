@@ -0,0 +1,83 @@
+import functools
+import resource
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+from django.db import connection
+
+# measured values of a stage, summed up over its calls (rss: maximum)
+METRIC_FIELDS = ('calls', 'wall', 'cpu', 'rows', 'rss', 'queries')
+
+
+def get_peak_rss():
+    """@return: peak resident memory of the process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+class StageMetrics:
+    """
+    Wall time, CPU time (of the thread) and rows of the stages of an extraction, the increase of the peak RSS of the
+    process in MB and the database round trips (statements of the django connection, a COPY is not counted) during
+    the stage. A stage which runs several times (e.g. per chunk of a streamed file) is summed up, a stage can be part
+    of another one (e.g. convert_step_name_to_step_flag of get_data).
+    The metrics of a file are collected by its reader, also in the parse processes, and stored in UploadFile.metrics.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def measure(self, stage, rows=None):
+        """
+        Measures the block as stage
+        @param rows: rows processed by the stage, can also be set on the yielded dict ('rows')
+        """
+        measurement = {'rows': rows, 'queries': 0}
+
+        def count_queries(execute, sql, params, many, context):
+            measurement['queries'] += 1
+            return execute(sql, params, many, context)
+
+        peak_rss = get_peak_rss()
+        cpu = time.thread_time()
+        wall = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count_queries):
+                yield measurement
+        finally:
+            values = self.stages.setdefault(stage, dict.fromkeys(METRIC_FIELDS, 0))
+            values['calls'] += 1
+            values['wall'] += time.perf_counter() - wall
+            values['cpu'] += time.thread_time() - cpu
+            values['rows'] += measurement['rows'] or 0
+            values['rss'] = max(values['rss'], get_peak_rss() - peak_rss)
+            values['queries'] += measurement['queries']
+
+    def to_json(self):
+        """@return: {stage: {field: value}} with rounded times (s) and memory (MB), in the order of the first calls"""
+        return {stage: {'calls': values['calls'],
+                        'wall': round(values['wall'], 4),
+                        'cpu': round(values['cpu'], 4),
+                        'rows': values['rows'],
+                        'rss': round(values['rss'], 1),
+                        'queries': values['queries']}
+                for stage, values in self.stages.items()}
+
+
+def measured(method):
+    """
+    Measures a method of a reader as stage of the reader's metrics, the rows are the rows of the data afterwards.
+    Readers without metrics (e.g. in the benchmarks) are not measured.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = getattr(self, 'metrics', None)
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        with metrics.measure(method.__name__) as measurement:
+            result = method(self, *args, **kwargs)
+            if isinstance(self.data, pd.DataFrame):
+                measurement['rows'] = len(self.data)
+        return result
+    return wrapper
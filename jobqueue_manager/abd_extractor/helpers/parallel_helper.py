@@ -0,0 +1,61 @@
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+
+import queue_settings
+
+
+def get_result(future):
+    """@return: tuple (result, exception) of the finished future"""
+    try:
+        return future.result(), None
+    except Exception as e:
+        return None, e
+
+
+def ordered_map(func, tasks, processes=None, ahead=None):
+    """
+    Runs func(*task) for every task in a pool of processes and yields the results in the order of the tasks, so a
+    result can be used while the next tasks run. Only ahead tasks are started ahead of the result which is used, at
+    most ahead + 1 results are held in memory. With one process the tasks run in a background thread, a single task
+    runs in this thread.
+    @param func: function on module level (processes get it pickled by name)
+    @param tasks: tuples of picklable arguments
+    @param processes: size of the pool, queue_settings.parse_processes by default, limited to ahead
+    @param ahead: number of tasks started ahead, queue_settings.parse_ahead by default
+    @return: generator of tuples (result, exception), the exception of a task is returned instead of raised
+    """
+    if processes is None:
+        processes = queue_settings.parse_processes
+    if ahead is None:
+        ahead = queue_settings.parse_ahead
+    tasks = list(tasks)
+    ahead = max(ahead, 1)
+    processes = max(min(processes, ahead, len(tasks)), 1)
+    if len(tasks) <= 1:
+        for task in tasks:
+            try:
+                yield func(*task), None
+            except Exception as e:
+                yield None, e
+        return
+
+    if processes == 1:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    else:
+        # the processes set up django like the extractor workers and ignore stop signals (the running job is finished)
+        from jobqueue_manager.workers import init_worker
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+                                                          mp_context=multiprocessing.get_context('spawn'))
+    pending = iter(tasks)
+    try:
+        futures = collections.deque(executor.submit(func, *task) for task in itertools.islice(pending, ahead))
+        while futures:
+            for task in itertools.islice(pending, 1):
+                futures.append(executor.submit(func, *task))
+            # the future is not referenced here anymore, the consumer decides how long the result is kept
+            yield get_result(futures.popleft())
+    finally:
+        # also if the consumer stops early
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -1,4 +1,8 @@
 import re
+import warnings
+
+import numpy as np
+import pandas as pd
 
 
 def get_number(str):
@@ -12,3 +16,128 @@ def cast_datetime_to_float(dt):
     my_float = total_milliseconds / 1000.0  # convert to float, showing seconds with decimal places for milliseconds
 
     return my_float
+
+
+def read_excel_chunks(file, header_row, skip_rows, chunk_rows):
+    """
+    Reads the first sheet of an excel file row by row and yields it as DataFrames of at most chunk_rows rows.
+    The chunks together are what pd.read_excel(file, header=header_row, skiprows=skip_rows) returns at once.
+    @param file: path of the excel file
+    @param header_row: index of the row with the column names
+    @param skip_rows: indices of rows after the header which are not part of the data (e.g. units)
+    @param chunk_rows: maximum number of rows per chunk
+    """
+    from openpyxl import load_workbook  # same dependency as pd.read_excel for .xlsx
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = None
+        for index, row in enumerate(rows):
+            if index == header_row:
+                header = row
+                break
+        if header is None:
+            return
+        columns = [name if name is not None else f'Unnamed: {index}' for index, name in enumerate(header)]
+        nbr_of_columns = len(columns)
+
+        chunk = []
+        for index, row in enumerate(rows, start=header_row + 1):
+            if index in skip_rows:
+                continue
+            chunk.append(tuple(row[:nbr_of_columns]) + (None,) * (nbr_of_columns - len(row)))
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame.from_records(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame.from_records(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+
+class HeaderIndex:
+    """
+    Inverted index of the text cells in the header region of a file: lower case cell text -> (row, column).
+    Built once from the first rows, so the metadata lookups do not scan the DataFrame cell by cell again.
+    The lookups match parts of the cell text like the former cell by cell search: the version is found in
+    'Version V 1.600.386' and the units in '[A]' or '[Ah]', so they can not be answered by the exact cell text.
+    """
+
+    def __init__(self, df):
+        self.cells = {}
+        self.results = {}
+        values = df.to_numpy(dtype=object)
+        for row, column in zip(*np.nonzero(~pd.isna(values))):
+            value = values[row, column]
+            if isinstance(value, str):
+                self.cells.setdefault(value.lower(), []).append((row, column))
+
+    def find(self, text):
+        """
+        Same result as a cell by cell search for cells which contain text (lower case).
+        Only the distinct texts of the index are searched and the result is kept for the next lookup.
+        @return: array with the (row, column) of the hits in row order, shape (0, 2) if there is none
+        """
+        if text not in self.results:
+            hits = sorted(position for cell, positions in self.cells.items() if text in cell
+                          for position in positions)
+            self.results[text] = np.array(hits, dtype='int64').reshape(-1, 2)
+        return self.results[text]
+
+
+# step names which are converted directly, charge and discharge are split by current and voltage
+STEP_NAME_FLAGS = {'OCV': 1, 'CC_Chg': 2, 'CC_Dchg': 4}
+UNKNOWN_STEP_FLAG = 99
+
+
+def update_cv_limits(step_name, voltage, cv_max_voltage=None, cv_min_voltage=None):
+    """
+    Limits of the CV steps: the highest voltage of the rows named 'charge' and the lowest of the rows named
+    'discharge', rounded to 2 decimals. Combined with the limits of the other rows of the file in streaming mode.
+    @param step_name: Series with the step names
+    @param voltage: Series with the voltage
+    @return: tuple (cv_max_voltage, cv_min_voltage), None if there is no such row
+    """
+    voltage = voltage.round(2).to_numpy(dtype='float64', na_value=np.nan)
+    is_charge = (step_name == 'charge').to_numpy(dtype=bool, na_value=False)
+    is_discharge = (step_name == 'discharge').to_numpy(dtype=bool, na_value=False)
+
+    with warnings.catch_warnings():  # all-NaN slices only give NaN limits
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if is_charge.any():
+            cv_max_voltage = np.fmax(np.nanmax(voltage[is_charge]),
+                                     cv_max_voltage if cv_max_voltage is not None else np.nan)
+        if is_discharge.any():
+            cv_min_voltage = np.fmin(np.nanmin(voltage[is_discharge]),
+                                     cv_min_voltage if cv_min_voltage is not None else np.nan)
+    return cv_max_voltage, cv_min_voltage
+
+
+def classify_steps(step_name, current, voltage, cv_max_voltage=None, cv_min_voltage=None):
+    """
+    Derives the step_flag of every row in one pass from the step name and the measured values.
+    Rows named 'charge' are CC charge (2) or CV charge (3) at the highest charge voltage, rows named 'discharge' are
+    CC discharge (4) or CV discharge (5) at the lowest discharge voltage, rows without current are OCV (1).
+    @param step_name: Series with the step names ('charge', 'discharge', 'OCV', 'CC_Chg', 'CC_Dchg')
+    @param current: Series with the current
+    @param voltage: Series with the voltage, compared rounded to 2 decimals
+    @param cv_max_voltage: highest charge voltage of the whole file in streaming mode (update_cv_limits)
+    @param cv_min_voltage: lowest discharge voltage of the whole file in streaming mode (update_cv_limits)
+    @return: tuple (float array with the step_flag, NaN for rows which fit no step; cv_max_voltage; cv_min_voltage)
+    """
+    cv_max_voltage, cv_min_voltage = update_cv_limits(step_name, voltage, cv_max_voltage, cv_min_voltage)
+    current = current.to_numpy(dtype='float64', na_value=np.nan)
+    voltage = voltage.round(2).to_numpy(dtype='float64', na_value=np.nan)
+    is_charge = (step_name == 'charge').to_numpy(dtype=bool, na_value=False)
+    is_discharge = (step_name == 'discharge').to_numpy(dtype=bool, na_value=False)
+    no_current = current == 0
+
+    charge_flag = np.select([no_current, voltage == cv_max_voltage, voltage < cv_max_voltage], [1, 3, 2],
+                            default=np.nan) if is_charge.any() else np.nan
+    discharge_flag = np.select([no_current, voltage == cv_min_voltage, current < 0], [1, 5, 4],
+                               default=np.nan) if is_discharge.any() else np.nan
+    direct_flag = step_name.map(STEP_NAME_FLAGS).to_numpy(dtype='float64', na_value=UNKNOWN_STEP_FLAG)
+
+    step_flag = np.select([is_charge, is_discharge], [charge_flag, discharge_flag], default=direct_flag)
+    return step_flag, cv_max_voltage, cv_min_voltage
@@ -0,0 +1,99 @@
+import queue
+import threading
+
+import numpy as np
+import pandas as pd
+
+STREAMING_MIN_KB = 200000  # files from 200mb on are read, cleaned and saved chunk by chunk
+STREAM_CHUNK_ROWS = 100000  # rows per chunk of a streamed file
+
+
+class CycleBuffer:
+    """
+    Collects the cleaned chunks of a streamed file and hands out the rows of the complete cycles.
+    The last cycle of a chunk is held back because it can continue in the next chunk.
+    Carries the state which close_cycle_gaps gets from the whole file: the consecutive cycle numbering and a running
+    row index (the HPPC pulse detection relies on it).
+    """
+
+    def __init__(self):
+        self.cycle_numbers = {}  # cycle_id of the file -> consecutive cycle_id
+        self.pending = None
+        self.nbr_of_rows = 0
+        self.end_time = None
+
+    def renumber(self, chunk):
+        """Same numbering as close_cycle_gaps (order of the first appearance), continued over the chunks"""
+        codes, uniques = pd.factorize(chunk['cycle_id'])
+        numbers = np.fromiter((self.cycle_numbers.setdefault(cycle_id, len(self.cycle_numbers) + 1)
+                               for cycle_id in uniques.tolist()), dtype='int64', count=len(uniques))
+        chunk['cycle_id'] = numbers[codes]
+
+    def push(self, chunk):
+        """
+        @param chunk: cleaned chunk of the file
+        @return: rows of all cycles which are complete
+        """
+        chunk.index = pd.RangeIndex(self.nbr_of_rows, self.nbr_of_rows + len(chunk))
+        self.nbr_of_rows += len(chunk)
+        if chunk.empty:
+            return chunk
+        self.renumber(chunk)
+        chunk_end = chunk['time'].max()
+        if self.end_time is None or chunk_end > self.end_time:
+            self.end_time = chunk_end
+        if self.pending is not None:
+            chunk = pd.concat([self.pending, chunk])
+        is_last_cycle = chunk['cycle_id'].to_numpy() == chunk['cycle_id'].iloc[-1]
+        self.pending = chunk[is_last_cycle]
+        return chunk[~is_last_cycle]
+
+    def flush(self):
+        """@return: rows of the last cycle at the end of the file"""
+        rest = self.pending if self.pending is not None else pd.DataFrame()
+        self.pending = None
+        return rest
+
+    def get_nbr_of_cycles(self):
+        return len(self.cycle_numbers)
+
+
+def prefetch(iterable, size=1):
+    """
+    Iterates over the iterable in a background thread, so the next chunk is already parsed while the current one is
+    loaded into the database. At most size items are held in advance.
+    """
+    items = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stopped.is_set():
+            try:
+                items.put(entry, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stopped.set()
@@ -5,8 +5,6 @@ from abd_database.models import CyclingRawData
 # TODO: Change naming to reflect use for cycling and HPPC data
 def get_cyclingRawData_csv(df_cyclingRawData):
     """ Works for Cycling and for HPPC data"""
-    df_cyclingRawData['agg_data'] = df_cyclingRawData['agg_data'].apply(lambda x: x.pk)
-    df_cyclingRawData = df_cyclingRawData.rename(columns={"agg_data": "agg_data_id"})
     cyclingRawData_fields = []
     for field in CyclingRawData._meta.fields:
         cyclingRawData_fields.append(field.get_attname_column()[1])
@@ -47,7 +47,7 @@ class AggData:
 
 
 class CyclingRawData:
-    required_fields = ['agg_data', 'voltage', 'cycle_id', 'step_flag', 'current', 'capacity', 'energy', 'time']  # todo why time_in_step is req? 'time_in_step',
+    required_fields = ['agg_data_id', 'voltage', 'cycle_id', 'step_flag', 'current', 'capacity', 'energy', 'time']  # todo why time_in_step is req? 'time_in_step',
     additional_fields = ['cell_temperature', 'ambient_temperature']
 
     def allowed_fields(self):
@@ -55,7 +55,7 @@ class CyclingRawData:
 
 
 class HPPCRawData:
-    required_fields = ['agg_data', 'voltage', 'cycle_id', 'step_flag', 'current', 'time']
+    required_fields = ['agg_data_id', 'voltage', 'cycle_id', 'step_flag', 'current', 'time']
     additional_fields = ['cell_temperature', 'ambient_temperature', 'capacity', 'energy']
 
     def allowed_fields(self):
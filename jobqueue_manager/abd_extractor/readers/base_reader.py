@@ -5,14 +5,23 @@ import pandas as pd
 import time
 import pytz
 
+from jobqueue_manager.abd_extractor.helpers.metrics_helper import measured, StageMetrics
+from jobqueue_manager.abd_extractor.helpers.reader_helper import classify_steps, HeaderIndex, UNKNOWN_STEP_FLAG
+
 
 class BaseReader(ABC):
+
     def __init__(self, file):
         self.data = {}
         self.file = file
         self.date = None
         self.unit_conversion = False  # if we had mA and need to convert to A set this on True
         self.header_line = 0
+        self.header_index = None
+        # limits of the CV steps, carried over the chunks in streaming mode
+        self.cv_max_voltage = None
+        self.cv_min_voltage = None
+        self.metrics = StageMetrics()  # stages of the extraction of the file
         self.column_types = {'voltage': 'float64',
                              'current': 'float64',
                              'capacity': 'float64',
@@ -27,12 +36,15 @@ class BaseReader(ABC):
     def get_data(self, file):
         pass
 
+    def index_header(self):
+        # index the text cells of the header region in self.data once, the metadata lookups use this index
+        self.header_index = HeaderIndex(self.data)
+
     def str_finder(self, str_to_find):
-        # return a matrix where value True when string exist in that df field (string search lower case)
-        # TODO: FutureWarning: DataFrame.applymap has been deprecated. Use DataFrame.map instead.
-        mask = self.data.applymap(lambda x: str_to_find in x.lower() if isinstance(x, str) else False).to_numpy()
-        indices = np.argwhere(mask)  # return "coordinates" of the found True value
-        return indices
+        # return "coordinates" of the fields where the string exists in the header region (string search lower case)
+        if self.header_index is None:
+            self.index_header()
+        return self.header_index.find(str_to_find)
 
     def find_header(self, string):
         indices = self.str_finder(string)  # (string search lower case)
@@ -42,6 +54,7 @@ class BaseReader(ABC):
         except IndexError:
             print('no header found')
 
+    @measured
     def transform_to_timezone_bound(self):
         localtz = time.tzname
         tz = pytz.timezone('Europe/Zurich')
@@ -55,77 +68,23 @@ class BaseReader(ABC):
         else:
             NotImplementedError(f'{localtz[1]} is not implemented')
 
+    @measured
     def convert_step_name_to_step_flag(self):
-        self.data['step_flag'] = 99  # init step flag column with not used value to check at the end if it worked
-
-        if self.unit_conversion:  # if wee need to change the unit from mA to A, comparison below need multiplier
-            multiplier = 1000
-        else:
-            multiplier = 1
-
-        while 1:
-            charge = False
-            discharge = False
-
-            # if there are part cycles they are mixed we only take the part cycle to split it in its parts (dis-charge)
-            if 'charge' in self.data['step_name'].unique():
-                dfy = self.data[self.data['step_name'] == 'charge'].filter(
-                    ['current', 'voltage']).reset_index()
-                charge = True
-                self.data = self.data.replace('charge', 'done')
-
-            elif 'discharge' in self.data['step_name'].unique():
-                dfy = self.data[self.data['step_name'] == 'discharge'].filter(
-                    ['current', 'voltage']).reset_index()
-                discharge = True
-                self.data = self.data.replace('discharge', 'done')
-
-            elif 'OCV' in self.data['step_name'].unique():  # directly convert the OCV flag
-                self.data.loc[self.data.step_name == 'OCV', 'step_flag'] = 1  # OCV
-                self.data = self.data.replace('OCV', 'done')
-
-            elif 'CC_Chg' in self.data['step_name'].unique():  # directly convert the CC_Chg flag
-                self.data.loc[self.data.step_name == 'CC_Chg', 'step_flag'] = 2  # CC_Chg
-                self.data = self.data.replace('CC_Chg', 'done')
-
-            elif 'CC_Dchg' in self.data['step_name'].unique():  # directly convert the CC_Dchg flag
-                self.data.loc[self.data.step_name == 'CC_Dchg', 'step_flag'] = 4  # CC_Dchg
-                self.data = self.data.replace('CC_Dchg', 'done')
-
-            else:
-                break
-
-            if charge:  # if the combined cycle is a charge
-                cv_max_value = dfy['voltage'].round(2).max()
-                dfy.loc[dfy.voltage.round(2) == cv_max_value, 'step_name'] = 3  # set CV_Chg value
-                dfy.loc[dfy.voltage.round(2) < cv_max_value, 'step_name'] = 2  # set CC_Chg value
-
-            if discharge:  # if the combined cycle is a discharge
-                cv_min_value = dfy['voltage'].round(2).min()
-                dfy.loc[dfy.current * multiplier < 0, 'step_name'] = 4  # set CC_Dchg value
-                dfy.loc[dfy.voltage.round(2) == cv_min_value, 'step_name'] = 5  # set CV_Dchg
-
-            if charge or discharge:
-                dfy.loc[dfy.current * multiplier == 0, 'step_name'] = 1  # set OCV value
-
-                # set all the values from combined cycle in self.data['step_flag']
-                for elements in range(0, len(dfy)):
-                    # Vectorized
-                    # TODO: check if this is faster than the original atleast SettingWithCopyWarning is gone
-                    index = dfy['index'].iloc[elements]
-                    self.data.loc[index, 'step_flag'] = dfy['step_name'].iloc[elements].copy()
-                    # Original
-                    # self.data['step_flag'].iloc[index] = dfy['step_name'].iloc[elements]
-
+        # one vectorized pass over all rows, charge and discharge steps are split in CC, CV and OCV parts
+        step_flag, self.cv_max_voltage, self.cv_min_voltage = classify_steps(
+            self.data['step_name'], self.data['current'], self.data['voltage'],
+            self.cv_max_voltage, self.cv_min_voltage)
+        self.data['step_flag'] = step_flag
 
         # if there is a nan value in step_flag the behaviour of the device was not CC_ or CV_Chg, CC_ or CV_Dchg, OCV
         self.data = self.data.dropna(subset=['step_flag']).reset_index(drop=True)  # delete those rows
         self.data['step_flag'] = self.data['step_flag'].astype('int32')  # convert column to int
 
-        if 99 in self.data['step_flag'].unique():
+        if UNKNOWN_STEP_FLAG in self.data['step_flag'].unique():
             print('one or more elements are not converted to the right step_flag')
             # todo handle the case of not treated cases
 
+    @measured
     def check_headers(self, required_names, additional_names):
         column_names = set(self.data.columns)
 
@@ -140,6 +99,7 @@ class BaseReader(ABC):
         required_names.update(additional_names)  # combine required and allowed fields to only delete not expected field
         self.data.drop(columns=list(column_names - required_names), inplace=True)
 
+    @measured
     def remove_nan(self):
         self.data = self.data.replace("", np.nan)
         self.data.fillna(value=np.nan, axis='columns', inplace=True)
@@ -151,3 +111,17 @@ class BaseReader(ABC):
         # TODO: check if timestamp is valid (not in unix, and not in the future or impossible past
         if first_timestamp:
             self.date = first_timestamp
+
+
+class StreamingReader(ABC):
+    """
+    Readers which also read big files in streaming mode, the extractor only streams the files of these readers
+    """
+
+    @abstractmethod
+    def get_chunks(self, chunk_rows):
+        """
+        Streaming mode for big files: yields the data as prepared chunks of at most chunk_rows rows instead of
+        keeping the whole file in self.data. State which depends on previous rows is carried over the chunks.
+        @param chunk_rows: maximum number of rows per chunk
+        """
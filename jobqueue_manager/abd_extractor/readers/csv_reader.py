@@ -1,9 +1,10 @@
 import pandas as pd
 
-from jobqueue_manager.abd_extractor.readers.base_reader import BaseReader
+from jobqueue_manager.abd_extractor.readers.base_reader import BaseReader, StreamingReader
 
 
-class CsvReader(BaseReader):
+class CsvReader(BaseReader, StreamingReader):
+
     def __init__(self, file):
         file = file.get_path()
         super(CsvReader, self).__init__(file)
@@ -28,8 +29,13 @@ class CsvReader(BaseReader):
                 # TODO: error handling
                 pass
 
-    def get_data(self):  # todo check on header, units
+    def read_header(self):
+        """
+        Finds the header line and the unit row from the first rows of the file
+        @return: list with the index of the unit row or empty list
+        """
         self.data = pd.read_csv(self.file, nrows=10)
+        self.index_header()
         if 'voltage' not in self.data.columns:
             self.find_header('voltage')  # (string search lower case)
         else:
@@ -41,6 +47,14 @@ class CsvReader(BaseReader):
         except IndexError as e:
             print('IndexError:', e)
             unit_row = []
+        return unit_row
+
+    def read_on_failure(self):
+        self.data = pd.read_csv(self.file)  # remove first row (second header)
+        self.data_cleaner_on_failure()
+
+    def get_data(self):  # todo check on header, units
+        unit_row = self.read_header()
 
         try:  # try to read csv with type cast and date parse remove unit column
             self.data = pd.read_csv(self.file, header=self.header_line, skiprows=unit_row,
@@ -48,5 +62,38 @@ class CsvReader(BaseReader):
 
         except ValueError as e:
             print('ValueError:', e)
-            self.data = pd.read_csv(self.file)  # remove first row (second header)
-            self.data_cleaner_on_failure()
+            self.read_on_failure()
+
+    def clean_chunk_on_failure(self, chunk):
+        """
+        Streaming counterpart of data_cleaner_on_failure for a chunk read as text: the rows with text in a typed
+        column (second header, units) are dropped before the chunk is cast, the file is never read at once
+        """
+        column_types = {column: dtype for column, dtype in self.column_types.items() if column in chunk.columns}
+        values = chunk[list(column_types)]
+        numbers = values.apply(pd.to_numeric, errors='coerce')
+        times = pd.to_datetime(chunk['time'], errors='coerce')
+        is_text = (numbers.isna() & values.notna()).any(axis=1) | (times.isna() & chunk['time'].notna())
+        self.data = chunk[~is_text.to_numpy()].astype(column_types | {'time': 'datetime64[ns]'})
+
+        self.data = self.data.rename(columns={'time': 'time_no_tz'})
+        self.transform_to_timezone_bound()
+        return self.data.reset_index(drop=True)
+
+    def get_chunks(self, chunk_rows):
+        unit_row = self.read_header()
+
+        try:  # the type cast fails on the first chunk if the file has a second header
+            chunks = pd.read_csv(self.file, header=self.header_line, skiprows=unit_row,
+                                 dtype=self.column_types, parse_dates=['time'], chunksize=chunk_rows)
+            first_chunk = next(chunks, None)
+        except ValueError as e:
+            print('ValueError:', e)
+            for chunk in pd.read_csv(self.file, header=self.header_line, skiprows=unit_row, dtype=str,
+                                     chunksize=chunk_rows):
+                yield self.clean_chunk_on_failure(chunk)
+            return
+
+        if first_chunk is not None:
+            yield first_chunk
+            yield from chunks
@@ -3,19 +3,24 @@ import numpy as np
 import datetime
 from difflib import SequenceMatcher
 
-from jobqueue_manager.abd_extractor.helpers.reader_helper import cast_datetime_to_float
-from jobqueue_manager.abd_extractor.readers.base_reader import BaseReader
+from jobqueue_manager.abd_extractor.helpers.reader_helper import cast_datetime_to_float, read_excel_chunks, \
+    update_cv_limits
+from jobqueue_manager.abd_extractor.readers.base_reader import BaseReader, StreamingReader
 from customexceptions import VersionError
 
 # todo to open .xlsx files need to install openpyxl package (pip install openpyxl)
 
 
-class DigatronReader(BaseReader):
+class DigatronReader(BaseReader, StreamingReader):
+
     def __init__(self, file):
         file = file.get_path()
         self.start_date = ''
         self.unit_conversion_curr = False
         self.unit_conversion_cap = False
+        # end of the previous chunk in streaming mode
+        self.last_capacity = None
+        self.last_energy = None
         self.meta = pd.DataFrame()
         self.version_list = ['V 1.600.386']  # versions witch are compatible with this script
         super(DigatronReader, self).__init__(file)
@@ -82,8 +87,17 @@ class DigatronReader(BaseReader):
             print('Header not found or no meta data in this file')
 
     def remove_unwanted_status_lines(self, status):
-        indices = self.str_finder(status)
-        self.data = self.data.drop(indices[:, 0])  # remove the rows where status is unwanted
+        # rows with the status in any text cell (string search lower case), checked column by column
+        unwanted = np.zeros(len(self.data), dtype=bool)
+        for position, dtype in enumerate(self.data.dtypes):
+            if dtype != object and not isinstance(dtype, pd.StringDtype):
+                continue
+            try:
+                cells = self.data.iloc[:, position].str.lower()
+            except AttributeError:  # no text in the column
+                continue
+            unwanted |= cells.str.contains(status, regex=False, na=False).to_numpy(dtype=bool)
+        self.data = self.data[~unwanted]  # remove the rows where status is unwanted
         self.data = self.data.reset_index(drop=True)
 
     def remove_switching_rows(self):
@@ -108,19 +122,34 @@ class DigatronReader(BaseReader):
             self.data['capacity'] = self.data['capacity'] / 1000  # conv mAh to Ah
 
     def set_step_flag(self):
-        self.data = self.data.replace(['CHA', 'DCH', 'PAU'], ['charge', 'discharge', 'OCV'])  # replace Status names
+        self.data['step_name'] = self.data['step_name'].replace(['CHA', 'DCH', 'PAU'], ['charge', 'discharge', 'OCV'])  # replace Status names
         self.convert_step_name_to_step_flag()
 
     def time_conversion(self):  # construct a timestamp with start date and program time (starts by 0)
         self.data['time_no_tz'] = pd.to_timedelta(self.data['Program time'].astype(str)) + self.start_date
 
     def energy_calculation(self):
-        # calculate the difference of energy
-        self.data.loc[self.data['current'] != 0, 'energy_diff'] = self.data['capacity'].diff() * self.data['voltage']
+        # calculate the difference of energy, in streaming mode the first row continues the previous chunk
+        capacity_diff = self.data['capacity'].diff()
+        if self.last_capacity is not None and len(self.data) > 0:
+            capacity_diff.iloc[0] = self.data['capacity'].iloc[0] - self.last_capacity
+        self.data.loc[self.data['current'] != 0, 'energy_diff'] = capacity_diff * self.data['voltage']
         self.data.loc[self.data['current'] == 0, 'energy_diff'] = 0  # if current 0 energy 0
         self.data.loc[self.data['capacity'] == 0, 'energy_diff'] = 0  # if capacity 0 energy 0
         # use groupeby and cumsum to cumulate the energy in the column and reset to 0 every time energy is 0
-        self.data['energy'] = self.data.groupby(self.data.energy_diff.eq(0).cumsum()).energy_diff.transform('cumsum')
+        groups = self.data.energy_diff.eq(0).cumsum()
+        self.data['energy'] = self.data.groupby(groups).energy_diff.transform('cumsum')
+
+        if self.last_energy is not None:
+            # the rows before the first reset continue the cumulation of the previous chunk
+            self.data.loc[groups == 0, 'energy'] += self.last_energy
+        if len(self.data) > 0:
+            last_group = groups.iloc[-1]
+            energy = self.data.loc[groups == last_group, 'energy_diff'].sum()
+            if last_group == 0 and self.last_energy is not None:
+                energy += self.last_energy
+            self.last_capacity = self.data['capacity'].iloc[-1]
+            self.last_energy = energy
 
     def get_temp_fields(self, nbr_of_fields):
         chan_hits = []
@@ -142,46 +171,85 @@ class DigatronReader(BaseReader):
                     temperature_pairs.append((chan_hit, t_hit))
         return temperature_pairs
 
-    def get_data(self):
+    def read_meta_data(self):
+        """
+        Reads version, start date, header line, temperature column and units from the first rows of the file
+        @return: name of the temperature column
+        """
         self.data = pd.read_excel(self.file, nrows=30)
-        version_supported = self.find_version()
-
-        if version_supported:  # if version nr is not supported upload not possible
-            self.find_start_date()
-            self.find_header('step time')  # todo unit check on second header line
-
-            # temp_column = self.str_finder('[t1]')  # search for temperature column (string search lower case)
-            temperature_pairs = self.get_temp_fields(3)
-            if len(temperature_pairs) > 1:
-                #     TODO: pick from selection
-                pass
-            elif len(temperature_pairs) <= 0:
-                #     TODO: throw error --> no pairs found // or just ignore temp field
-                pass
-            else:
-                pass
-            col_name = self.data.iloc[temperature_pairs[0][0][0], temperature_pairs[0][0][1]]
+        self.index_header()
+        self.find_version()  # if version nr is not supported upload not possible
+        self.find_start_date()
+        self.find_header('step time')  # todo unit check on second header line
+
+        # temp_column = self.str_finder('[t1]')  # search for temperature column (string search lower case)
+        temperature_pairs = self.get_temp_fields(3)
+        if len(temperature_pairs) > 1:
+            #     TODO: pick from selection
+            pass
+        elif len(temperature_pairs) <= 0:
+            #     TODO: throw error --> no pairs found // or just ignore temp field
+            pass
+        else:
+            pass
+        col_name = self.data.iloc[temperature_pairs[0][0][0], temperature_pairs[0][0][1]]
+
+        self.split_meta_data()
+        self.unit_check()
+        return col_name
+
+    def rename_columns(self, col_name):
+        self.data.rename({'Current': 'current',
+                          'Voltage': 'voltage',
+                          'AhAccu': 'capacity',
+                          'Cycle': 'cycle_id',
+                          'Status': 'step_name',
+                          'Step time': 'time_in_step'}, axis=1, inplace=True)
+        if col_name:
+            self.data.rename({col_name: 'ambient_temperature'}, axis=1, inplace=True)
+        self.data['step_name'] = self.data['step_name'].astype("string")
+        self.data['time_in_step'] = self.data['time_in_step'].apply(lambda x: cast_datetime_to_float(x))
+
+    def prepare_data(self):
+        self.adjust_data()
+        self.set_step_flag()
+        self.time_conversion()
+        self.energy_calculation()
+        self.transform_to_timezone_bound()
 
-            self.split_meta_data()
-            self.unit_check()
-            try:
-                self.data = pd.read_excel(self.file, header=self.header_line+1, skiprows=[self.header_line+2])
-                self.data.rename({'Current': 'current',
-                                  'Voltage': 'voltage',
-                                  'AhAccu': 'capacity',
-                                  'Cycle': 'cycle_id',
-                                  'Status': 'step_name',
-                                  'Step time': 'time_in_step'}, axis=1, inplace=True)
-                if col_name:
-                    self.data.rename({col_name: 'ambient_temperature'}, axis=1, inplace=True)
-                self.data['step_name'] = self.data['step_name'].astype("string")
-                self.data['time_in_step'] = self.data['time_in_step'].apply(lambda x: cast_datetime_to_float(x))
-
-            except ValueError as ve:
-                print('ValueError:', ve)
-
-            self.adjust_data()
-            self.set_step_flag()
-            self.time_conversion()
-            self.energy_calculation()
-            self.transform_to_timezone_bound()
+    def get_data(self):
+        col_name = self.read_meta_data()
+        try:
+            self.data = pd.read_excel(self.file, header=self.header_line+1, skiprows=[self.header_line+2])
+            self.rename_columns(col_name)
+
+        except ValueError as ve:
+            print('ValueError:', ve)
+
+        self.prepare_data()
+
+    def find_cv_limits(self, chunk_rows):
+        """
+        Pre-pass of the streaming mode over the status and voltage of the file: the CV steps of every chunk are
+        classified with the limits of the whole file like in get_data, not only with the limits of the chunks before
+        """
+        for chunk in read_excel_chunks(self.file, self.header_line + 1, [self.header_line + 2], chunk_rows):
+            self.data = chunk.rename(columns={'Status': 'step_name', 'Voltage': 'voltage', 'AhAccu': 'capacity'})
+            self.data['step_name'] = self.data['step_name'].astype("string")
+            # the rows which adjust_data removes, the status is searched in all columns
+            self.remove_unwanted_status_lines('prg')
+            self.remove_unwanted_status_lines('sto')
+            self.remove_switching_rows()
+            step_name = self.data['step_name'].replace(['CHA', 'DCH'], ['charge', 'discharge'])
+            self.cv_max_voltage, self.cv_min_voltage = update_cv_limits(
+                step_name, self.data['voltage'].astype(np.float64), self.cv_max_voltage, self.cv_min_voltage)
+        self.data = pd.DataFrame()
+
+    def get_chunks(self, chunk_rows):
+        col_name = self.read_meta_data()
+        self.find_cv_limits(chunk_rows)
+        for chunk in read_excel_chunks(self.file, self.header_line + 1, [self.header_line + 2], chunk_rows):
+            self.data = chunk
+            self.rename_columns(col_name)
+            self.prepare_data()
+            yield self.data
@@ -0,0 +1,390 @@
+import csv
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.http import HttpResponse, StreamingHttpResponse
+
+import jobqueue_manager.abd_extractor.helpers.aggregation_helper as aggregation
+from abd_database.helpers import timescale
+from abd_database.helpers.db import execute_prepared, iterate_query, prepare
+from abd_database.helpers.downsampling import PLOT_MAX_POINTS, downsample
+from abd_database.helpers.plot_data import make_plot_data, make_trace
+from abd_database.models import CyclingRawData
+from abd_database.views_export import ExportRawData, stream_csv
+from jobqueue_manager.abd_extractor.extractors.baseExtractor import parse_file
+from jobqueue_manager.abd_extractor.helpers.copy_helper import BinaryCopyStream, get_copy_columns
+from jobqueue_manager.abd_extractor.helpers.metrics_helper import get_peak_rss
+from jobqueue_manager.abd_extractor.helpers.parallel_helper import ordered_map
+from jobqueue_manager.abd_extractor.helpers.stream_helper import STREAM_CHUNK_ROWS
+from jobqueue_manager.abd_extractor.helpers.to_csv_helper import get_cyclingRawData_csv
+from jobqueue_manager.abd_extractor.readers.base_reader import BaseReader
+from jobqueue_manager.abd_extractor.readers.csv_reader import CsvReader
+from jobqueue_manager.test_helper import LocalFile, generate_cycling_data, legacy_convert_step_name_to_step_flag
+
+
+def legacy_aggregate_cycles(df, theoretical_capacity):
+    """Per-cycle loop as used by BaseExtractor.save_aggData before the vectorized aggregation (without saving)"""
+    entries = []
+    for cycle_index, group in df.groupby('cycle_id'):
+        charge_c_rate = discharge_c_rate = charge_capacity = discharge_capacity = None
+        efficiency = ambient_temperature = None
+        if len(group[group['step_flag'].isin([2, 3])]['current']) > 0:
+            cc_charge_avg = group[group['step_flag'].isin([2, 3])]['current'].mean()
+            charge_c_rate = np.round(cc_charge_avg / theoretical_capacity, 2)
+        if len(group[group['step_flag'] == 4]['current']) > 0:
+            cc_discharge_avg = abs(group[group['step_flag'] == 4]['current'].mean())
+            discharge_c_rate = np.round(cc_discharge_avg / theoretical_capacity, 2)
+        if len(group[group['step_flag'].isin([2, 3])]) > 0:
+            charge_capacity = group[group['step_flag'].isin([2, 3])]['capacity'].abs().max()
+        if len(group[group['step_flag'] == 4]['capacity']) > 0:
+            discharge_capacity = group[group['step_flag'] == 4]['capacity'].abs().max()
+        if discharge_capacity is not None and charge_capacity is not None and charge_capacity != 0:
+            efficiency = discharge_capacity / charge_capacity * 100
+        if 'ambient_temperature' in group:
+            if group['ambient_temperature'].notnull().values.all():
+                ambient_temperature = group['ambient_temperature'].mean()
+        entries.append((cycle_index, charge_capacity, discharge_capacity, efficiency, charge_c_rate,
+                        discharge_c_rate, ambient_temperature, group['time'].min(), group['time'].max(),
+                        group['voltage'].min(), group['voltage'].max()))
+    return entries
+
+
+def generate_step_names(df):
+    """Step names of a device which only reports charge, discharge and pause, as Digatron does"""
+    df = df.drop(columns='step_flag').assign(
+        step_name=np.select([df['step_flag'].isin([2, 3]), df['step_flag'] == 4], ['charge', 'discharge'],
+                            default='OCV'))
+    df.loc[df['step_name'] == 'OCV', 'current'] = 0.0
+    return df
+
+
+def benchmark_aggdata(options):
+    df = generate_cycling_data(options['cycles'], options['rows_per_cycle'])
+    results = []
+    for name, func in (('before (per-cycle loop)', legacy_aggregate_cycles),
+                       ('after (vectorized)', aggregation.aggregate_cycles)):
+        start = time.perf_counter()
+        func(df, 2.5)
+        results.append((name, len(df), time.perf_counter() - start))
+    return results
+
+
+def _read_all(stream, size=1 << 20):
+    while stream.read(size):
+        pass
+
+
+def _measure(func):
+    """@return: duration and peak memory in MB of func, measured in two runs (tracing slows down allocations)"""
+    start = time.perf_counter()
+    func()
+    duration = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak / 1e6
+
+
+def benchmark_copy(options):
+    """Client side of the raw data load: in-memory CSV rendering vs. chunked binary COPY encoding"""
+    df = generate_cycling_data(options['cycles'], options['rows_per_cycle'])
+    df['agg_data_id'] = df['cycle_id']
+    columns = get_copy_columns(df, CyclingRawData)
+    results = []
+    for name, func in (('before (csv StringIO)', lambda: _read_all(get_cyclingRawData_csv(df.copy())[0])),
+                       ('after (binary COPY)', lambda: _read_all(BinaryCopyStream(df, columns)))):
+        duration, peak = _measure(func)
+        results.append((f'{name} peak {peak:,.0f}MB', len(df), duration))
+    return results
+
+
+def benchmark_stream(options):
+    """Reading a CSV upload at once vs. in chunks with the streaming reader"""
+    df = generate_cycling_data(options['cycles'], options['rows_per_cycle'])
+    df['time'] = df['time'].dt.tz_localize(None)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'upload.csv')
+        df.to_csv(path, index=False)
+        upload = SimpleNamespace(get_path=lambda: path)
+
+        def read_all():
+            CsvReader(upload).get_data()
+
+        def read_chunks():
+            for chunk in CsvReader(upload).get_chunks(STREAM_CHUNK_ROWS):
+                pass
+
+        results = []
+        for name, func in (('before (whole file)', read_all), ('after (chunks)', read_chunks)):
+            duration, peak = _measure(func)
+            results.append((f'{name} peak {peak:,.0f}MB', len(df), duration))
+    return results
+
+
+def benchmark_stepflag(options):
+    df = generate_step_names(generate_cycling_data(options['cycles'], options['rows_per_cycle']))
+    reader = SimpleNamespace(cv_max_voltage=None, cv_min_voltage=None)
+
+    def vectorized():
+        reader.data = df.copy()
+        BaseReader.convert_step_name_to_step_flag(reader)
+
+    results = []
+    for name, func in (('before (step name loop)', lambda: legacy_convert_step_name_to_step_flag(df)),
+                       ('after (classify_steps)', vectorized)):
+        start = time.perf_counter()
+        func()
+        results.append((name, len(df), time.perf_counter() - start))
+    return results
+
+
+def _scan(cursor, sql, params=None):
+    start = time.perf_counter()
+    cursor.execute(sql, params)
+    return len(cursor.fetchall()), time.perf_counter() - start
+
+
+def _create_scratch_rawdata(cursor, table, df):
+    """Loads synthetic raw data into a hypertable like the raw data table, without its row level security"""
+    columns = get_copy_columns(df, CyclingRawData)
+    column_names = ", ".join(f'"{column}"' for column, db_type in columns)
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute(f"CREATE TABLE {table} (LIKE abd_database_cyclingrawdata)")
+    cursor.execute(f"ALTER TABLE {table} DROP COLUMN id")
+    cursor.execute("SELECT create_hypertable(%s, 'time', chunk_time_interval => %s::interval)",
+                   [table, timescale.CHUNK_TIME_INTERVAL])
+    cursor.execute(f"CREATE INDEX ON {table} (agg_data_id)")
+    cursor.copy_expert(f'COPY {table} ({column_names}) FROM STDIN WITH (FORMAT binary)',
+                       BinaryCopyStream(df, columns), size=1 << 20)
+
+
+def benchmark_compression(options):
+    """Disk size and scan time of raw data in a scratch hypertable before and after native compression"""
+    df = generate_cycling_data(options['cycles'], options['rows_per_cycle'])
+    df['agg_data_id'] = df['cycle_id']
+    table = 'benchmark_compression_rawdata'
+    cycles = list(range(1, options['cycles'] + 1, max(options['cycles'] // 10, 1)))
+    # same queries as capacity_vs_voltage_for_cycles and get_data_for_battery
+    cycles_sql = f"SELECT time, voltage, capacity, step_flag, agg_data_id FROM {table} WHERE agg_data_id = ANY(%s)"
+    full_sql = f"SELECT * FROM {table} ORDER BY time"
+
+    results = []
+    with connections[timescale.DB_ALIAS].cursor() as cursor:
+        _create_scratch_rawdata(cursor, table, df)
+        try:
+            for name in ('before (uncompressed)', 'after (compressed)'):
+                if name.startswith('after'):
+                    error = timescale.enable_compression(table, 'agg_data_id')
+                    if error:
+                        raise CommandError(error)
+                    timescale.compress_chunks(table)
+                cursor.execute(f"ANALYZE {table}")
+                size = timescale.get_hypertable_stats(table)['total_bytes'] / 1e6
+                rows, duration = _scan(cursor, cycles_sql, [cycles])
+                results.append((f'{name} {size:,.0f}MB, {len(cycles)} cycles', rows, duration))
+                rows, duration = _scan(cursor, full_sql)
+                results.append((f'{name} {size:,.0f}MB, all rows', rows, duration))
+        finally:
+            cursor.execute(f"DROP TABLE {table}")
+    return results
+
+
+def benchmark_export(options):
+    """
+    Raw data csv export: fetchall into a HttpResponse vs. server-side cursor into a StreamingHttpResponse.
+    The peak RSS of a process only grows, so the streamed export runs first and each run reports its increase.
+    """
+    df = generate_cycling_data(options['cycles'], options['rows_per_cycle'])
+    df['agg_data_id'] = df['cycle_id']
+    table = 'benchmark_export_rawdata'
+    fields = ExportRawData.fields
+    sql = f"SELECT {', '.join(fields)} FROM {table} ORDER BY time"
+
+    def legacy():
+        with connections[timescale.DB_ALIAS].cursor() as cursor:
+            cursor.execute(sql)
+            rows = cursor.fetchall()
+        response = HttpResponse(content_type='text/csv')
+        writer = csv.writer(response)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow(row)
+        return None
+
+    def streamed():
+        response = StreamingHttpResponse(stream_csv(iterate_query(sql, using=timescale.DB_ALIAS), [fields]))
+        first_byte = None
+        for piece in response.streaming_content:
+            if first_byte is None:
+                first_byte = time.perf_counter()
+        return first_byte
+
+    results = []
+    with connections[timescale.DB_ALIAS].cursor() as cursor:
+        _create_scratch_rawdata(cursor, table, df)
+        cursor.execute(f"ANALYZE {table}")
+    try:
+        for name, func in (('after (streamed)', streamed), ('before (fetchall)', legacy)):
+            peak = get_peak_rss()
+            start = time.perf_counter()
+            first_byte = func()
+            duration = time.perf_counter() - start
+            if first_byte is not None:
+                name += f' first byte {first_byte - start:.2f}s'
+            results.append((f'{name} peak RSS +{get_peak_rss() - peak:,.0f}MB', len(df), duration))
+    finally:
+        with connections[timescale.DB_ALIAS].cursor() as cursor:
+            cursor.execute(f"DROP TABLE {table}")
+    return results
+
+
+def benchmark_plot(options):
+    """
+    Capacity vs. voltage plot of 20 cycles (as capacity_vs_voltage_for_cycles) with all points vs. downsampled, as
+    plotly figure vs. compact plot data
+    """
+    df = generate_cycling_data(20, options['rows_per_cycle'] * 100)
+
+    def figure(max_points, compact):
+        fig = go.Figure()
+        traces = []
+        for cycle_id, cycle in df.groupby('cycle_id'):
+            for flags in ([2, 3], [4]):
+                trace = downsample(cycle[cycle['step_flag'].isin(flags)].sort_values(by='capacity'), 'voltage',
+                                   max_points)
+                if compact:
+                    traces.append(make_trace(str(cycle_id), trace['capacity'], trace['voltage']))
+                else:
+                    fig.add_trace(go.Scatter(x=trace['capacity'], y=trace['voltage'], mode='markers'))
+        if compact:
+            return json.dumps(make_plot_data(traces, 'Capacity', 'Voltage'))
+        return fig.to_json()
+
+    results = []
+    for name, max_points, compact in (('before (all points)', None, False),
+                                      (f'after ({PLOT_MAX_POINTS} points/trace)', PLOT_MAX_POINTS, False),
+                                      ('after (compact plot data)', PLOT_MAX_POINTS, True)):
+        start = time.perf_counter()
+        size = len(figure(max_points, compact))
+        results.append((f'{name} {size / 1e6:,.1f}MB', len(df), time.perf_counter() - start))
+    return results
+
+
+def _planning_time(cursor, sql, params):
+    """@return: planning time of the query in ms"""
+    cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", params)
+    return cursor.fetchone()[0][0]['Planning Time']
+
+
+def benchmark_prepared(options):
+    """
+    Repeated capacity tab queries (capacity_vs_voltage_for_cycles) with changing cycle selections: the cycle ids
+    formatted into the query text (parsed and planned on every call) vs. one prepared statement with = ANY(%s)
+    """
+    df = generate_cycling_data(options['cycles'], options['rows_per_cycle'])
+    df['agg_data_id'] = df['cycle_id']
+    table = 'benchmark_prepared_rawdata'
+    fields = "time, voltage, capacity, step_flag, agg_data_id"
+    literal_sql = f"SELECT {fields} FROM {table} WHERE agg_data_id IN {{}}"
+    prepared_sql = f"SELECT {fields} FROM {table} WHERE agg_data_id = ANY(%s)"
+    rng = np.random.default_rng(0)
+    selections = [rng.choice(np.arange(1, options['cycles'] + 1), size=rng.integers(2, 6), replace=False).tolist()
+                  for _ in range(500)]
+
+    def literal(cursor, cycles):
+        cursor.execute(literal_sql.format(tuple(cycles)))
+
+    def prepared(cursor, cycles):
+        execute_prepared(cursor, prepared_sql, [cycles])
+
+    results = []
+    with connections[timescale.DB_ALIAS].cursor() as cursor:
+        _create_scratch_rawdata(cursor, table, df)
+        cursor.execute(f"ANALYZE {table}")
+        try:
+            for name, query in (('before (literal ids)', literal), ('after (prepared, = ANY)', prepared)):
+                rows = 0
+                start = time.perf_counter()
+                for cycles in selections:
+                    query(cursor, cycles)
+                    rows += len(cursor.fetchall())
+                duration = time.perf_counter() - start
+                if query is literal:
+                    planning = _planning_time(cursor, literal_sql.format(tuple(selections[0])), None)
+                else:
+                    planning = _planning_time(cursor, f"EXECUTE {prepare(cursor, prepared_sql)} (%s)",
+                                              [selections[0]])
+                results.append((f'{name} planning {planning:.2f}ms/query', rows, duration))
+        finally:
+            cursor.execute(f"DROP TABLE {table}")
+    return results
+
+
+def benchmark_parse(options):
+    """
+    Parsing and cleaning of the CSV files of a batch (parse_file) with 1 process (in this process) up to one process
+    per core, the wall time includes the start of the processes
+    """
+    df = generate_cycling_data(options['cycles'], options['rows_per_cycle'])
+    df['time'] = df['time'].dt.tz_localize(None)
+    fields = (CyclingRawData.get_required_fields(None), CyclingRawData.get_additional_fields(None))
+    cores = os.cpu_count() or 1
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        tasks = []
+        for index in range(options['files']):
+            path = os.path.join(directory, f'upload_{index}.csv')
+            df.to_csv(path, index=False)
+            tasks.append((CsvReader, LocalFile(path), *fields))
+
+        processes = 1
+        while True:
+            start = time.perf_counter()
+            for parsed, error in ordered_map(parse_file, tasks, processes, ahead=processes):
+                if error is not None:
+                    raise CommandError(error)
+            duration = time.perf_counter() - start
+            speedup = results[0][2] / duration if results else 1
+            results.append((f'{len(tasks)} files, {processes} processes x{speedup:.1f}', len(df) * len(tasks),
+                            duration))
+            if processes >= min(cores, len(tasks)):
+                return results
+            processes = min(processes * 2, cores)
+
+
+STAGES = {
+    'aggdata': benchmark_aggdata,
+    'copy': benchmark_copy,
+    'stream': benchmark_stream,
+    'stepflag': benchmark_stepflag,
+    'compression': benchmark_compression,
+    'export': benchmark_export,
+    'plot': benchmark_plot,
+    'prepared': benchmark_prepared,
+    'parse': benchmark_parse,
+}
+
+
+class Command(BaseCommand):
+    help = "Benchmarks stages of the extraction pipeline with synthetic data and reports rows/sec"
+
+    def add_arguments(self, parser):
+        parser.add_argument('stage', choices=STAGES.keys())
+        parser.add_argument('--cycles', type=int, default=2000)
+        parser.add_argument('--rows-per-cycle', type=int, default=200)
+        parser.add_argument('--files', type=int, default=8, help="files per batch of the parse stage")
+
+    def handle(self, *args, **options):
+        for name, rows, duration in STAGES[options['stage']](options):
+            self.stdout.write(f"{options['stage']:<10} {name:<40} {rows:>12,} rows {duration:>9.3f}s "
+                              f"{rows / duration:>14,.0f} rows/s")
@@ -0,0 +1,33 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+import queue_settings
+from jobqueue_manager.manager_helper import cleanup_fileupload
+from jobqueue_manager.workers import ExtractorPool
+
+
+class Command(BaseCommand):
+    help = "Runs extractor processes which consume the upload queue until SIGTERM or Ctrl+C"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=queue_settings.nbr_of_workers,
+                            help="number of extractor processes")
+        parser.add_argument('--skip-cleanup', action='store_true',
+                            help="do not remove unreferenced uploaded files on start")
+
+    def handle(self, *args, **options):
+        if not options['skip_cleanup']:
+            cleanup_fileupload()
+        pool = ExtractorPool(options['workers'])
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping, waiting for the running jobs to finish...")
+            pool.shutdown(wait=False)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        pool.start()
+        self.stdout.write(f"Started {options['workers']} extractor workers")
+        pool.join()
+        self.stdout.write("All extractor workers stopped")
@@ -1,99 +1,92 @@
+import atexit
 import logging
 import threading
+from collections import defaultdict
 from copy import copy
-from queue import PriorityQueue
 
-from django.db.models import Q
-from django.db import connection
+from abd_database.helpers.db import set_active_tenant
 
 from jobqueue_manager.manager_helper import get_priority, PublicQueue, QueueFile, QueueBatch, cleanup_fileupload
+from jobqueue_manager.models import QueueJob
+from jobqueue_manager.workers import ExtractorPool, is_worker_process
 import queue_settings
 
 logger = logging.getLogger(__name__)
 
-q = PriorityQueue()
-public_queue = PublicQueue()
-
-
-def start_extractor():
-    while True:
-        warnings = []
-        batch = q.get()
-        public_queue.set_active()
-        successful_files = []
-
-        # TODO: To be investigated, as queue is not per tenant
-        with connection.cursor() as cursor:
-            cursor.execute("SET abd.active_tenant = %s", [batch[2].user.company_id])
-
-        # TODO: removed exclude battery --> needs check for further impl.
-        files_in_batch = batch[2].uploadfile_set.all().filter(~Q(status='SUCCESS') & Q(forget=False)).exclude(celltest__isnull=False).order_by('id')
-        if batch[3]:
-            files_in_batch = files_in_batch.filter(pk=batch[3])
-        logger.info("+++++++++++ Start Batch +++++++++++")
-        logger.info(f"{len(files_in_batch)} files selected for upload.")
-        from jobqueue_manager.manager_helper import map_extractor_types
-        map_extractor_types(batch[2].extractor_type, files_in_batch, batch[2].user.company, batch[4])
-        logger.info("Extraction complete, starting cleaning up")
-        try:
-            batch[2].delete_files()
-        except Exception:
-            # TODO: keine symptoms bekämpfung!!! ursache lösen!!!!
-            pass
-        logger.info("Successfully deleted all remaining files")
-        public_queue.remove_active()
-        unhandled_files = list(set(map(lambda x: x.file.name, files_in_batch)) - set(successful_files))
-        if len(warnings) > 0:
-            for warning in warnings:
-                logger.warning(warning)
-        logger.info(
-            f"{len(successful_files)}/{len(files_in_batch)} successfully uploaded, {len(unhandled_files)}/{len(files_in_batch)} could not be uploaded")
-        logger.info("++++++++++++ End Batch ++++++++++++")
+pool = None
+pool_lock = threading.Lock()
+
+
+def extract_batch(job):
+    """
+    Extracts all files of the job which are not uploaded yet, runs in an extractor worker process
+    @param job: claimed QueueJob
+    """
+    warnings = []
+    successful_files = []
+    batch = job.batch
+
+    # TODO: To be investigated, as queue is not per tenant
+    set_active_tenant(batch.user.company_id)
+
+    # TODO: removed exclude battery --> needs check for further impl.
+    files_in_batch = job.get_files()
+    logger.info("+++++++++++ Start Batch +++++++++++")
+    logger.info(f"{len(files_in_batch)} files selected for upload.")
+    from jobqueue_manager.manager_helper import map_extractor_types
+    map_extractor_types(batch.extractor_type, files_in_batch, batch.user.company, job.get_argument_list())
+    logger.info("Extraction complete, starting cleaning up")
+    try:
+        batch.delete_files()
+    except Exception:
+        # TODO: keine symptoms bekämpfung!!! ursache lösen!!!!
+        pass
+    logger.info("Successfully deleted all remaining files")
+    unhandled_files = list(set(map(lambda x: x.file.name, files_in_batch)) - set(successful_files))
+    if len(warnings) > 0:
+        for warning in warnings:
+            logger.warning(warning)
+    logger.info(
+        f"{len(successful_files)}/{len(files_in_batch)} successfully uploaded, {len(unhandled_files)}/{len(files_in_batch)} could not be uploaded")
+    logger.info("++++++++++++ End Batch ++++++++++++")
 
 
 def start_queue():
-    global thread
-    thread = threading.Thread(target=start_extractor, daemon=True)
-    thread.start()
-    # cleanup is buggy
-    if q.empty():
-        # comment out for local dev
-        cleanup_fileupload()
+    """
+    Starts the extractor processes of this web server, only if embedded_workers is set.
+    Otherwise, the queue is consumed by manage.py run_extractor_worker.
+    """
+    global pool
+    if is_worker_process() or not queue_settings.embedded_workers:
+        return
+    with pool_lock:
+        if pool is None:
+            pool = ExtractorPool(queue_settings.nbr_of_workers)
+            pool.start()
+            atexit.register(stop_queue)
+            cleanup_fileupload()
 
 
-def is_queue_alive():
-    try:
-        return thread.is_alive()
-    except Exception:
-        return False
+def stop_queue():
+    """Graceful shutdown: running jobs are finished, queued jobs stay in the queue table"""
+    if pool is not None:
+        pool.shutdown(wait=True)
 
 
 def add_to_queue(batch, user, argument_list: list = None, target_file_id=None):
-    if not is_queue_alive():
-        start_queue()
     error_message = None
-    current_queue_size = public_queue.get_total_size()
+    current_queue_size = QueueJob.objects.get_total_size()
     if current_queue_size < queue_settings.max_queue_size:
         priority = get_priority(user)
-        queue_file_list = list()
-        file_list = []
-        all_files = batch.uploadfile_set.all().filter(~Q(status='SUCCESS') & Q(forget=False)).exclude(celltest__isnull=False).order_by('id')
-        if target_file_id:
-            all_files = all_files.filter(pk=target_file_id)
-        sum_size_kb = 0
-        for file in all_files:
-            file_list.append(file.kb)
-            queue_file_list.append(QueueFile(file.file_name, file.kb, file.checksum))
-            sum_size_kb += file.kb
+        job = QueueJob(batch=batch, user=user, priority=priority, target_file_id=target_file_id)
+        if argument_list:
+            job.battery, job.equipment, job.date, job.dataset = argument_list
+        file_list = [file.kb for file in job.get_files()]
+        sum_size_kb = sum(file_list)
         if sum_size_kb < queue_settings.max_batch_size:
             if current_queue_size + sum_size_kb < queue_settings.max_queue_size:
-                for index, file in enumerate(file_list):
-                    if sum_size_kb == 0:
-                        file_list[index] = (file, 0)
-                    else:
-                        file_list[index] = (file, file / sum_size_kb * 100)
-                public_queue.add_to_batches(QueueBatch(batch.id, user, queue_file_list))
-                q.put((priority, batch.__hash__(), batch, target_file_id, argument_list))
+                job.kb = sum_size_kb
+                job.save()
                 logger.info(f"Successfully added {len(file_list)} files to queue with {sum_size_kb:,}kb!")
             else:
                 error_message = f"Selected batch would exceed queue threshold of {int(queue_settings.max_queue_size):,}kb to {int(current_queue_size + sum_size_kb - queue_settings.max_queue_size):,}kb. Please try a smaller batch or try later!"
@@ -106,8 +99,29 @@ def add_to_queue(batch, user, argument_list: list = None, target_file_id=None):
     return error_message
 
 
+def get_public_queue():
+    """
+    @return: PublicQueue with the queued and running jobs of all users
+    """
+    from abd_database.models import UploadFile
+    public_queue = PublicQueue()
+    jobs = list(QueueJob.objects.pending().select_related('user', 'batch'))
+    # the files of all jobs in one query instead of one per job
+    files_per_batch = defaultdict(list)
+    for file in QueueJob.filter_extracted_files(UploadFile.objects.filter(batch__in={job.batch_id for job in jobs})):
+        files_per_batch[file.batch_id].append(file)
+    for job in jobs:
+        queue_file_list = [QueueFile(file.file_name, file.kb, file.checksum) for file in files_per_batch[job.batch_id]
+                           if not job.target_file_id or file.pk == job.target_file_id]
+        queue_batch = QueueBatch(job.batch_id, job.user, queue_file_list)
+        queue_batch.active = job.status == QueueJob.StatusCodes.RUNNING
+        public_queue.add_to_batches(queue_batch)
+    return public_queue
+
+
 def get_queue_status(user=None):
-    if not is_queue_alive() or len(public_queue.batches) < 1:
+    public_queue = get_public_queue()
+    if len(public_queue.batches) < 1:
         return
     users_in_queue = list(batch.user for batch in public_queue.batches)
     map_user_to_id = lambda x: [(x[t], t) for t in range(len(x))]
@@ -115,7 +129,6 @@ def get_queue_status(user=None):
 
     anon_public_queue = PublicQueue()
 
-    public_queue.sort_by_priority()
     for batch in public_queue.batches:
         anon_batch = copy(batch)
         if not anon_batch.user == user:
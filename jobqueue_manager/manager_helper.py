@@ -1,4 +1,5 @@
 import os
+import time
 from dataclasses import dataclass, field
 from enum import Enum
 from typing import List
@@ -32,10 +33,20 @@ def map_extractor_types(extractor_name, files, owner, argument_list=None):
 
 
 # TODO: periodically call cleanup method
-def cleanup_fileupload():
+def cleanup_fileupload(min_age=3600):
+    """
+    Removes uploaded files which are not referenced by an upload anymore.
+    Files of queued uploads and of failed uploads which can be re-done are kept.
+    @param min_age: seconds, younger files are kept as their upload could still be in progress
+    """
+    from abd_database.models import UploadFile
     dir = os.path.join(settings.MEDIA_ROOT, 'uploadfiles')
+    referenced = set(os.path.basename(name) for name in
+                     UploadFile.objects.filter(is_deleted=False).values_list('file', flat=True))
     for file in os.listdir(dir):
-        os.remove(os.path.join(dir, file))
+        path = os.path.join(dir, file)
+        if file not in referenced and time.time() - os.path.getmtime(path) > min_age:
+            os.remove(path)
 
 
 def get_priority(user) -> int:
@@ -144,12 +155,3 @@ class PublicQueue:
     def sort_by_priority(self):
         if len(self.batches) > 0:
             self.batches = sorted(self.batches, key=lambda x: x.priority)
-
-    def set_active(self):
-        self.sort_by_priority()
-        self.batches[0].active = True
-
-    def remove_active(self):
-        self.sort_by_priority()
-        del self.batches[0]
-        self.get_total_size()
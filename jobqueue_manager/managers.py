@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from django.db import models as djangoModels
+from django.db import connection, transaction
+from django.utils import timezone
+
+# key of the advisory lock which serializes the claims of all workers
+CLAIM_LOCK_ID = 7301
+
+
+class QueueJobManager(djangoModels.Manager):
+    def pending(self):
+        """Queued and running jobs in the order they are claimed"""
+        return self.filter(status__in=[self.model.StatusCodes.QUEUED, self.model.StatusCodes.RUNNING]) \
+            .order_by('priority', 'id')
+
+    def get_total_size(self):
+        """
+        @return: size in kb of all queued and running jobs
+        """
+        return self.pending().aggregate(total=djangoModels.Sum('kb'))['total'] or 0
+
+    def requeue_expired(self, lease_timeout, max_attempts):
+        """
+        Gives running jobs without heartbeat for lease_timeout seconds back to the queue, their worker is gone.
+        Jobs which already lost max_attempts workers are set to failed.
+        @return: number of jobs put back into the queue
+        """
+        expired = self.filter(status=self.model.StatusCodes.RUNNING,
+                              heartbeat__lt=timezone.now() - timedelta(seconds=lease_timeout))
+        expired.filter(attempts__gte=max_attempts).update(
+            status=self.model.StatusCodes.FAILED, worker=None,
+            error_details=f'Extractor worker stopped responding {max_attempts} times')
+        return expired.update(status=self.model.StatusCodes.QUEUED, worker=None)
+
+    def claim(self, worker):
+        """
+        Takes the next queued job by priority and marks it as running for the worker.
+        Jobs of a battery which is in work by another worker are skipped to keep the cycle offsets correct,
+        rows locked by another transaction are skipped instead of waited for.
+        @param worker: name of the claiming worker
+        @return: claimed QueueJob or None if there is nothing to do
+        """
+        table = self.model._meta.db_table
+        queued = self.model.StatusCodes.QUEUED
+        running = self.model.StatusCodes.RUNNING
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # without this lock two workers could claim two jobs of the same battery at the same moment,
+                # it is only held for the claim itself
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CLAIM_LOCK_ID])
+                cursor.execute(f"""
+                    UPDATE {table}
+                    SET status = %s, worker = %s, started = now(), heartbeat = now(), attempts = attempts + 1
+                    WHERE id = (
+                        SELECT job.id FROM {table} job
+                        WHERE job.status = %s AND (job.battery_id IS NULL OR NOT EXISTS (
+                            SELECT 1 FROM {table} other
+                            WHERE other.status = %s AND other.battery_id = job.battery_id))
+                        ORDER BY job.priority, job.id
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED)
+                    RETURNING id""", [running, worker, queued, running])
+                row = cursor.fetchone()
+        if row is None:
+            return None
+        return self.select_related('batch__user').get(pk=row[0])
+
+    def beat(self, job_id, worker):
+        """
+        Renews the lease of a running job
+        @return: False if the job is not owned by the worker anymore
+        """
+        return self.filter(pk=job_id, worker=worker, status=self.model.StatusCodes.RUNNING) \
+            .update(heartbeat=timezone.now()) > 0
+
+    def finish(self, job_id, worker, error_details=None):
+        """
+        Removes a successfully extracted job from the queue or keeps it as failed with the error details
+        """
+        job = self.filter(pk=job_id, worker=worker, status=self.model.StatusCodes.RUNNING)
+        if error_details is None:
+            job.delete()
+        else:
+            job.update(status=self.model.StatusCodes.FAILED, error_details=error_details)
@@ -0,0 +1,44 @@
+# Generated by Django 4.0.4 on 2026-10-18 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('abd_database', '0015_auto_20231211_1230'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.PositiveSmallIntegerField()),
+                ('kb', models.PositiveIntegerField(default=0)),
+                ('equipment', models.CharField(blank=True, max_length=512, null=True)),
+                ('date', models.DateField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('FAILED', 'Failed')], default='QUEUED', max_length=16)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat', models.DateTimeField(blank=True, null=True)),
+                ('worker', models.CharField(blank=True, max_length=128, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error_details', models.TextField(blank=True, null=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='abd_database.uploadbatch')),
+                ('battery', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='abd_database.battery')),
+                ('dataset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='abd_database.dataset')),
+                ('target_file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='abd_database.uploadfile')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='queuejob',
+            index=models.Index(fields=['status', 'priority', 'id'], name='queuejob_claim_idx'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db import models
+
+from jobqueue_manager.managers import QueueJobManager
+
+
+class QueueJob(models.Model):
+    """
+    Persistent entry of the upload queue, one per call of add_to_queue.
+    Jobs are claimed by the extractor workers (manage.py run_extractor_worker or the workers started with the web
+    server) and removed after a successful extraction. Failed jobs are kept with their error details.
+    """
+
+    class StatusCodes(models.TextChoices):
+        QUEUED = 'QUEUED'
+        RUNNING = 'RUNNING'
+        FAILED = 'FAILED'
+
+    batch = models.ForeignKey('abd_database.UploadBatch', on_delete=models.CASCADE)
+    target_file = models.ForeignKey('abd_database.UploadFile', blank=True, null=True, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    priority = models.PositiveSmallIntegerField()
+    kb = models.PositiveIntegerField(default=0)
+
+    # arguments of the extractor, see map_extractor_types (a job is deleted with its battery, nothing to extract into)
+    battery = models.ForeignKey('abd_database.Battery', blank=True, null=True, on_delete=models.CASCADE)
+    equipment = models.CharField(max_length=512, blank=True, null=True)
+    date = models.DateField(blank=True, null=True)
+    dataset = models.ForeignKey('abd_database.Dataset', blank=True, null=True, on_delete=models.SET_NULL)
+
+    status = models.CharField(max_length=16, choices=StatusCodes.choices, default=StatusCodes.QUEUED)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    heartbeat = models.DateTimeField(blank=True, null=True)
+    worker = models.CharField(max_length=128, blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error_details = models.TextField(blank=True, null=True)
+
+    objects = QueueJobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'priority', 'id'], name='queuejob_claim_idx'),
+        ]
+
+    def get_argument_list(self):
+        """
+        Arguments for the extractor as passed to add_to_queue. Needs the active tenant to be set.
+        @return: tuple (battery, equipment, date, dataset)
+        """
+        return self.battery, self.equipment, self.date, self.dataset
+
+    def get_files(self):
+        """
+        @return: files of the batch which are extracted by this job
+        """
+        files = self.filter_extracted_files(self.batch.uploadfile_set.all())
+        if self.target_file_id:
+            files = files.filter(pk=self.target_file_id)
+        return files
+
+    @staticmethod
+    def filter_extracted_files(files):
+        """
+        @param files: UploadFile queryset, e.g. of a batch
+        @return: the files which are extracted by a job of their batch: not uploaded yet and without CellTest
+        """
+        return files.filter(~models.Q(status='SUCCESS') & models.Q(forget=False)) \
+            .exclude(celltest__isnull=False).order_by('id')
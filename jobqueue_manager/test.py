@@ -1,7 +1,37 @@
+import os
+import pickle
+import tempfile
+import threading
+from datetime import timedelta
+from types import SimpleNamespace
+
+import numpy as np
 import pandas as pd
-from pandas.testing import assert_frame_equal
+from pandas.testing import assert_frame_equal, assert_series_equal
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from abd_database.helpers.db import set_active_tenant
+from abd_database.helpers.figure_cache import get_data_version
+from abd_database.models import Battery, BatterySummary, BatteryType, CellTest, ChemicalType, CyclingRawData, Dataset, \
+    Supplier, UploadBatch, UploadFile
+from abd_management.models import Organisation, User
+from jobqueue_manager.abd_extractor.extractors.baseExtractor import parse_file
 from jobqueue_manager.abd_extractor.helpers.extractor_helper import close_cycle_gaps
+from jobqueue_manager.abd_extractor.helpers.metrics_helper import StageMetrics
+from jobqueue_manager.abd_extractor.helpers.parallel_helper import ordered_map
+from jobqueue_manager.abd_extractor.helpers.reader_helper import HeaderIndex
+from jobqueue_manager.abd_extractor.helpers.stream_helper import CycleBuffer
+from jobqueue_manager.abd_extractor.readers.base_reader import BaseReader
+from jobqueue_manager.abd_extractor.readers.csv_reader import CsvReader
+from jobqueue_manager.abd_extractor.readers.digatron_reader import DigatronReader
+from jobqueue_manager.manager import get_public_queue
+from jobqueue_manager.models import QueueJob
+from jobqueue_manager.test_helper import LocalFile, PreparedHdf5Extractor, generate_cycling_data, \
+    legacy_convert_step_name_to_step_flag, write_digatron_file
 
 
 class ExtractorHelperTests(TestCase):
@@ -49,3 +79,366 @@ class ExtractorHelperTests(TestCase):
 
         df = close_cycle_gaps(df, None)
         assert_frame_equal(df, df_correct)
+
+
+class ReaderTests(TestCase):
+    def test_step_flags_match_step_name_loop(self):
+        """
+        The vectorized convert_step_name_to_step_flag sets the same step flags as the former step name loop
+        """
+        rng = np.random.default_rng(0)
+        rows = 2000
+        df = pd.DataFrame({'step_name': rng.choice(['charge', 'discharge', 'OCV', 'CC_Chg', 'CC_Dchg', 'Rest'], rows),
+                           'current': rng.choice([0, 1.5, -1.5, 0.2], rows),
+                           'voltage': rng.choice([2.5, 3.0, 3.7, 4.2, 4.2001, np.nan], rows)})
+        expected = legacy_convert_step_name_to_step_flag(df)
+        reader = SimpleNamespace(cv_max_voltage=None, cv_min_voltage=None, data=df.copy())
+        BaseReader.convert_step_name_to_step_flag(reader)
+        assert_series_equal(reader.data['step_flag'], expected['step_flag'])
+        self.assertEqual(reader.cv_max_voltage, 4.2)
+        self.assertEqual(reader.cv_min_voltage, 2.5)
+
+    def test_remove_unwanted_status_lines(self):
+        """
+        The rows with the status in any text cell are removed, not only those with the status in the step name
+        """
+        reader = DigatronReader.__new__(DigatronReader)
+        reader.data = pd.DataFrame({'step_name': pd.Series(['PRG', 'CHA', 'CHA', 'DCH', None], dtype='string'),
+                                    'Program time': ['0:00:00', '0:00:01', '0:00:02', '0:00:03', '0:00:04'],
+                                    'comment': [None, 'STO by user', None, 1.5, 'Sto'],
+                                    'voltage': [3.6, 3.7, 3.8, 3.5, 3.4]})
+        reader.remove_unwanted_status_lines('prg')
+        reader.remove_unwanted_status_lines('sto')
+        self.assertEqual(reader.data['voltage'].tolist(), [3.8, 3.5])
+        self.assertEqual(reader.data.index.tolist(), [0, 1])
+
+    def test_header_index_finds_like_cell_search(self):
+        """
+        HeaderIndex.find returns the same coordinates as a cell by cell search of the header region
+        """
+        df = pd.DataFrame([['Version V 1.600.386', None, 1.5, 'Start of Test'],
+                           ['Chan001', np.nan, 'Step time', 'Ah'],
+                           ['[T1]', 'Voltage', 'chan001', 'A']])
+        index = HeaderIndex(df)
+        np.testing.assert_array_equal(index.find('version'), [[0, 0]])
+        np.testing.assert_array_equal(index.find('chan001'), [[1, 0], [2, 2]])
+        np.testing.assert_array_equal(index.find('a'), [[0, 3], [1, 0], [1, 3], [2, 1], [2, 2], [2, 3]])
+        np.testing.assert_array_equal(index.find('step time'), [[1, 2]])
+        self.assertEqual(index.find('current').shape, (0, 2))
+
+
+class StreamingTests(TestCase):
+    def test_cycle_buffer_matches_close_cycle_gaps(self):
+        """
+        CycleBuffer hands out complete cycles numbered like close_cycle_gaps on the whole file
+        """
+        cycle_id_list = [[3]*250, [7]*20, [12]*400, [13]*10, [100]*130]
+        cycle_id_list = [item for sublist in cycle_id_list for item in sublist]
+        df = pd.DataFrame({'cycle_id': cycle_id_list,
+                           'time': pd.date_range('2023-01-01', periods=len(cycle_id_list), freq='s')})
+        buffer = CycleBuffer()
+        parts = [buffer.push(df.iloc[start:start + 100].copy()) for start in range(0, len(df), 100)]
+        parts.append(buffer.flush())
+        for part in parts[:-1]:
+            self.assertTrue(part.empty or part['cycle_id'].iloc[-1] != parts[-1]['cycle_id'].iloc[0])
+        streamed = pd.concat(parts)
+        expected = close_cycle_gaps(df.copy(), None)
+        assert_frame_equal(streamed, expected)
+        self.assertEqual(buffer.get_nbr_of_cycles(), 5)
+
+    def test_streamed_step_flags_match_whole_file(self):
+        """
+        A streamed Digatron file gets the same step flags as the whole file, its CV limits are those of the whole file
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'digatron.xlsx')
+            write_digatron_file(path, 4, 30)
+            file = LocalFile(path)
+            reader = DigatronReader(file)
+            reader.get_data()
+            expected = reader.data['step_flag'].to_numpy()
+            reader = DigatronReader(file)
+            streamed = np.concatenate([chunk['step_flag'].to_numpy() for chunk in reader.get_chunks(100)])
+        np.testing.assert_array_equal(streamed, expected)
+        self.assertEqual(set(expected), {1, 2, 3, 4, 5})
+
+    def test_csv_chunks_with_unit_row(self):
+        """
+        A second header row (units) which fails the type cast is dropped chunk by chunk, the chunks are the data of the
+        whole file
+        """
+        df = generate_cycling_data(3, 40)
+        df['time'] = df['time'].dt.tz_localize(None)
+        df['time_in_step'] = 1.0
+        df['cell_temperature'] = 25.0
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'upload.csv')
+            units = ['[V]' if column == 'voltage' else '' for column in df.columns]
+            with open(path, 'w') as file:
+                file.write(','.join(df.columns) + '\n' + ','.join(units) + '\n')
+                df.to_csv(file, index=False, header=False)
+            reader = CsvReader(LocalFile(path))
+            reader.get_data()
+            expected = reader.data
+            reader = CsvReader(LocalFile(path))
+            streamed = pd.concat(reader.get_chunks(50), ignore_index=True)
+        assert_frame_equal(streamed, expected)
+        self.assertEqual(len(streamed), len(df))
+
+    def test_energy_calculation_in_chunks(self):
+        """
+        The cumulated energy of a Digatron file is the same if it is calculated in chunks
+        """
+        rng = np.random.default_rng(0)
+        capacity = rng.uniform(0, 2, 1000)
+        capacity[rng.random(1000) < 0.05] = 0
+        df = pd.DataFrame({'current': rng.choice([0, 1.5, -1.5], 1000),
+                           'capacity': capacity,
+                           'voltage': rng.uniform(3, 4.2, 1000)})
+        reader = DigatronReader.__new__(DigatronReader)
+        reader.last_capacity = reader.last_energy = None
+        reader.data = df.copy()
+        reader.energy_calculation()
+        expected = reader.data['energy'].to_numpy()
+
+        reader.last_capacity = reader.last_energy = None
+        energy = []
+        for start in range(0, len(df), 333):
+            reader.data = df.iloc[start:start + 333].reset_index(drop=True)
+            reader.energy_calculation()
+            energy.append(reader.data['energy'].to_numpy())
+        np.testing.assert_allclose(np.concatenate(energy), expected)
+
+
+class ParallelParsingTests(TestCase):
+    def test_parse_files_in_order(self):
+        """
+        The files parsed in processes are handed out in the order of the files, with the same data as parsed in this
+        process. The error of a file is returned in its place.
+        """
+        fields = (CyclingRawData.get_required_fields(None), CyclingRawData.get_additional_fields(None))
+        with tempfile.TemporaryDirectory() as directory:
+            tasks = []
+            for index in range(3):
+                df = generate_cycling_data(5 + index, 40, seed=index)
+                df['time'] = df['time'].dt.tz_localize(None)
+                path = os.path.join(directory, f'upload_{index}.csv')
+                df.to_csv(path, index=False)
+                tasks.append((CsvReader, LocalFile(path), *fields))
+            tasks.insert(1, (CsvReader, LocalFile(os.path.join(directory, 'missing.csv')), *fields))
+
+            inline = list(ordered_map(parse_file, tasks, processes=1))
+            parallel = list(ordered_map(parse_file, tasks, processes=2, ahead=2))
+        for (expected, expected_error), (parsed, error) in zip(inline, parallel):
+            self.assertIs(type(error), type(expected_error))
+            if expected is not None:
+                assert_frame_equal(parsed['data'], expected['data'])
+                self.assertNotIn('parser', parsed)
+        self.assertIsInstance(parallel[1][1], FileNotFoundError)
+        self.assertEqual([parsed['data']['cycle_id'].max() for parsed, error in parallel if error is None], [5, 6, 7])
+
+    def test_one_file_parsed_ahead(self):
+        """
+        With one process the next file is parsed while the current one is saved, but not the files after it
+        """
+        started = []
+        next_started = threading.Event()
+
+        def start(index):
+            started.append(index)
+            if index == 1:
+                next_started.set()
+
+        results = ordered_map(start, [(index,) for index in range(5)], processes=1, ahead=1)
+        next(results)
+        # the task after the next one is only submitted when the next result is taken
+        self.assertTrue(next_started.wait(timeout=10))
+        self.assertEqual(started, [0, 1])
+        results.close()
+
+
+class MetricsTests(TestCase):
+    def test_stage_metrics(self):
+        """
+        The stages of a parsed file are measured with their rows, the database round trips of a stage are counted
+        """
+        fields = (CyclingRawData.get_required_fields(None), CyclingRawData.get_additional_fields(None))
+        with tempfile.TemporaryDirectory() as directory:
+            df = generate_cycling_data(5, 40)
+            df['time'] = df['time'].dt.tz_localize(None)
+            path = os.path.join(directory, 'upload.csv')
+            df.to_csv(path, index=False)
+            parsed = parse_file(CsvReader, LocalFile(path), *fields)
+        stages = parsed['metrics'].to_json()
+        for stage in ('get_data', 'check_headers', 'remove_nan', 'close_cycle_gaps'):
+            self.assertEqual(stages[stage]['calls'], 1)
+            self.assertEqual(stages[stage]['rows'], len(df))
+            self.assertGreaterEqual(stages[stage]['wall'], 0)
+
+        # a file which fails keeps the metrics of its stages until the error, also when it is parsed in a process
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'upload.csv')
+            df.drop(columns='energy').to_csv(path, index=False)
+            with self.assertRaises(AttributeError) as context:
+                parse_file(CsvReader, LocalFile(path), *fields)
+        error = pickle.loads(pickle.dumps(context.exception))
+        self.assertEqual(error.metrics.to_json()['get_data']['rows'], len(df))
+
+        metrics = StageMetrics()
+        for count in range(2):
+            with metrics.measure('count_files'):
+                UploadFile.objects.count()
+        self.assertEqual(metrics.to_json()['count_files']['calls'], 2)
+        self.assertEqual(metrics.to_json()['count_files']['queries'], 2)
+
+
+class Hdf5ExtractorTests(TestCase):
+    def test_upload_refreshes_summaries(self):
+        """
+        An HDF5 upload stores the summaries of its cycling test and of its battery in the transaction of the file
+        """
+        organisation = Organisation.objects.create(name="Hdf5Org")
+        user = User.objects.create_user(username="Hdf5User", password="12345", company=organisation)
+        set_active_tenant(organisation.id)
+        battery_type = BatteryType.objects.create(supplier=Supplier.objects.all().first(), theoretical_capacity=2.4,
+                                                  chemical_type_cathode=ChemicalType.objects.all().first(),
+                                                  content_type=ContentType.objects.get(model='prismaformat'),
+                                                  object_id=1)
+        battery = Battery.objects.create(owner=organisation, battery_type=battery_type, weight=100, vmax=4.2,
+                                         vnom=3.7, vmin=3.0, prod_year=2016, private=True)
+        dataset = Dataset.objects.create(name="Hdf5Dataset", owner=organisation, private=True)
+        batch = UploadBatch.objects.create(user=user)
+
+        total_cycles = 0
+        versions = []
+        for nbr_of_cycles in (3, 4):
+            upload = UploadFile.objects.create(batch=batch, file=f'uploadfiles/upload_{nbr_of_cycles}.h5', kb=1,
+                                               time=timezone.now(), checksum=str(nbr_of_cycles) * 32)
+            data = {'CellTest0': {'data': pd.DataFrame({'date': ['2023-01-01']}),
+                                  'CyclingRawData': {'data': generate_cycling_data(nbr_of_cycles, 40)},
+                                  'ErrorCodes': {'data': pd.DataFrame()}}}
+            PreparedHdf5Extractor([upload], data, battery, dataset)
+            upload.refresh_from_db()
+            self.assertEqual(upload.status, UploadFile.StatusCodes.SUCCESSFUL, upload.error_details)
+
+            total_cycles += nbr_of_cycles
+            summary = BatterySummary.objects.get(battery=battery)
+            self.assertEqual(summary.nbr_of_cycles, total_cycles)
+            versions.append(get_data_version([battery.pk]))
+        self.assertEqual(summary.nbr_of_tests, 2)
+        # the cached figures of the battery are not served after the second upload
+        self.assertIsNotNone(versions[0])
+        self.assertNotEqual(versions[0], versions[1])
+        # the raw data is saved once
+        self.assertEqual(CyclingRawData.objects.filter(agg_data__cycling_test__cellTest__battery=battery).count(),
+                         total_cycles * 40)
+
+
+class QueueJobTests(TestCase):
+    def setUp(self):
+        organisation = Organisation.objects.create(name="QueueOrg")
+        self.user = User.objects.create_user(username="QueueUser", password="12345", company=organisation)
+        self.batch = UploadBatch.objects.create(user=self.user)
+
+    def create_job(self, priority):
+        return QueueJob.objects.create(batch=self.batch, user=self.user, priority=priority)
+
+    def test_claim_by_priority(self):
+        """
+        claim returns the queued jobs by priority and upload order and marks them as running
+        """
+        standard = self.create_job(2)
+        admin = self.create_job(0)
+        later_admin = self.create_job(0)
+        self.assertEqual(QueueJob.objects.claim("worker").pk, admin.pk)
+        self.assertEqual(QueueJob.objects.claim("worker").pk, later_admin.pk)
+        claimed = QueueJob.objects.claim("worker")
+        self.assertEqual(claimed.pk, standard.pk)
+        self.assertEqual(claimed.status, QueueJob.StatusCodes.RUNNING)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertIsNone(QueueJob.objects.claim("worker"))
+
+    def test_requeue_expired(self):
+        """
+        running jobs without heartbeat are given back to the queue and fail after max_attempts lost workers
+        """
+        self.create_job(0)
+        job = QueueJob.objects.claim("lost worker")
+        QueueJob.objects.filter(pk=job.pk).update(heartbeat=timezone.now() - timedelta(seconds=600))
+        self.assertEqual(QueueJob.objects.requeue_expired(lease_timeout=300, max_attempts=2), 1)
+        self.assertEqual(QueueJob.objects.claim("worker").pk, job.pk)
+
+        QueueJob.objects.filter(pk=job.pk).update(heartbeat=timezone.now() - timedelta(seconds=600))
+        self.assertEqual(QueueJob.objects.requeue_expired(lease_timeout=300, max_attempts=2), 0)
+        self.assertEqual(QueueJob.objects.get(pk=job.pk).status, QueueJob.StatusCodes.FAILED)
+
+    def test_finish(self):
+        """
+        successful jobs are removed, failed jobs are kept and a worker can not finish a job it does not own
+        """
+        self.create_job(0)
+        self.create_job(0)
+        done = QueueJob.objects.claim("worker")
+        failed = QueueJob.objects.claim("worker")
+        QueueJob.objects.finish(done.pk, "other worker")
+        self.assertTrue(QueueJob.objects.filter(pk=done.pk).exists())
+        QueueJob.objects.finish(done.pk, "worker")
+        self.assertFalse(QueueJob.objects.filter(pk=done.pk).exists())
+        QueueJob.objects.finish(failed.pk, "worker", "error")
+        self.assertEqual(QueueJob.objects.get(pk=failed.pk).status, QueueJob.StatusCodes.FAILED)
+
+    def test_public_queue_queries(self):
+        """
+        the public queue reads the files of all jobs in one query
+        """
+        def create_file(batch, name, kb):
+            return UploadFile.objects.create(batch=batch, file=f'uploadfiles/{name}', kb=kb, time=timezone.now(),
+                                             checksum=name[0] * 32)
+
+        create_file(self.batch, 'first.csv', 1)
+        create_file(self.batch, 'second.csv', 1)
+        self.create_job(0)
+        other_batch = UploadBatch.objects.create(user=self.user)
+        target = create_file(other_batch, 'target.csv', 2)
+        create_file(other_batch, 'other.csv', 3)
+        QueueJob.objects.create(batch=other_batch, user=self.user, priority=1, target_file=target)
+        with CaptureQueriesContext(connection) as queries:
+            public_queue = get_public_queue()
+        self.assertEqual(sum('FROM "abd_database_uploadfile"' in query['sql'] for query in queries), 1)
+        self.assertEqual([[file.kb for file in batch.files] for batch in public_queue.batches], [[1, 1], [2]])
+
+    def test_find_duplicates(self):
+        """
+        the files of a new batch are compared with the successful uploads and the queued files in one query
+        """
+        def create_file(batch, name, checksum, status=UploadFile.StatusCodes.INITIAL):
+            return UploadFile.objects.create(batch=batch, file=f'uploadfiles/{name}', kb=1, time=timezone.now(),
+                                             checksum=checksum * 32, status=status)
+
+        uploaded = create_file(UploadBatch.objects.create(user=self.user), 'uploaded.csv', 'a',
+                               UploadFile.StatusCodes.SUCCESSFUL)
+        create_file(self.batch, 'queued.csv', 'b')
+        # extracted before, the job of its batch skips the file
+        extracted = create_file(self.batch, 'extracted.csv', 'd')
+        self.create_job(0)
+        create_file(UploadBatch.objects.create(user=self.user), 'not_queued.csv', 'c')
+
+        organisation = self.user.company
+        set_active_tenant(organisation.id)
+        battery_type = BatteryType.objects.create(supplier=Supplier.objects.all().first(), theoretical_capacity=2.4,
+                                                  chemical_type_cathode=ChemicalType.objects.all().first(),
+                                                  content_type=ContentType.objects.get(model='prismaformat'),
+                                                  object_id=1)
+        battery = Battery.objects.create(owner=organisation, battery_type=battery_type, weight=100, vmax=4.2,
+                                         vnom=3.7, vmin=3.0, prod_year=2016, private=True)
+        dataset = Dataset.objects.create(name="DuplicateDataset", owner=organisation, private=True)
+        CellTest.objects.create(battery=battery, file=extracted, date=timezone.now().date(), dataset=dataset)
+
+        new_batch = UploadBatch.objects.create(user=self.user)
+        files = [create_file(new_batch, f'new_{checksum}.csv', checksum) for checksum in 'abcd']
+        with self.assertNumQueries(1):
+            in_db, in_queue = new_batch.find_duplicates()
+        self.assertEqual(in_db, [(files[0].pk, [uploaded.pk])])
+        self.assertEqual(in_queue, [(files[1].pk, ['uploadfiles/queued.csv'])])
+        self.assertEqual(files[1].get_duplicates_in_queue(), ['uploadfiles/queued.csv'])
+        self.assertEqual(files[3].get_duplicates_in_queue(), [])
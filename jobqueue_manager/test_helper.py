@@ -0,0 +1,153 @@
+import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from jobqueue_manager.abd_extractor.extractors.baseExtractor import BaseExtractor
+from jobqueue_manager.abd_extractor.extractors.hdf5_extractor import Hdf5Extractor
+
+
+def generate_cycling_data(nbr_of_cycles, rows_per_cycle, seed=0):
+    """
+    Generates synthetic cleaned cycling raw data: every cycle is an OCV, cc-charge, cv-charge and cc-discharge part.
+    """
+    rng = np.random.default_rng(seed)
+    rows = nbr_of_cycles * rows_per_cycle
+    part = rows_per_cycle // 4
+    flags_per_cycle = np.repeat([1, 2, 3, 4], [rows_per_cycle - 3 * part, part, part, part])
+    step_flag = np.tile(flags_per_cycle, nbr_of_cycles)
+    current = np.select([step_flag == 2, step_flag == 3, step_flag == 4], [2.5, 1.0, -2.5], default=0.0)
+    current = current + rng.normal(0, 0.01, rows)
+    return pd.DataFrame({'cycle_id': np.repeat(np.arange(1, nbr_of_cycles + 1), rows_per_cycle),
+                         'step_flag': step_flag,
+                         'current': current,
+                         'voltage': rng.uniform(2.5, 4.2, rows),
+                         'capacity': np.abs(rng.normal(2.4, 0.1, rows)),
+                         'energy': rng.uniform(0, 10, rows),
+                         'ambient_temperature': rng.normal(25, 0.5, rows),
+                         'time': pd.date_range('2023-01-01', periods=rows, freq='s', tz='Europe/Zurich')})
+
+
+def legacy_convert_step_name_to_step_flag(data):
+    """Step name loop as used by BaseReader.convert_step_name_to_step_flag before classify_steps"""
+    data = data.copy()
+    data['step_flag'] = 99
+    while 1:
+        charge = False
+        discharge = False
+        if 'charge' in data['step_name'].unique():
+            dfy = data[data['step_name'] == 'charge'].filter(['current', 'voltage']).reset_index()
+            charge = True
+            data = data.replace('charge', 'done')
+        elif 'discharge' in data['step_name'].unique():
+            dfy = data[data['step_name'] == 'discharge'].filter(['current', 'voltage']).reset_index()
+            discharge = True
+            data = data.replace('discharge', 'done')
+        elif 'OCV' in data['step_name'].unique():
+            data.loc[data.step_name == 'OCV', 'step_flag'] = 1
+            data = data.replace('OCV', 'done')
+        elif 'CC_Chg' in data['step_name'].unique():
+            data.loc[data.step_name == 'CC_Chg', 'step_flag'] = 2
+            data = data.replace('CC_Chg', 'done')
+        elif 'CC_Dchg' in data['step_name'].unique():
+            data.loc[data.step_name == 'CC_Dchg', 'step_flag'] = 4
+            data = data.replace('CC_Dchg', 'done')
+        else:
+            break
+        if charge:
+            cv_max_value = dfy['voltage'].round(2).max()
+            dfy.loc[dfy.voltage.round(2) == cv_max_value, 'step_name'] = 3
+            dfy.loc[dfy.voltage.round(2) < cv_max_value, 'step_name'] = 2
+        if discharge:
+            cv_min_value = dfy['voltage'].round(2).min()
+            dfy.loc[dfy.current < 0, 'step_name'] = 4
+            dfy.loc[dfy.voltage.round(2) == cv_min_value, 'step_name'] = 5
+        if charge or discharge:
+            dfy.loc[dfy.current == 0, 'step_name'] = 1
+            for elements in range(0, len(dfy)):
+                index = dfy['index'].iloc[elements]
+                data.loc[index, 'step_flag'] = dfy['step_name'].iloc[elements]
+    data = data.dropna(subset=['step_flag']).reset_index(drop=True)
+    data['step_flag'] = data['step_flag'].astype('int32')
+    return data
+
+
+def write_digatron_file(path, nbr_of_cycles, rows_per_step, seed=0):
+    """
+    Writes a synthetic Digatron export (.xlsx) with the metadata, header and unit rows the DigatronReader expects.
+    Every cycle is a pause, a CC-CV charge and a CC-CV discharge with PRG and switching rows in between. The CV
+    voltages of the later cycles are beyond those of the first ones, so the CV limits depend on the whole file.
+    """
+    rng = np.random.default_rng(seed)
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['Digatron Export'])
+    sheet.append(['Version V 1.600.386'])
+    sheet.append(['Start of Test', datetime.date(2023, 1, 1), datetime.time(8, 0, 0)])
+    sheet.append(['Program time', 'Step time', 'Status', 'Cycle', 'Current', 'Voltage', 'AhAccu', 'Chan001'])
+    sheet.append(['[h:m:s]', '[h:m:s]', None, None, '[A]', '[V]', '[Ah]', '[T1]'])
+
+    second = 0
+    for cycle in range(1, nbr_of_cycles + 1):
+        charge_voltage = 4.1 if cycle <= nbr_of_cycles // 2 else 4.2
+        discharge_voltage = 2.6 if cycle <= nbr_of_cycles // 2 else 2.5
+        steps = [('PAU', np.zeros(rows_per_step), np.full(rows_per_step, 3.6)),
+                 ('CHA', np.full(rows_per_step, 1.5), np.linspace(3.6, charge_voltage, rows_per_step)),
+                 ('CHA', np.linspace(1.5, 0.1, rows_per_step), np.full(rows_per_step, charge_voltage)),
+                 ('DCH', np.full(rows_per_step, -1.5), np.linspace(4.0, discharge_voltage, rows_per_step)),
+                 ('DCH', np.linspace(-1.5, -0.1, rows_per_step), np.full(rows_per_step, discharge_voltage))]
+        for status, currents, voltages in steps:
+            sheet.append([_program_time(second), datetime.time(0, 0, 0), 'PRG', cycle, 0, voltages[0], None, 25])
+            capacity = 0.0
+            for step_second, (current, voltage) in enumerate(zip(currents, voltages)):
+                second += 1
+                capacity += abs(current) / 3600
+                sheet.append([_program_time(second), datetime.time(0, step_second // 60, step_second % 60), status,
+                              cycle, float(current), float(voltage + rng.normal(0, 0.0005)), capacity,
+                              float(rng.normal(25, 0.5))])
+    workbook.save(path)
+
+
+def _program_time(second):
+    return f'{second // 3600}:{second // 60 % 60:02d}:{second % 60:02d}'
+
+
+class PreparedHdf5Extractor(Hdf5Extractor):
+    """
+    Hdf5Extractor of a file which is already read and cleaned (data as Hdf5Reader.data), the battery and dataset of
+    the file exist already. Runs the extraction of the file from its status changes to the saving like an upload.
+    """
+
+    def __init__(self, files, data, battery, dataset):
+        self.owner = dataset.owner
+        self.battery_types = []
+        self.batteries = []
+        self.datasets = []
+        self.prepared = battery, dataset
+        self.readers = [SimpleNamespace(data=data, battery=None, dataset=None,
+                                        get_data=lambda: None)]
+        BaseExtractor.__init__(self, files)
+
+    def clean_data(self, index):
+        pass
+
+    def save_battery_type(self, clean_df_battery):
+        return self.prepared[0].battery_type
+
+    def save_battery(self, df_battery, saved_battery_type, year):
+        return self.prepared[0]
+
+    def save_dataset(self, df_dataset, owner):
+        return self.prepared[1]
+
+
+class LocalFile:
+    """Stands in for the UploadFile of a file on disk, e.g. a synthetic upload, it is pickled for the parse processes"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_path(self):
+        return self.path
@@ -0,0 +1,132 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import traceback
+
+import django
+from django.db import connection, DatabaseError
+
+import queue_settings
+
+logger = logging.getLogger(__name__)
+
+# set in the worker processes, they must not start another pool
+WORKER_ENV = 'ABD_EXTRACTOR_WORKER'
+
+
+def is_worker_process():
+    return os.environ.get(WORKER_ENV) == '1'
+
+
+def init_worker():
+    os.environ[WORKER_ENV] = '1'
+    # Ctrl+C and a service stop reach the whole process group, the pool stops its workers after the running job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    django.setup()
+
+
+def get_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class Heartbeat(threading.Thread):
+    """Renews the lease of the running job until it is stopped"""
+
+    def __init__(self, job_id, worker, interval):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.worker = worker
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        from jobqueue_manager.models import QueueJob
+        try:
+            while not self.stopped.wait(self.interval):
+                if not QueueJob.objects.beat(self.job_id, self.worker):
+                    logger.warning(f"Lost the lease of job {self.job_id}")
+                    return
+        finally:
+            # the thread has its own connection
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job, worker):
+    """
+    Extracts the batch of a claimed job and removes the job from the queue, or marks it as failed
+    """
+    from jobqueue_manager.manager import extract_batch
+    from jobqueue_manager.models import QueueJob
+    heartbeat = Heartbeat(job.pk, worker, queue_settings.heartbeat_interval)
+    heartbeat.start()
+    error_details = None
+    try:
+        extract_batch(job)
+    except Exception:
+        error_details = traceback.format_exc()
+        logger.error(f"Extraction of batch {job.batch_id} failed: \n{error_details}")
+    finally:
+        heartbeat.stop()
+    QueueJob.objects.finish(job.pk, worker, error_details)
+
+
+def work(stop_event):
+    """
+    Main loop of a worker process: claims and extracts jobs until the stop_event is set.
+    A running job is always finished before stopping.
+    """
+    init_worker()
+    from jobqueue_manager.models import QueueJob
+    worker = get_worker_name()
+    parent = os.getppid()
+    logger.info(f"Extractor worker {worker} started")
+    # also stop if the pool process is gone without a shutdown
+    while not stop_event.is_set() and os.getppid() == parent:
+        try:
+            QueueJob.objects.requeue_expired(queue_settings.lease_timeout, queue_settings.max_attempts)
+            job = QueueJob.objects.claim(worker)
+        except DatabaseError as e:
+            logger.error(f"Could not claim a job: \n{e}")
+            connection.close()
+            job = None
+        if job is None:
+            stop_event.wait(queue_settings.poll_interval)
+            continue
+        run_job(job, worker)
+    logger.info(f"Extractor worker {worker} stopped")
+
+
+class ExtractorPool:
+    """
+    Extractor processes which consume the queue table.
+    Every process claims its jobs on its own, so pools of several hosts or web processes can share the queue.
+    """
+
+    def __init__(self, nbr_of_workers):
+        self.nbr_of_workers = nbr_of_workers
+        context = multiprocessing.get_context('spawn')
+        self.stop_event = context.Event()
+        self.processes = [context.Process(target=work, args=(self.stop_event,), name=f'extractor-{index}')
+                          for index in range(nbr_of_workers)]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def join(self):
+        for process in self.processes:
+            process.join()
+
+    def shutdown(self, wait=True):
+        """Stops claiming new jobs, running jobs are finished if wait is set"""
+        self.stop_event.set()
+        if wait:
+            self.join()
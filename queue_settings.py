@@ -1,8 +1,24 @@
+import os
+
 from django.conf import settings
 
 if settings.DEBUG:
     max_queue_size = 12e6  # 12'000'000kb -> 12gb
     max_batch_size = 5e6  # 5'000'000kb -> 5gb
+    embedded_workers = True  # start the extractor processes with the development server
 else:
     max_queue_size = 4.5e6  # 4'500'000kb -> 4.5gb
     max_batch_size = 9.8e5  # 980'000kb -> 980mb
+    embedded_workers = False  # the queue is consumed by manage.py run_extractor_worker
+
+nbr_of_workers = 2  # extractor processes, batches of the same battery are never extracted in parallel
+poll_interval = 2  # seconds an idle worker waits before it looks for new jobs
+heartbeat_interval = 30  # seconds between two lease renewals of a running job
+lease_timeout = 300  # seconds without heartbeat after which a running job is given to another worker
+max_attempts = 3  # a job is set to failed after it lost this many workers
+# files of a batch which are parsed ahead of the file which is saved, a worker holds up to parse_ahead + 1 parsed
+# files in memory (two with the default)
+parse_ahead = 1
+# processes per extractor worker which parse the files of a batch in parallel, at most parse_ahead of them are used
+# (1 parses the files in a thread of the worker)
+parse_processes = max((os.cpu_count() or 1) // nbr_of_workers, 1)